@@ -14,9 +14,8 @@ SMTP_PASSWORD=your_email_auth_code
 SENDER_NAME=价值分析系统
 
 
-CONCURRENT_LIMIT=2  # 降低并发数减少网络压力
-FETCH_DELAY_MIN=10.0  # 增加最小延迟
-FETCH_DELAY_MAX=40.0  # 增加最大延迟
+# 上游请求节奏由按主机的自适应限速器控制（UPSTREAM_RATE_*、ANALYSIS_*_WORKERS），
+# CONCURRENT_LIMIT / FETCH_DELAY_MIN / FETCH_DELAY_MAX 已移除
 
 # 网络相关配置
 NETWORK_RETRY_COUNT=5
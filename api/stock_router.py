@@ -70,6 +70,17 @@ async def fetch_all_market_data(force: bool = False):
     """手动触发：抓取全市场 5000+ 股票实时行情"""
     return await stock_service.fetch_daily_market_data(force=force)
 
+@router.post("/data/fetch/intraday")
+async def fetch_intraday_market_data(force: bool = False):
+    """手动触发：盘中快照轮询（只写入变化的股票），force=True 时忽略交易时段限制"""
+    return await stock_service.fetch_intraday_snapshot(force=force)
+
+@router.get("/data/intraday/polls")
+def get_intraday_polls(limit: int = 50):
+    """查看最近盘中轮询的总行数与变化行数"""
+    polls = list(stock_service.intraday_polls)[-limit:]
+    return {"count": len(polls), "polls": polls}
+
 @router.post("/data/fetch/history/{stock_code}")
 async def fetch_individual_history(stock_code: str):
     """手动同步特定股票的历史K线数据(用于计算波动率)"""
@@ -92,6 +103,19 @@ async def analyze_all_watched(background_tasks: BackgroundTasks):
     background_tasks.add_task(stock_service.analyze_all_watched_stocks)
     return {"status": "success", "message": "全量分析任务已在后台排队"}
 
+@router.post("/analyze/universe")
+async def analyze_universe(persist: bool = False, top: int = 20):
+    """
+    向量化批量评分：对最新快照中的全部股票评分（财务数据沿用最近一次分析结果），返回前 top 名
+    persist=true 时只保存有财务数据的股票，其余股票的 ROE/增速按 0 计分，不写入分析结果
+    """
+    frame = await stock_service.score_stocks(persist=persist)
+    if frame.empty:
+        raise HTTPException(status_code=404, detail="尚无行情数据")
+    columns = ["stock_code", "stock_name", "total_score", "suggestion", "volatility_30d", "dividend_yield", "roe"]
+    best = frame.nlargest(top, "total_score")[columns]
+    return {"count": len(frame), "top": best.astype(object).where(best.notna(), None).to_dict("records")}
+
 @router.post("/analyze/stock/{stock_code}")
 async def analyze_single_stock(stock_code: str, db: Session = Depends(get_db)):
     """立即分析单只股票并返回结果"""
@@ -194,6 +218,16 @@ def get_system_status(db: Session = Depends(get_db)):
         }
     }
 
+@router.get("/system/sources")
+def get_source_stats():
+    """查看快照数据源的延迟(p95)、胜率与失败次数"""
+    return {"sources": stock_service.source_stats.snapshot()}
+
+@router.get("/system/rate-limits")
+def get_rate_limits():
+    """查看各上游主机的自适应限速状态：当前速率(次/秒)、近期错误率、请求与限流次数"""
+    return {"hosts": stock_service.rate_controller.snapshot()}
+
 @router.get("/diagnose/{stock_code}")
 async def diagnose_stock_issues(stock_code: str, db: Session = Depends(get_db)):
     """诊断特定股票的数据问题"""
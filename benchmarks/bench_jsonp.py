@@ -0,0 +1,124 @@
+"""
+JSONP 解码微基准 - 对比旧实现(正则 + json.loads + 文本拷贝)与 services.jsonp
+
+用法:
+    python benchmarks/bench_jsonp.py            # 使用 benchmarks/payloads 下的录制数据
+    python benchmarks/bench_jsonp.py --record   # 先从东财 clist/get 录制 100/500/5000 条的响应
+
+未录制时按东财字段结构生成同等规模的载荷，便于离线对比
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import timeit
+import argparse
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import jsonp
+from services.jsonp import decode_jsonp, diff_to_frame
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+SIZES = [100, 500, 5000]
+
+
+def payload_path(size: int) -> str:
+    return os.path.join(PAYLOAD_DIR, f"clist_{size}.jsonp")
+
+
+def synthesize_payload(size: int) -> bytes:
+    """按 clist/get (fltt=2) 的字段结构生成载荷，数值与 '-' 哨兵混合"""
+    rng = random.Random(size)
+    rows = []
+    for i in range(size):
+        price = round(rng.uniform(2, 200), 2)
+        rows.append({
+            "f1": 2, "f2": price, "f3": round(rng.uniform(-10, 10), 2), "f4": round(rng.uniform(-2, 2), 2),
+            "f5": rng.randint(0, 5_000_000), "f6": round(rng.uniform(0, 5e9), 2),
+            "f7": round(rng.uniform(0, 15), 2), "f8": round(rng.uniform(0, 30), 2),
+            "f9": rng.choice([round(rng.uniform(-500, 500), 2), "-"]), "f10": round(rng.uniform(0, 5), 2),
+            "f11": round(rng.uniform(-2, 2), 2), "f12": f"{600000 + i:06d}", "f13": 1, "f14": f"股票{i}",
+            "f15": price, "f16": price, "f17": price, "f18": price,
+            "f20": round(rng.uniform(1e9, 1e12), 2), "f21": round(rng.uniform(1e9, 1e12), 2),
+            "f22": round(rng.uniform(-1, 1), 2), "f23": rng.choice([round(rng.uniform(0, 20), 2), "-"]),
+            "f24": 0.0, "f25": 0.0, "f62": 0.0, "f115": "-", "f128": "-", "f136": "-", "f148": 1, "f152": 2,
+        })
+    body = json.dumps({"rc": 0, "data": {"total": size, "diff": rows}}, ensure_ascii=False)
+    return f"jQuery341015241163678647807_{int(time.time() * 1000)}({body});".encode("utf-8")
+
+
+def record_payloads():
+    """从东财录制真实响应（需要网络）"""
+    from services.stock_service import stock_service
+
+    os.makedirs(PAYLOAD_DIR, exist_ok=True)
+    session = stock_service._make_em_session()
+    try:
+        for size in SIZES:
+            _ts = int(time.time() * 1000)
+            params = {
+                "cb": f"jQuery341015241163678647807_{_ts}", "pn": "1", "np": "1",
+                "ut": stock_service.target_ut, "fltt": "2", "invt": "2",
+                "fs": stock_service.EM_CLIST_FS, "fields": stock_service.EM_CLIST_FIELDS,
+                "wbp2u": "|0|0|0|web", "fid": "f3", "po": "1", "pz": str(size), "_": str(_ts),
+            }
+            response = session.get(stock_service.EM_CLIST_URL, params=params,
+                                   headers=stock_service.EM_CLIST_HEADERS, timeout=30, verify=False)
+            with open(payload_path(size), "wb") as f:
+                f.write(jsonp.response_bytes(response))
+            print(f"   ✅ 已录制 {size} 条 -> {payload_path(size)}")
+            time.sleep(3)
+    finally:
+        session.close()
+
+
+def load_payload(size: int):
+    if os.path.exists(payload_path(size)):
+        with open(payload_path(size), "rb") as f:
+            return f.read(), "录制"
+    return synthesize_payload(size), "生成"
+
+
+def legacy_decode(payload: bytes) -> pd.DataFrame:
+    """旧实现：解码为文本 -> 正则提取 -> json.loads -> DataFrame"""
+    raw_text = payload.decode("utf-8")
+    json_match = re.search(r'jQuery.*?\((.*)\)', raw_text)
+    res_json = json.loads(json_match.group(1))
+    return pd.DataFrame(res_json["data"]["diff"])
+
+
+def new_decode(payload: bytes) -> pd.DataFrame:
+    return diff_to_frame(decode_jsonp(payload)["data"]["diff"])
+
+
+def bench(func, payload, number):
+    return min(timeit.repeat(lambda: func(payload), number=number, repeat=5)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONP 解码微基准")
+    parser.add_argument("--record", action="store_true", help="先录制真实响应")
+    args = parser.parse_args()
+
+    if args.record:
+        record_payloads()
+
+    print(f"\norjson: {'已安装' if jsonp.orjson is not None else '未安装(使用标准库 json)'}")
+    print(f"{'条数':>6s} {'来源':>4s} {'大小KB':>8s} {'旧实现ms':>10s} {'新实现ms':>10s} {'加速':>6s}")
+    for size in SIZES:
+        payload, source = load_payload(size)
+        assert legacy_decode(payload).equals(new_decode(payload))
+        number = max(1, 2000 // size)
+        old_ms = bench(legacy_decode, payload, number)
+        new_ms = bench(new_decode, payload, number)
+        print(f"{size:6d} {source:>4s} {len(payload) / 1024:8.1f} {old_ms:10.3f} {new_ms:10.3f} {old_ms / new_ms:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -30,12 +30,9 @@ class Settings(BaseSettings):
     MIN_VALID_FINANCIAL_DATA: float = 0.1
     CACHE_ENABLED: bool = True
     CACHE_TTL_SECONDS: int = 7200          # 增加缓存时间到2小时
-    CONCURRENT_LIMIT: int = 2              # 保持并发数2
     QUALITY_THRESHOLD: float = 0.7
     
-    # 抓取延迟配置
-    FETCH_DELAY_MIN: float = 3.0           # 减少最小延迟
-    FETCH_DELAY_MAX: float = 20.0          # 减少最大延迟
+    # 批处理配置（请求节奏见下方 UPSTREAM_RATE_*）
     BATCH_SIZE: int = 10                   # 增加批处理大小
     PRIORITY_FIRST: bool = True
     
@@ -43,6 +40,63 @@ class Settings(BaseSettings):
     NETWORK_RETRY_BACKOFF: float = 1.5     # 重试退避因子
     MAX_NETWORK_ERRORS: int = 10           # 最大连续网络错误数
     ADAPTIVE_DELAY_MULTIPLIER: float = 2.0 # 自适应延迟倍数
+    
+    # 东财快照分页抓取配置（直连 clist/get 接口）
+    EM_PAGE_CONCURRENCY: int = 4           # 同时在途的分页请求数
+    EM_PAGE_RATE_LIMIT: float = 1.0        # 分页请求速率上限(次/秒)，决定整体耗时
+    EM_PAGE_RETRY: int = 3                 # 单页最大尝试次数
+    EM_MAX_PAGE_FAILURES: int = 5          # 连续失败页数达到该值时中止抓取
+    SNAPSHOT_CHECKPOINT_DIR: str = "cache/snapshot_checkpoints"  # 分页检查点目录，重跑时只补抓缺失页
+    SNAPSHOT_APPEND_HISTORY: bool = True   # 快照入库后把当日K线追加到 historical_data
+    
+    # 快照数据源对冲竞速（akshare 与东财直连）
+    # 对冲模式下东财直连结果需整表收集后才能判定胜负，不走逐页流式入库；默认关闭
+    SNAPSHOT_HEDGE_ENABLED: bool = False   # 主数据源超时未返回时并行启动备用数据源
+    SNAPSHOT_HEDGE_DELAY: float = 0        # 固定对冲延迟(秒)，0 表示按主数据源 p95 延迟自动计算
+    SNAPSHOT_HEDGE_DELAY_DEFAULT: float = 30.0  # 延迟样本不足时的对冲延迟(秒)
+    SNAPSHOT_HEDGE_DELAY_MIN: float = 5.0
+    SNAPSHOT_HEDGE_DELAY_MAX: float = 120.0
+    SNAPSHOT_MIN_COVERAGE: float = 0.98    # 东财直连结果行数达到首页 total 的该比例才算完整
+    
+    # 盘中快照轮询（只写入变化的股票到 intraday_market_data）
+    INTRADAY_ENABLED: bool = False         # 是否在交易时段定时轮询
+    INTRADAY_POLL_MINUTES: int = 5         # 轮询间隔(分钟)
+    
+    # 交易日历（akshare 交易日列表的本地缓存）
+    TRADING_CALENDAR_PATH: str = "cache/trading_calendar.json"
+    TRADING_CALENDAR_MAX_AGE_DAYS: int = 30  # 缓存超过该天数后重新拉取
+    
+    # 日K线同步配置
+    KLINE_INCREMENTAL: bool = True         # 只请求最后一根已存K线之后的数据（不复权K线 + 复权因子）
+    KLINE_FULL_BARS: int = 120             # 全量抓取的K线根数
+    KLINE_MIN_BARS: int = 100              # 已存K线少于该值时做全量抓取
+    KLINE_BATCH_SIZE: int = 5000           # K线批量写入每批行数(executemany)
+    KLINE_BATCH_CHUNK: int = 50            # 批量K线接口每次 efinance 多代码调用的股票数
+    KLINE_BATCH_CONCURRENCY: int = 4       # 批量K线回退到东财接口时的并发请求数
+    PRICE_STORE_ENABLED: bool = True       # 分析时从本地内存映射价格库读取K线
+    PRICE_STORE_DIR: str = "cache/price_store"  # 价格库目录，每只股票一个 .npy 文件
+    
+    # 上游自适应限速（按主机 AIMD：成功加性增、限流/断连/超时乘性减）
+    UPSTREAM_RATE_INITIAL: float = 1.0     # 每个主机的初始速率(次/秒)
+    UPSTREAM_RATE_MIN: float = 0.1
+    UPSTREAM_RATE_MAX: float = 5.0
+    UPSTREAM_RATE_INCREASE: float = 0.05   # 每次成功增加的速率(次/秒)
+    UPSTREAM_RATE_DECREASE: float = 0.5    # 过载时速率乘以该系数
+    
+    # 批量分析流水线（K线 -> 分红 -> 财务 -> 评分 -> 写入，各阶段独立并发）
+    ANALYSIS_FINANCIAL_MAX_AGE_DAYS: int = 7   # 财务数据超过该天数才重新抓取
+    ANALYSIS_DIVIDEND_MAX_AGE_DAYS: int = 7    # 分红记录超过该天数才重新抓取
+    ANALYSIS_REFRESH_TIMEOUT: int = 1800       # 网络刷新最长秒数，超时后剩余股票沿用本地数据(0 不限)
+    ANALYSIS_KLINE_WORKERS: int = 2            # K线刷新阶段并发数
+    ANALYSIS_DIVIDEND_WORKERS: int = 2         # 分红刷新阶段并发数
+    ANALYSIS_FINANCIAL_WORKERS: int = 2        # 财务刷新阶段并发数
+    ANALYSIS_SCORE_BATCH: int = 200            # 评分阶段每批股票数
+    ANALYSIS_SCORE_WAIT: float = 1.0           # 评分批未满时最多等待上游的秒数
+    ANALYSIS_COMMIT_BATCH: int = 500           # 分析结果累计该条数后提交一次
+    ANALYSIS_COMMIT_INTERVAL: float = 30.0     # 最早一条未提交结果等待超过该秒数也提交(0 只按条数)
+    
+    # 批量写入配置
+    UPSERT_BATCH_SIZE: int = 1000          # 批量 upsert 每批行数(executemany)
 
     class Config:
         # 核心修改：使用绝对路径确保无论从哪里启动都能读到 .env
@@ -1,7 +1,186 @@
-from sqlalchemy.orm import Session
-from models.stock import DailyMarketData, UserStockWatch, StockAnalysisResult
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+from models.stock import (
+    DailyMarketData, IntradayMarketData, UserStockWatch, StockAnalysisResult, HistoricalData, DividendData,
+    AdjustmentFactor
+)
 from datetime import date, datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Sequence
+
+def bulk_upsert(db: Session, model, rows: List[Dict[str, Any]], key_fields: Sequence[str],
+                batch_size: int = 1000) -> int:
+    """
+    按自然键批量 upsert（SQLAlchemy Core, 分批 executemany）
+    - MySQL/TiDB: INSERT ... ON DUPLICATE KEY UPDATE
+    - SQLite/PostgreSQL: INSERT ... ON CONFLICT (key) DO UPDATE
+    key_fields 必须对应表上的唯一索引；不提交事务，由调用方统一 commit
+    """
+    if not rows:
+        return 0
+
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+    update_fields = [c for c in rows[0].keys() if c not in key_fields]
+
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        # 无可更新列时用键列自赋值实现"存在即跳过"
+        set_ = {c: stmt.inserted[c] for c in update_fields} or {key_fields[0]: stmt.inserted[key_fields[0]]}
+        stmt = stmt.on_duplicate_key_update(set_)
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        if update_fields:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(key_fields),
+                set_={c: stmt.excluded[c] for c in update_fields}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(key_fields))
+    else:
+        raise ValueError(f"不支持的数据库方言: {dialect}")
+
+    for start in range(0, len(rows), batch_size):
+        db.execute(stmt, rows[start:start + batch_size])
+    return len(rows)
+
+def upsert_market_data_batch(db: Session, market_data_list: List[Dict[str, Any]],
+                             batch_size: int = 1000) -> int:
+    """按 (date, code) 批量 upsert 市场数据，不提交事务"""
+    required_fields = ['date', 'code']
+    rows = [data for data in market_data_list
+            if all(data.get(field) not in (None, '') for field in required_fields)]
+    return bulk_upsert(db, DailyMarketData, rows, key_fields=('date', 'code'), batch_size=batch_size)
+
+def upsert_intraday_data_batch(db: Session, market_data_list: List[Dict[str, Any]],
+                               batch_size: int = 1000) -> int:
+    """按 (date, code) 批量 upsert 盘中行情，不提交事务"""
+    rows = [data for data in market_data_list if data.get('date') and data.get('code')]
+    return bulk_upsert(db, IntradayMarketData, rows, key_fields=('date', 'code'), batch_size=batch_size)
+
+HISTORICAL_BAR_FIELDS = ('open', 'close', 'high', 'low', 'volume', 'amount',
+                         'amplitude', 'change_pct', 'change_amount', 'turnover_rate')
+
+def _column_values(values) -> list:
+    """numpy 数组 / Series / 列表转为可直接绑定的 Python 列表，NaN 转 None"""
+    values = values.tolist() if hasattr(values, 'tolist') else list(values)
+    return [None if isinstance(v, float) and v != v else v for v in values]
+
+def upsert_historical_bars(db: Session, stock_code: str, bars: Dict[str, Sequence],
+                           batch_size: int = 5000, upsert: bool = True) -> int:
+    """
+    批量写入单只股票的日K线（按列传入 OHLCV 数组），分批 executemany，不提交事务
+    - bars 必须包含 date 列（date/datetime/Timestamp），其余只写 HISTORICAL_BAR_FIELDS 中出现的列
+    - upsert=True 按 (stock_code, date) 幂等覆盖；已确定无冲突（如同一事务内刚清空）时
+      可传 upsert=False 走普通 INSERT，不依赖唯一索引
+    返回写入行数
+    """
+    fields = [f for f in HISTORICAL_BAR_FIELDS if f in bars]
+    columns = {f: _column_values(bars[f]) for f in ['date', *fields]}
+    columns['date'] = [d.date() if isinstance(d, datetime) else d for d in columns['date']]
+    if 'volume' in columns:
+        columns['volume'] = [None if v is None else int(v) for v in columns['volume']]
+
+    rows = [dict(zip(columns, values), stock_code=stock_code) for values in zip(*columns.values())]
+    if not rows:
+        return 0
+    if upsert:
+        return bulk_upsert(db, HistoricalData, rows, key_fields=('stock_code', 'date'), batch_size=batch_size)
+
+    stmt = insert(HistoricalData.__table__)
+    for start in range(0, len(rows), batch_size):
+        db.execute(stmt, rows[start:start + batch_size])
+    return len(rows)
+
+def append_daily_bars_from_snapshot(db: Session, trade_date: date, batch_size: int = 1000) -> int:
+    """
+    用当日快照为全市场追加一根日K线，按 (stock_code, date) 幂等 upsert，不提交事务
+    - 收盘后的快照即当日完整日线（不复权价格，与 historical_data 一致）
+    - 停牌股（无成交或无开盘价）不生成K线
+    """
+    m = DailyMarketData
+    snapshot = db.query(
+        m.code, m.open, m.latest_price, m.high, m.low, m.volume, m.amount,
+        m.amplitude, m.change_pct, m.change_amount, m.turnover_rate
+    ).filter(
+        m.date == trade_date,
+        m.volume > 0,
+        m.open.isnot(None),
+        m.latest_price > 0
+    ).all()
+
+    rows = [{
+        'stock_code': r.code,
+        'date': trade_date,
+        'open': r.open,
+        'close': r.latest_price,
+        'high': r.high,
+        'low': r.low,
+        'volume': int(r.volume),
+        'amount': r.amount,
+        'amplitude': r.amplitude,
+        'change_pct': r.change_pct,
+        'change_amount': r.change_amount,
+        'turnover_rate': r.turnover_rate,
+    } for r in snapshot]
+    return bulk_upsert(db, HistoricalData, rows, key_fields=('stock_code', 'date'), batch_size=batch_size)
+
+def get_adjust_factors(db: Session, stock_codes: Sequence[str]) -> Dict[str, tuple]:
+    """批量读取复权因子，返回 {代码: ([生效日期...], [因子...])}，日期升序；没有因子的股票不出现"""
+    rows = db.query(
+        AdjustmentFactor.stock_code, AdjustmentFactor.date, AdjustmentFactor.hfq_factor
+    ).filter(AdjustmentFactor.stock_code.in_(list(stock_codes))).order_by(
+        AdjustmentFactor.stock_code, AdjustmentFactor.date
+    ).all()
+    factors = {}
+    for code, day, value in rows:
+        dates, values = factors.setdefault(code, ([], []))
+        dates.append(day)
+        values.append(value)
+    return factors
+
+def save_adjust_factors(db: Session, stock_code: str, rows: Sequence[tuple], replace: bool = False) -> int:
+    """
+    写入复权因子 [(生效日期, 后复权因子), ...]，不提交事务
+    replace=True 时先删除该股票全部因子（全量重抓后重新推算），否则按 (stock_code, date) upsert
+    """
+    if replace:
+        db.query(AdjustmentFactor).filter(AdjustmentFactor.stock_code == stock_code).delete()
+    now = datetime.now()
+    return bulk_upsert(db, AdjustmentFactor, [
+        {'stock_code': stock_code, 'date': day, 'hfq_factor': float(value), 'updated_at': now}
+        for day, value in rows
+    ], key_fields=('stock_code', 'date'))
+
+def get_adjacent_bar_pairs(db: Session, trade_date: date, prev_date: date) -> list:
+    """
+    已有复权因子的股票在 prev_date 与 trade_date 两根K线的收盘价及 trade_date 的涨跌额
+    用于快照追加当日K线后判断当日是否除权除息
+    """
+    today, prev = aliased(HistoricalData), aliased(HistoricalData)
+    has_factor = db.query(AdjustmentFactor.stock_code).distinct()
+    return db.query(
+        today.stock_code, prev.close.label('prev_close'), today.close, today.change_amount
+    ).join(
+        prev, (prev.stock_code == today.stock_code) & (prev.date == prev_date)
+    ).filter(
+        today.date == trade_date,
+        today.stock_code.in_(has_factor)
+    ).all()
+
+def upsert_dividends(db: Session, dividend_list: List[Dict[str, Any]], batch_size: int = 1000) -> int:
+    """按 (stock_code, ex_dividend_date) 批量 upsert 分红记录，缺少除权日的记录跳过，不提交事务"""
+    rows = {}
+    for data in dividend_list:
+        if data.get('stock_code') and data.get('ex_dividend_date'):
+            rows[(data['stock_code'], data['ex_dividend_date'])] = data
+    return bulk_upsert(db, DividendData, list(rows.values()),
+                       key_fields=('stock_code', 'ex_dividend_date'), batch_size=batch_size)
+
+def upsert_analysis_results(db: Session, results: List[Dict[str, Any]], batch_size: int = 1000) -> int:
+    """按 (stock_code, analysis_date) 批量 upsert 分析结果，同日重复分析覆盖旧结果，不提交事务"""
+    return bulk_upsert(db, StockAnalysisResult, results,
+                       key_fields=('stock_code', 'analysis_date'), batch_size=batch_size)
 
 def save_market_data_batch(db: Session, market_data_list: List[Dict[str, Any]]) -> List[DailyMarketData]:
     """批量保存市场数据"""
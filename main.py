@@ -35,6 +35,7 @@ from apscheduler.triggers.cron import CronTrigger
 
 # 导入核心配置与模型
 from core.database import engine, Base, SessionLocal
+from core.config import settings
 from api import user_router, stock_router, holdings_router
 
 # 导入业务服务
@@ -42,6 +43,7 @@ from services.stock_service import stock_service
 from services.holding_service import holding_service
 from services.email_service import email_service
 from services.index_service import index_service
+from services.trading_calendar import trading_calendar
 
 # 导入调度管理器（方案二）
 try:
@@ -82,6 +84,10 @@ async def lifespan(app: FastAPI):
         os.makedirs("outputs")
         logger.info("创建outputs目录")
     
+    # 预加载交易日历（读本地缓存，过期时才请求 akshare），避免首个任务在事件循环里阻塞拉取
+    calendar_source = await asyncio.to_thread(trading_calendar.load)
+    logger.info(f"交易日历加载完成: {calendar_source}")
+    
     # 方案一：初始化主调度器（全局变量）
     main_scheduler = AsyncIOScheduler()
     logger.info("主调度器初始化完成")
@@ -133,13 +139,30 @@ async def lifespan(app: FastAPI):
     print("✅ 系统已安全停止\n")
     logger.info("系统关闭完成")
 
+def trading_day_job(name, func):
+    """
+    包装只在交易日运行的任务：非交易日（周末、节假日）直接跳过
+    包装后是协程函数，调度器会等待任务执行完毕，max_instances=1 才能真正阻止同一任务重叠运行；
+    同步任务放到线程中执行，不阻塞事件循环
+    """
+    async def runner():
+        if not trading_calendar.is_trading_day():
+            logger.info(f"⏭️ 今日非交易日，跳过{name}")
+            return
+        if asyncio.iscoroutinefunction(func):
+            await func()
+        else:
+            await asyncio.to_thread(func)
+    return runner
+
 def setup_business_tasks(scheduler):
     """配置核心业务任务"""
     logger.info("配置核心业务任务...")
     
+    # 任务 A-D 与盘中轮询只在交易日执行（按交易日历判断）
     # 任务 A: 每日 15:30 抓取全市场收盘数据
     scheduler.add_job(
-        lambda: asyncio.create_task(stock_service.fetch_daily_market_data()),
+        trading_day_job("市场数据抓取", stock_service.fetch_daily_market_data),
         CronTrigger(hour=15, minute=30),
         id="sync_market_data",
         name="市场数据抓取",
@@ -151,7 +174,7 @@ def setup_business_tasks(scheduler):
     
     # 任务 B: 每日 16:00 进行全量股票分析评分
     scheduler.add_job(
-        lambda: asyncio.create_task(stock_service.analyze_all_watched_stocks()),
+        trading_day_job("股票分析", stock_service.analyze_all_watched_stocks),
         CronTrigger(hour=16, minute=0),
         id="analyze_stocks",
         name="股票分析",
@@ -163,7 +186,7 @@ def setup_business_tasks(scheduler):
     
     # 任务 C: 每日 16:30 更新所有用户的持仓盈亏
     scheduler.add_job(
-        lambda: update_holdings_wrapper(),
+        trading_day_job("持仓更新", update_holdings_wrapper),
         CronTrigger(hour=16, minute=30),
         id="update_holdings",
         name="持仓更新",
@@ -175,7 +198,7 @@ def setup_business_tasks(scheduler):
     
     # 任务 D: 每日 18:00 生成报告并发送邮件
     scheduler.add_job(
-        lambda: asyncio.create_task(email_service.send_all_daily_reports()),
+        trading_day_job("邮件报告", email_service.send_all_daily_reports),
         CronTrigger(hour=18, minute=0),
         id="send_daily_emails",
         name="邮件报告",
@@ -197,6 +220,20 @@ def setup_business_tasks(scheduler):
     )
     logger.info("✓ 指数同步任务配置完成")
     
+    # 任务 F: 交易时段内每 N 分钟轮询盘中快照（只写变化行，不影响收盘数据）
+    if settings.INTRADAY_ENABLED:
+        scheduler.add_job(
+            trading_day_job("盘中行情轮询", stock_service.fetch_intraday_snapshot),
+            CronTrigger(day_of_week='mon-fri', hour='9-11,13-14',
+                        minute=f"*/{max(1, settings.INTRADAY_POLL_MINUTES)}"),
+            id="poll_intraday",
+            name="盘中行情轮询",
+            misfire_grace_time=60,  # 过期的轮询直接丢弃
+            coalesce=True,
+            max_instances=1
+        )
+        logger.info("✓ 盘中行情轮询任务配置完成")
+    
     # 添加系统监控任务
     scheduler.add_job(
         system_monitor_task,
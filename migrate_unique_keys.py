@@ -0,0 +1,137 @@
+"""
+唯一键迁移工具 - 为已有数据库补建自然键唯一索引
+Base.metadata.create_all 只会创建缺失的表，不会给已有表补索引或新列；
+升级后首次启动前执行一次：补齐缺失列，分批清理重复行，创建唯一索引，
+最后删除已被联合唯一索引覆盖的单列 stock_code 索引：
+
+    python migrate_unique_keys.py
+    python migrate_unique_keys.py --dry-run
+"""
+
+import argparse
+from sqlalchemy import select, delete, func, and_, inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from core.database import engine
+from models.stock import DailyMarketData, HistoricalData, DividendData, StockAnalysisResult
+
+# 需要自然键唯一的表：模型 -> 自然键字段
+UNIQUE_KEY_TARGETS = [
+    (DailyMarketData, ("date", "code")),
+    (HistoricalData, ("stock_code", "date")),
+    (DividendData, ("stock_code", "ex_dividend_date")),
+    (StockAnalysisResult, ("stock_code", "analysis_date")),
+]
+
+# 联合唯一索引以 stock_code 开头后，旧的单列索引成为冗余，只增加写入开销
+REDUNDANT_INDEXES = {
+    "historical_data": ["ix_historical_data_stock_code"],
+    "dividend_data": ["ix_dividend_data_stock_code"],
+    "stock_analysis_results": ["ix_stock_analysis_results_stock_code"],
+}
+
+
+def ensure_columns(model) -> list:
+    """为已有表补齐模型中新增的列（仅新增，不修改已有列），返回新增的列名"""
+    table = model.__table__
+    existing = {col["name"] for col in inspect(engine).get_columns(table.name)}
+    added = []
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            added.append(column.name)
+    return added
+
+
+def find_duplicate_ids(conn, model, key_fields, limit):
+    """查找重复行的 id（每组保留 id 最大、即最新写入的一行）"""
+    table = model.__table__
+    keys = [table.c[f] for f in key_fields]
+    groups = select(*keys, func.max(table.c.id).label("keep_id")).group_by(*keys).having(
+        func.count(table.c.id) > 1
+    ).subquery()
+    stmt = select(table.c.id).join(
+        groups, and_(*[table.c[f] == groups.c[f] for f in key_fields])
+    ).where(table.c.id < groups.c.keep_id).limit(limit)
+    return [row[0] for row in conn.execute(stmt)]
+
+
+def dedup_table(model, key_fields, batch_size=5000, dry_run=False) -> int:
+    """分批删除重复行，返回删除总数"""
+    table = model.__table__
+    removed = 0
+    while True:
+        with engine.begin() as conn:
+            ids = find_duplicate_ids(conn, model, key_fields, batch_size)
+            if not ids:
+                break
+            if dry_run:
+                return len(ids)
+            conn.execute(delete(table).where(table.c.id.in_(ids)))
+        removed += len(ids)
+        print(f"   🗑️ {table.name}: 已删除 {removed} 条重复行")
+    return removed
+
+
+def ensure_unique_indexes(model) -> list:
+    """创建模型上声明但数据库中缺失的唯一索引，返回新建的索引名"""
+    table = model.__table__
+    existing = {ix["name"] for ix in inspect(engine).get_indexes(table.name)}
+    created = []
+    for index in table.indexes:
+        if index.unique and index.name not in existing:
+            index.create(bind=engine)
+            created.append(index.name)
+    return created
+
+
+def drop_redundant_indexes(model) -> list:
+    """删除已被联合唯一索引覆盖的单列索引，返回删除的索引名"""
+    table = model.__table__
+    existing = {ix["name"] for ix in inspect(engine).get_indexes(table.name)}
+    dropped = []
+    with engine.begin() as conn:
+        for name in REDUNDANT_INDEXES.get(table.name, []):
+            if name not in existing:
+                continue
+            if engine.dialect.name == "mysql":
+                conn.execute(text(f"DROP INDEX {name} ON {table.name}"))
+            else:
+                conn.execute(text(f"DROP INDEX {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="唯一键迁移工具")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批删除的重复行数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不修改数据库")
+    args = parser.parse_args()
+
+    for model, key_fields in UNIQUE_KEY_TARGETS:
+        table_name = model.__tablename__
+        if not inspect(engine).has_table(table_name):
+            print(f"ℹ️ {table_name} 不存在，跳过")
+            continue
+
+        print(f"\n📊 {table_name} ({', '.join(key_fields)})")
+        if not args.dry_run:
+            for name in ensure_columns(model):
+                print(f"   ✅ 已补齐列 {name}")
+        removed = dedup_table(model, key_fields, batch_size=args.batch_size, dry_run=args.dry_run)
+        if args.dry_run:
+            print(f"   ℹ️ 存在重复行（首批 {removed} 条），未做修改" if removed else "   ✅ 无重复行")
+            continue
+        print(f"   ✅ 去重完成，共删除 {removed} 条")
+
+        for name in ensure_unique_indexes(model):
+            print(f"   ✅ 已创建唯一索引 {name}")
+        for name in drop_redundant_indexes(model):
+            print(f"   🗑️ 已删除冗余索引 {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,11 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Date, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, Text, Index
 import datetime
 from core.database import Base
 
-class DailyMarketData(Base):
+class MarketQuoteColumns:
     """
-    每日市场数据表
+    全市场快照行情字段（收盘表与盘中表共用）
     """
-    __tablename__ = "daily_market_data"
-    
     id = Column(Integer, primary_key=True, autoincrement=True, 
                comment="主键ID - 自增")
     date = Column(Date, index=True, comment="数据日期 - 交易日期")
@@ -45,6 +43,27 @@ class DailyMarketData(Base):
     updated_at = Column(DateTime, default=datetime.datetime.now, 
                        comment="更新时间 - 数据入库时间")
 
+class DailyMarketData(MarketQuoteColumns, Base):
+    """
+    每日市场数据表
+    收盘快照是该交易日的权威数据
+    """
+    __tablename__ = "daily_market_data"
+    __table_args__ = (
+        # 自然键：同一交易日同一股票只保留一行，供批量 upsert 定位冲突
+        Index("uq_daily_market_date_code", "date", "code", unique=True),
+    )
+
+class IntradayMarketData(MarketQuoteColumns, Base):
+    """
+    盘中行情表
+    交易时段内轮询快照，每只股票每天一行，只覆盖写入发生变化的股票；不参与收盘分析
+    """
+    __tablename__ = "intraday_market_data"
+    __table_args__ = (
+        Index("uq_intraday_market_date_code", "date", "code", unique=True),
+    )
+
 class UserStockWatch(Base):
     """
     用户股票关注表
@@ -63,10 +82,14 @@ class StockAnalysisResult(Base):
     股票分析结果表
     """
     __tablename__ = "stock_analysis_results"
+    __table_args__ = (
+        # 自然键：同一股票每天只保留一条分析结果，重复分析时覆盖
+        Index("uq_analysis_code_date", "stock_code", "analysis_date", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True, 
                comment="主键ID - 自增")
-    stock_code = Column(String(10), index=True, comment="股票代码 - 6位数字")
+    stock_code = Column(String(10), comment="股票代码 - 6位数字")
     stock_name = Column(String(50), comment="股票名称 - 中文简称")
     analysis_date = Column(Date, index=True, comment="分析日期 - 数据分析日期")
     
@@ -88,6 +111,7 @@ class StockAnalysisResult(Base):
     volatility_score = Column(Integer, comment="波动率评分 - 0-40分,波动越低分数越高")
     dividend_score = Column(Integer, comment="股息率评分 - 0-30分,股息率越高分数越高")
     growth_score = Column(Integer, comment="成长性评分 - 0-30分,ROE越高分数越高")
+    valuation_score = Column(Integer, comment="估值评分 - 按PE/PB分档,亏损或无数据不加分")
     total_score = Column(Integer, comment="综合评分 - 总分0-100分")
     
     # 分析结果
@@ -102,17 +126,21 @@ class HistoricalData(Base):
     历史行情数据表
     """
     __tablename__ = "historical_data"
+    __table_args__ = (
+        # 自然键：同一股票同一交易日只有一根K线，追加/补齐时按此幂等 upsert
+        Index("uq_historical_code_date", "stock_code", "date", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True, 
                comment="主键ID - 自增")
-    stock_code = Column(String(10), index=True, comment="股票代码 - 6位数字")
+    stock_code = Column(String(10), comment="股票代码 - 6位数字")
     date = Column(Date, index=True, comment="交易日期 - K线日期")
     
     # OHLC数据
-    open = Column(Float, comment="开盘价 - 当日开盘价格(元,前复权)")
-    close = Column(Float, comment="收盘价 - 当日收盘价格(元,前复权)")
-    high = Column(Float, comment="最高价 - 当日最高价格(元,前复权)")
-    low = Column(Float, comment="最低价 - 当日最低价格(元,前复权)")
+    open = Column(Float, comment="开盘价 - 当日开盘价格(元,不复权)")
+    close = Column(Float, comment="收盘价 - 当日收盘价格(元,不复权)")
+    high = Column(Float, comment="最高价 - 当日最高价格(元,不复权)")
+    low = Column(Float, comment="最低价 - 当日最低价格(元,不复权)")
     
     # 成交数据
     volume = Column(Integer, comment="成交量 - 当日成交股数(股)")
@@ -127,15 +155,40 @@ class HistoricalData(Base):
     created_at = Column(DateTime, default=datetime.datetime.now, 
                        comment="创建时间 - 数据入库时间")
 
+class AdjustmentFactor(Base):
+    """
+    复权因子表
+    每只股票按生效日期分段记录后复权因子：一行从 date 起生效直到下一行，
+    每次除权除息只新增一行；historical_data 存不复权价格，读取时按因子换算
+    - 后复权价 = 不复权价 × hfq_factor
+    - 前复权价 = 不复权价 × hfq_factor / 最新因子
+    """
+    __tablename__ = "adjustment_factors"
+    __table_args__ = (
+        Index("uq_adjust_factor_code_date", "stock_code", "date", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True, 
+               comment="主键ID - 自增")
+    stock_code = Column(String(10), comment="股票代码 - 6位数字")
+    date = Column(Date, comment="生效日期 - 除权除息日(首行为首根已存K线日期)")
+    hfq_factor = Column(Float, comment="后复权因子 - 相对首根已存K线")
+    updated_at = Column(DateTime, default=datetime.datetime.now, 
+                       comment="更新时间")
+
 class DividendData(Base):
     """
     分红派息数据表
     """
     __tablename__ = "dividend_data"
+    __table_args__ = (
+        # 自然键：同一股票同一除权除息日只有一条分红记录
+        Index("uq_dividend_code_exdate", "stock_code", "ex_dividend_date", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True, 
                comment="主键ID - 自增")
-    stock_code = Column(String(10), index=True, comment="股票代码 - 6位数字")
+    stock_code = Column(String(10), comment="股票代码 - 6位数字")
     stock_name = Column(String(50), comment="股票名称 - 中文简称")
     ex_dividend_date = Column(Date, index=True, comment="除权除息日 - 分红生效日期")
     
@@ -188,4 +241,65 @@ class IndexConstituent(Base):
     updated_at = Column(DateTime, default=datetime.datetime.now, 
                        onupdate=datetime.datetime.now, 
                        comment="更新时间 - 最后修改时间")
-    is_active = Column(Integer, default=1, comment="是否有效 - 1:当前成分股, 0:已调出")
\ No newline at end of file
+    is_active = Column(Integer, default=1, comment="是否有效 - 1:当前成分股, 0:已调出")
+
+class SupplementProgress(Base):
+    """
+    历史数据批量补充进度表
+    每个批次(run_id)中每只股票一行，重跑时跳过已完成的股票
+    """
+    __tablename__ = "supplement_progress"
+    __table_args__ = (
+        Index("uq_supplement_run_code", "run_id", "stock_code", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True, 
+               comment="主键ID - 自增")
+    run_id = Column(String(50), comment="批次标识 - 默认 模式-日期")
+    stock_code = Column(String(10), comment="股票代码 - 6位数字")
+    status = Column(String(10), comment="处理结果 - success/skip/error")
+    saved = Column(Integer, default=0, comment="写入条数")
+    message = Column(String(200), comment="结果说明 - 失败原因等")
+    finished_at = Column(DateTime, default=datetime.datetime.now, 
+                        comment="完成时间")
+
+class SupplementRun(Base):
+    """
+    历史数据批量补充批次表
+    每个批次一行，finished_at 为空表示批次中途退出；不指定批次时续跑同模式最近一个未完成批次
+    """
+    __tablename__ = "supplement_runs"
+    
+    run_id = Column(String(50), primary_key=True, comment="批次标识 - 默认 模式-日期")
+    mode = Column(String(20), index=True, comment="补充模式 - full/incremental/append")
+    started_at = Column(DateTime, default=datetime.datetime.now, 
+                       comment="开始时间")
+    finished_at = Column(DateTime, comment="完成时间 - 为空表示未完成")
+
+class HistoricalCoverage(Base):
+    """
+    历史K线覆盖度缓存表
+    由统计报告的一次分组查询生成，补充单只股票后随之更新
+    """
+    __tablename__ = "historical_coverage"
+    
+    stock_code = Column(String(10), primary_key=True, comment="股票代码 - 6位数字")
+    bars = Column(Integer, comment="K线条数")
+    min_date = Column(Date, comment="最早K线日期")
+    max_date = Column(Date, comment="最新K线日期")
+    refreshed_at = Column(DateTime, default=datetime.datetime.now, 
+                         comment="统计时间")
+
+class AnalysisInputState(Base):
+    """
+    分析输入刷新状态表
+    记录每只股票分红与财务数据最近一次成功刷新的时间及最新财务指标，
+    批量分析的刷新阶段据此只抓过期的输入，计算阶段直接读取其中的财务指标
+    """
+    __tablename__ = "analysis_input_state"
+    
+    stock_code = Column(String(10), primary_key=True, comment="股票代码 - 6位数字")
+    roe = Column(Float, comment="ROE净资产收益率(%) - 最近一次成功获取")
+    profit_growth = Column(Float, comment="利润增长率(%) - 最近一次成功获取")
+    financial_at = Column(DateTime, comment="财务数据刷新时间")
+    dividend_at = Column(DateTime, comment="分红记录刷新时间")
@@ -0,0 +1,56 @@
+import numpy as np
+
+# 价格精确到分，昨收参考价与实际昨收相差超过该值才视为除权除息
+PRICE_TOLERANCE = 0.015
+
+
+def derive_factors(dates, closes, change_amounts, prev_close: float = None, prev_factor: float = 1.0) -> list:
+    """
+    由不复权K线推算复权因子
+    除权除息日交易所按除权参考价计算涨跌，因此 收盘 - 涨跌额 即当日的昨收参考价；
+    它与上一根K线的实际收盘价不一致时，当日为除权除息日，后复权因子乘以 实际昨收 / 参考昨收
+    - prev_close 为 None（全量）：首根K线生成一行值为 prev_factor 的基准因子，再加上区间内的除权行
+    - prev_close 为已存最后一根K线收盘价（增量）：只返回新K线中发生的除权行，从 prev_factor 继续累乘
+    返回 [(date, factor), ...]，涨跌额缺失的K线不参与判断
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    if not len(closes):
+        return []
+    changes = np.asarray(change_amounts, dtype=np.float64)
+    first_prev = np.nan if prev_close is None else prev_close
+    actual_prev = np.concatenate([[first_prev], closes[:-1]])
+    reference_prev = closes - changes
+    valid = np.isfinite(actual_prev) & np.isfinite(reference_prev) & (actual_prev > 0) & (reference_prev > 0)
+    events = valid & (np.abs(actual_prev - reference_prev) > PRICE_TOLERANCE)
+    ratios = np.where(events, actual_prev / np.where(valid, reference_prev, 1.0), 1.0)
+    factors = prev_factor * np.cumprod(ratios)
+
+    rows = [(dates[0], float(factors[0]))] if prev_close is None else []
+    rows += [(dates[i], float(factors[i])) for i in np.flatnonzero(events)]
+    return rows
+
+
+def factors_for_days(bar_days, factor_days, factor_values) -> np.ndarray:
+    """每根K线当日生效的后复权因子（searchsorted 向量化），早于首个因子日期的K线按首个因子"""
+    factor_values = np.asarray(factor_values, dtype=np.float64)
+    if not len(factor_values):
+        return np.ones(len(bar_days))
+    index = np.searchsorted(np.asarray(factor_days), np.asarray(bar_days), side="right") - 1
+    return factor_values[np.clip(index, 0, None)]
+
+
+def adjust_prices(prices, bar_days, factor_days, factor_values, mode: str = "qfq") -> np.ndarray:
+    """
+    不复权价格换算为复权价格
+    prices 为一维数组或 (K线数, 列数) 二维数组，行与 bar_days 对应；日期均为同一种数值表示
+    mode: qfq 前复权（最新价不变）/ hfq 后复权 / None 原样返回
+    """
+    if mode is None or not len(factor_values):
+        return prices
+    factors = factors_for_days(bar_days, factor_days, factor_values)
+    if mode == "qfq":
+        factors = factors / float(factor_values[-1])
+    elif mode != "hfq":
+        raise ValueError(f"未知复权方式: {mode}")
+    prices = np.asarray(prices, dtype=np.float64)
+    return prices * (factors[:, None] if prices.ndim == 2 else factors)
@@ -0,0 +1,139 @@
+import time
+import asyncio
+from collections import deque
+
+import numpy as np
+
+
+class SourceLatencyStats:
+    """
+    数据源延迟与胜率统计（进程内滑动窗口）
+    - 延迟只记录成功返回完整结果的耗时，用于计算 p95 作为对冲延迟
+    - 胜率 = 赢得竞速次数 / 参与竞速次数，用于决定谁先发
+    """
+
+    def __init__(self, window: int = 50):
+        self.window = window
+        self.latencies = {}
+        self.races = {}
+        self.wins = {}
+        self.failures = {}
+
+    def _ensure(self, source: str):
+        if source not in self.latencies:
+            self.latencies[source] = deque(maxlen=self.window)
+            self.races[source] = 0
+            self.wins[source] = 0
+            self.failures[source] = 0
+
+    def record(self, source: str, latency: float = None, ok: bool = False):
+        """记录一次参与：ok=True 时记入成功延迟，被取消的一方 latency 传 None 且 ok=False"""
+        self._ensure(source)
+        self.races[source] += 1
+        if ok and latency is not None:
+            self.latencies[source].append(latency)
+        elif latency is not None:
+            self.failures[source] += 1
+
+    def record_win(self, source: str):
+        self._ensure(source)
+        self.wins[source] += 1
+
+    def p95(self, source: str):
+        samples = self.latencies.get(source)
+        if not samples:
+            return None
+        return float(np.percentile(np.asarray(samples), 95))
+
+    def win_rate(self, source: str):
+        races = self.races.get(source, 0)
+        return self.wins[source] / races if races else None
+
+    def hedge_delay(self, source: str, default: float, lower: float, upper: float,
+                    min_samples: int = 5) -> float:
+        """主数据源的 p95 延迟即对冲延迟；样本不足时使用默认值"""
+        samples = self.latencies.get(source)
+        if not samples or len(samples) < min_samples:
+            return default
+        return float(min(upper, max(lower, self.p95(source))))
+
+    def pick_primary(self, sources: list, min_races: int = 5) -> list:
+        """按胜率排序数据源（样本不足的保持原顺序靠前），返回 [主, 备]"""
+        def rank(item):
+            index, source = item
+            races = self.races.get(source, 0)
+            if races < min_races:
+                return (0, index)
+            return (1, -self.win_rate(source), index)
+        return [source for _, source in sorted(enumerate(sources), key=rank)]
+
+    def snapshot(self) -> dict:
+        return {
+            source: {
+                "races": self.races[source],
+                "wins": self.wins[source],
+                "failures": self.failures[source],
+                "win_rate": round(self.win_rate(source), 3) if self.races[source] else None,
+                "p95_seconds": round(self.p95(source), 2) if self.latencies[source] else None,
+                "samples": len(self.latencies[source]),
+            }
+            for source in self.latencies
+        }
+
+
+async def hedged_race(primary, secondary, delay: float, stats: SourceLatencyStats, is_complete):
+    """
+    对冲竞速：先启动主数据源，超过 delay 秒仍未返回（或提前失败）时启动备用数据源，
+    取第一个完整结果并取消另一方
+    primary / secondary 为 (名称, 无参协程工厂)；返回 (胜出名称, 结果)，都失败时返回 (None, None)
+    注意：跑在线程里的同步调用被取消后线程仍会执行完，只是结果被丢弃
+    """
+    tasks = {}
+    started = {}
+
+    def launch(source):
+        name, factory = source
+        started[name] = time.monotonic()
+        tasks[asyncio.ensure_future(factory())] = name
+
+    launch(primary)
+    hedged = False
+    winner = (None, None)
+    try:
+        while True:
+            pending = {t for t in tasks if not t.done()}
+            if not pending:
+                break
+            done, _ = await asyncio.wait(pending, timeout=None if hedged else delay,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                print(f"   ⏱️ {primary[0]} 超过 {delay:.1f} 秒未返回，启动对冲数据源 {secondary[0]}")
+                launch(secondary)
+                hedged = True
+                continue
+
+            for task in done:
+                name = tasks[task]
+                latency = time.monotonic() - started[name]
+                result = task.result() if not task.cancelled() and task.exception() is None else None
+                ok = result is not None and is_complete(result)
+                stats.record(name, latency, ok)
+                if ok and winner[0] is None:
+                    winner = (name, result)
+
+            if winner[0] is not None:
+                break
+            if not hedged:
+                print(f"   ⚠️ {primary[0]} 未返回完整结果，立即启动 {secondary[0]}")
+                launch(secondary)
+                hedged = True
+    finally:
+        for task, name in tasks.items():
+            if not task.done():
+                task.cancel()
+                stats.record(name)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if winner[0] is not None:
+        stats.record_win(winner[0])
+    return winner
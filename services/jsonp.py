@@ -0,0 +1,70 @@
+"""
+东财 JSONP 响应解码
+- 直接在响应字节上按下标定位最外层括号，不使用正则（避免回溯和多次文本拷贝）
+- 安装了 orjson 时用 orjson 解析，否则退回标准库 json
+"""
+import json
+
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def response_bytes(response) -> bytes:
+    """
+    取响应体字节：requests 自动处理 gzip/deflate/br
+    若服务器仍强制返回 zstd，用 zstandard 库手动解压
+    """
+    content_encoding = response.headers.get("Content-Encoding", "").lower()
+    if "zstd" in content_encoding:
+        try:
+            import zstandard as zstd_lib
+        except ImportError:
+            raise ValueError("服务器返回了 zstd 压缩，请执行: pip install zstandard")
+        return zstd_lib.ZstdDecompressor().decompress(response.content)
+    return response.content
+
+
+def _loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    if isinstance(body, memoryview):
+        body = body.tobytes()
+    return json.loads(body)
+
+
+def decode_jsonp(payload) -> dict:
+    """
+    解码 jQuery123_456({...}); 形式的 JSONP，也兼容不带回调的纯 JSON
+    payload 可以是 bytes 或 str；无法定位 JSON 时抛出 ValueError
+    """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+
+    start = 0
+    while start < len(payload) and payload[start] in b" \t\r\n":
+        start += 1
+    if payload[start:start + 1] in (b"{", b"["):
+        return _loads(memoryview(payload)[start:])
+
+    # 回调名中不会出现括号：第一个 "(" 与最后一个 ")" 之间即为 JSON 本体
+    left = payload.find(b"(")
+    right = payload.rfind(b")")
+    if left == -1 or right <= left:
+        raise ValueError(f"无法解析JSONP响应，原始内容(前500字节): {payload[:500]!r}")
+    return _loads(memoryview(payload)[left + 1:right])
+
+
+def diff_to_frame(diff) -> pd.DataFrame:
+    """
+    clist/get 的 data.diff 直接构造 DataFrame
+    diff 可能是列表，也可能是 {"0": {...}, "1": {...}} 形式的字典
+    """
+    if not diff:
+        return pd.DataFrame()
+    if isinstance(diff, dict):
+        diff = list(diff.values())
+    return pd.DataFrame.from_records(diff)
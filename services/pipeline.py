@@ -0,0 +1,40 @@
+import asyncio
+
+
+async def run_stages(*coros):
+    """
+    并发运行流水线各阶段，按传入顺序返回各阶段结果
+    任一阶段抛出异常时取消其余阶段并重新抛出，避免上下游因队列阻塞而互相等待
+    """
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def queue_stage(inbound: asyncio.Queue, outbound: asyncio.Queue, handler, workers: int = 1):
+    """
+    流水线中间阶段：workers 个协程从 inbound 取元素，await handler(item) 后把结果放入 outbound
+    handler 返回 None 时丢弃该元素；上游以一个 None 作为结束标记，
+    同阶段的 worker 依次转交结束标记，最后一个退出的 worker 再向下游发出 None
+    """
+    remaining = max(1, workers)
+
+    async def worker():
+        nonlocal remaining
+        while (item := await inbound.get()) is not None:
+            result = await handler(item)
+            if result is not None:
+                await outbound.put(result)
+        remaining -= 1
+        await (outbound if remaining == 0 else inbound).put(None)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
@@ -0,0 +1,182 @@
+import os
+import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from services.adjustment import adjust_prices
+
+
+class PriceStore:
+    """
+    本地列式价格库（historical_data 的只读缓存）
+    每只股票一个 .npy 文件，float64 二维数组，按日期升序，列为 COLUMNS；
+    日期存为 1970-01-01 起的天数。读取时用 np.load(mmap_mode='r') 内存映射，
+    取最近 N 根只是切片，不拷贝、不查库
+    数据库仍是权威数据，写库后同步更新；文件缺失或损坏时由调用方回退到数据库并重建
+    价格为不复权价，复权因子另存 {code}.fq.npy（列为 生效日期, 后复权因子），
+    读取时传 adjust="qfq"/"hfq" 即按因子换算开高低收
+    """
+
+    COLUMNS = ("date", "open", "high", "low", "close", "volume")
+    DATE, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+
+    def __init__(self, base_dir: str):
+        self.base_dir = Path(base_dir)
+
+    def _path(self, code: str) -> Path:
+        return self.base_dir / f"{code}.npy"
+
+    def _factor_path(self, code: str) -> Path:
+        return self.base_dir / f"{code}.fq.npy"
+
+    @staticmethod
+    def _to_day_numbers(dates) -> np.ndarray:
+        return pd.DatetimeIndex(pd.to_datetime(dates)).values.astype("datetime64[D]").astype(np.int64).astype(np.float64)
+
+    @classmethod
+    def to_array(cls, bars) -> np.ndarray:
+        """把含 date/open/high/low/close/volume 列的表或列字典转成存储数组（缺失列填 NaN）"""
+        dates = bars["date"]
+        size = len(dates)
+        array = np.full((size, len(cls.COLUMNS)), np.nan)
+        array[:, cls.DATE] = cls._to_day_numbers(dates)
+        for i, name in enumerate(cls.COLUMNS[1:], start=1):
+            if name in bars:
+                array[:, i] = pd.to_numeric(pd.Series(bars[name], dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+        return array[np.argsort(array[:, cls.DATE], kind="stable")]
+
+    def load(self, code: str):
+        """内存映射读取整只股票，不存在或损坏时返回 None"""
+        return self._load_file(self._path(code))
+
+    def load_factors(self, code: str):
+        """读取复权因子 (k, 2) 数组，没有时返回 None"""
+        return self._load_file(self._factor_path(code))
+
+    @staticmethod
+    def _load_file(path: Path):
+        if not path.exists():
+            return None
+        try:
+            return np.load(path, mmap_mode="r")
+        except (ValueError, OSError):
+            return None
+
+    def write(self, code: str, array: np.ndarray):
+        """整体替换（先写临时文件再原子替换，读者不会看到半个文件）"""
+        self._write_file(self._path(code), array)
+
+    def write_factors(self, code: str, dates, factors):
+        """整体替换某只股票的复权因子"""
+        array = np.column_stack([self._to_day_numbers(dates), np.asarray(factors, dtype=np.float64)])
+        self._write_file(self._factor_path(code), array.reshape(-1, 2))
+
+    def _write_file(self, path: Path, array: np.ndarray):
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp.npy")
+        np.save(tmp_path, np.ascontiguousarray(array, dtype=np.float64))
+        os.replace(tmp_path, path)
+
+    def append(self, code: str, array: np.ndarray):
+        """
+        追加K线，与已有日期重复的以新数据为准
+        新K线都晚于已存最后一根（每日追加的常见情况）时就地写入文件尾部并更新头部行数，
+        只写新增的字节；日期有重叠或乱序时读出整只股票合并后整体替换
+        """
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        if not len(array):
+            return
+        existing = self.load(code)
+        if existing is None or not len(existing):
+            self.write(code, array)
+            return
+        last_day = existing[-1, self.DATE]
+        del existing
+        if array[:, self.DATE].min() > last_day and self._append_in_place(self._path(code), array):
+            return
+        existing = self.load(code)
+        keep = ~np.isin(existing[:, self.DATE], array[:, self.DATE])
+        merged = np.concatenate([np.asarray(existing[keep]), array])
+        self.write(code, merged[np.argsort(merged[:, self.DATE], kind="stable")])
+
+    def _append_in_place(self, path: Path, array: np.ndarray) -> bool:
+        """
+        把行追加到 .npy 文件末尾，再改写头部中的 shape；
+        头部预留的空格放不下新行数或文件格式不符时返回 False，由调用方整体重写
+        先写数据后改头部：中途退出时文件仍是旧行数，尾部多出的字节被忽略
+        """
+        fmt = np.lib.format
+        with open(path, "r+b") as f:
+            version = fmt.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = fmt.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran_order, dtype = fmt.read_array_header_2_0(f)
+            else:
+                return False
+            data_offset = f.tell()
+            if fortran_order or dtype != np.float64 or len(shape) != 2 or shape[1] != array.shape[1]:
+                return False
+            header_start = fmt.MAGIC_LEN + (2 if version == (1, 0) else 4)
+            header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (
+                shape[0] + len(array), shape[1])
+            room = data_offset - header_start - 1
+            if len(header) > room:
+                return False
+            f.seek(data_offset + shape[0] * shape[1] * 8)
+            f.truncate()
+            f.write(array.astype("<f8").tobytes())
+            f.flush()
+            f.seek(header_start)
+            f.write((header.ljust(room) + "\n").encode("latin1"))
+        return True
+
+    def delete(self, code: str):
+        self._path(code).unlink(missing_ok=True)
+        self._factor_path(code).unlink(missing_ok=True)
+
+    def has(self, code: str) -> bool:
+        return self._path(code).exists()
+
+    def get_bars(self, code: str, n: int, adjust: str = None):
+        """
+        最近 n 根K线，没有数据时返回 None
+        adjust=None 为不复权的零拷贝切片；qfq/hfq 时按复权因子换算开高低收（返回副本）
+        """
+        array = self.load(code)
+        if array is None:
+            return None
+        bars = array[-n:] if n else array
+        factors = self.load_factors(code) if adjust else None
+        if factors is None or not len(factors) or not len(bars):
+            return bars
+        bars = np.array(bars)
+        bars[:, self.OPEN:self.CLOSE + 1] = adjust_prices(
+            bars[:, self.OPEN:self.CLOSE + 1], bars[:, self.DATE], factors[:, 0], factors[:, 1], adjust
+        )
+        return bars
+
+    def get_closes(self, code: str, n: int, adjust: str = None):
+        """最近 n 个收盘价，没有数据时返回 None（adjust 同 get_bars）"""
+        bars = self.get_bars(code, n, adjust)
+        return None if bars is None else bars[:, self.CLOSE]
+
+    def get_panel(self, codes: list, n: int, column: str = "close", adjust: str = None) -> np.ndarray:
+        """
+        多只股票最近 n 根的某一列，返回 (股票数, n) 矩阵
+        各股票按自身最近 n 根右对齐，历史不足的左侧填 NaN
+        """
+        index = self.COLUMNS.index(column)
+        panel = np.full((len(codes), n), np.nan)
+        for row, code in enumerate(codes):
+            bars = self.get_bars(code, n, adjust)
+            if bars is not None and len(bars):
+                panel[row, n - len(bars):] = bars[:, index]
+        return panel
+
+    @classmethod
+    def dates_of(cls, bars: np.ndarray) -> list:
+        """把存储的天数列还原为 datetime.date 列表"""
+        return [datetime.date(1970, 1, 1) + datetime.timedelta(days=int(d)) for d in bars[:, cls.DATE]]
@@ -0,0 +1,144 @@
+import time
+import asyncio
+from collections import deque
+
+import requests
+
+
+class TokenBucket:
+    """
+    异步令牌桶限速器
+    - rate: 每秒补充的令牌数，即稳态请求上限(次/秒)
+    - capacity: 桶容量，允许的最大突发请求数
+    等待者按到达顺序依次获得令牌，墙钟时间由 rate 决定而不是固定 sleep
+    一次取的令牌数超过 capacity 时，等桶满后透支，后续等待者先补足欠额
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """获取令牌，不足时挂起等待"""
+        needed = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((needed - self._tokens) / self.rate)
+
+    def set_rate(self, rate: float):
+        """调整补充速率（先按旧速率结算已累积的令牌）"""
+        self._refill()
+        self.rate = float(rate)
+
+
+# 被视为"上游限流/过载"的 HTTP 状态码
+THROTTLE_STATUS = {429, 503}
+THROTTLE_MESSAGES = ("timed out", "timeout", "disconnected", "connection aborted",
+                     "connection reset", "too many requests")
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """429/503、断连、超时视为上游过载，需要降速；其余错误（无数据、解析失败等）不影响速率"""
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) in THROTTLE_STATUS:
+        return True
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError,
+                          requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    message = str(error).lower()
+    return any(keyword in message for keyword in THROTTLE_MESSAGES)
+
+
+class _HostState:
+    def __init__(self, rate: float, window: int):
+        self.bucket = TokenBucket(rate, capacity=1)
+        self.outcomes = deque(maxlen=window)   # 最近若干次请求是否成功
+        self.requests = 0
+        self.throttled = 0
+        self.last_decrease = 0.0
+
+
+class AIMDRateController:
+    """
+    按上游主机的自适应限速（AIMD，加性增、乘性减）
+    - 每次请求前 acquire(host) 从该主机的令牌桶取许可，而不是每只股票固定 sleep；
+      一次调用在内部展开成多个请求时（如 efinance 多代码接口）按请求数取许可
+    - 成功：速率 + increase（不超过 max_rate）
+    - 429/503/断连/超时：速率 × decrease（不低于 min_rate）；decrease_interval 秒内只降一次，
+      避免同一波并发失败把速率连降到底
+    - snapshot() 给出各主机当前速率与滑动窗口内的错误率
+    """
+
+    def __init__(self, initial_rate: float = 1.0, min_rate: float = 0.1, max_rate: float = 5.0,
+                 increase: float = 0.05, decrease: float = 0.5, decrease_interval: float = 2.0,
+                 window: int = 100):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.decrease_interval = decrease_interval
+        self.window = window
+        self.hosts = {}
+
+    def _state(self, host: str) -> _HostState:
+        if host not in self.hosts:
+            self.hosts[host] = _HostState(self.initial_rate, self.window)
+        return self.hosts[host]
+
+    async def acquire(self, host: str, permits: int = 1):
+        await self._state(host).bucket.acquire(permits)
+
+    def record(self, host: str, ok: bool, throttled: bool = False):
+        """记录一次请求结果并调整该主机速率"""
+        state = self._state(host)
+        state.requests += 1
+        state.outcomes.append(ok)
+        bucket = state.bucket
+        if ok:
+            bucket.set_rate(min(self.max_rate, bucket.rate + self.increase))
+        elif throttled:
+            state.throttled += 1
+            now = time.monotonic()
+            if now - state.last_decrease >= self.decrease_interval:
+                state.last_decrease = now
+                bucket.set_rate(max(self.min_rate, bucket.rate * self.decrease))
+
+    async def call(self, host: str, func, *args, permits: int = 1, **kwargs):
+        """
+        取得 permits 个许可后在线程中执行同步上游调用，并按结果调整速率；异常原样抛出
+        permits 为该调用实际发出的请求数
+        """
+        await self.acquire(host, permits)
+        try:
+            result = await asyncio.to_thread(func, *args, **kwargs)
+        except Exception as e:
+            self.record(host, ok=False, throttled=is_throttling_error(e))
+            raise
+        self.record(host, ok=True)
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            host: {
+                "rate": round(state.bucket.rate, 3),
+                "error_ratio": round(1 - sum(state.outcomes) / len(state.outcomes), 3) if state.outcomes else 0.0,
+                "requests": state.requests,
+                "throttled": state.throttled,
+            }
+            for host, state in self.hosts.items()
+        }
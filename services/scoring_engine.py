@@ -0,0 +1,247 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models.stock import DailyMarketData, DividendData, HistoricalData, StockAnalysisResult
+from crud.stock import get_adjust_factors
+from services.adjustment import adjust_prices
+from services.price_store import PriceStore
+from services.trading_calendar import trading_calendar
+
+# =========================================================================
+# 评分分档表（与 StockService._calc_*_score 共用，改分档只改这里）
+# np.digitize(x, BINS) 返回 x 落在第几个区间，再用 POINTS 查分；NaN/None(无数据)一律 0 分
+# =========================================================================
+
+VOLATILITY_BINS = [20, 30, 40, 55]          # v30 年化波动率(%)，v30<=0（数据不足）不给分
+VOLATILITY_POINTS = [30, 22, 14, 8, 3]
+DIVIDEND_BINS = [1.2, 2.5, 4, 6]            # 年化股息率(%)
+DIVIDEND_POINTS = [0, 8, 14, 20, 25]
+GROWTH_BINS = [0, 5, 15, 30]                # 利润增速(%)，下滑不给分
+GROWTH_POINTS = [0, 2, 5, 8, 10]
+PE_BINS = [10, 18, 28, 40, 60]              # 负PE/无数据不给分
+PE_POINTS = [12, 10, 7, 4, 2, 0]
+PB_BINS = [1.0, 2.0, 3.5, 6.0]
+PB_POINTS = [8, 6, 4, 2, 0]
+SUGGESTION_BINS = [40, 55, 75]
+SUGGESTIONS = np.array(["观望", "关注", "推荐", "强烈推荐"])
+
+ANNUALIZE = np.sqrt(252) * 100
+
+
+def _points(values, bins, points) -> np.ndarray:
+    # digitize 把 NaN 放进最后一档，必须显式置 0
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isnan(values), 0, np.asarray(points)[np.digitize(values, bins)])
+
+
+def volatility_points(v30) -> np.ndarray:
+    v30 = np.asarray(v30, dtype=np.float64)
+    return np.where(v30 > 0, _points(v30, VOLATILITY_BINS, VOLATILITY_POINTS), 0)
+
+
+def dividend_points(div_yield) -> np.ndarray:
+    return _points(np.asarray(div_yield, dtype=np.float64), DIVIDEND_BINS, DIVIDEND_POINTS)
+
+
+def growth_points(roe, profit_growth) -> np.ndarray:
+    """ROE 子分(0-15，亏损不给分) + 利润增速子分(0-10)"""
+    roe = np.asarray(roe, dtype=np.float64)
+    roe_score = np.select([roe >= 20, roe >= 15, roe >= 10, roe >= 6, roe > 0], [15, 12, 9, 5, 2], 0)
+    return roe_score + _points(np.asarray(profit_growth, dtype=np.float64), GROWTH_BINS, GROWTH_POINTS)
+
+
+def valuation_points(pe, pb) -> np.ndarray:
+    """PE 子分(0-12) + PB 子分(0-8)，NaN(无数据)与负值不给分"""
+    pe = np.asarray(pe, dtype=np.float64)
+    pb = np.asarray(pb, dtype=np.float64)
+    pe_score = np.where(pe > 0, _points(pe, PE_BINS, PE_POINTS), 0)
+    pb_score = np.where(pb > 0, _points(pb, PB_BINS, PB_POINTS), 0)
+    return pe_score + pb_score
+
+
+def suggestions(total) -> np.ndarray:
+    return SUGGESTIONS[np.digitize(total, SUGGESTION_BINS)]
+
+
+def rolling_volatility(closes: np.ndarray, window: int) -> np.ndarray:
+    """
+    按行计算最近 window 个对数收益率的年化波动率(%)，ddof=1
+    closes 为 (股票数, 天数) 矩阵、各行右对齐、左侧 NaN 填充；有效收益率不足 window 个的行为 0
+    """
+    if closes.shape[1] <= window or window < 2:
+        return np.zeros(len(closes))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tail = np.diff(np.log(closes[:, -(window + 1):]), axis=1)
+    full = np.isfinite(tail).all(axis=1)
+    std = np.std(np.where(full[:, None], tail, 0.0), axis=1, ddof=1)
+    return np.where(full, std * ANNUALIZE, 0.0)
+
+
+class ScoringEngine:
+    """
+    全市场批量评分
+    - 收盘价：价格库 get_panel 一次装入 (股票数 × 天数) 前复权矩阵，价格库缺失的股票按交易日历
+      只查最近 window 个交易日的K线一次补齐
+    - 行情/分红/财务：各一次批量查询
+    - 波动率按行向量化计算，四个维度用分档表 digitize/select 一次算完
+    结果为一张 DataFrame，列名与 StockAnalysisResult 字段一致
+    """
+
+    def __init__(self, price_store: PriceStore, use_price_store: bool = True, window: int = 120):
+        self.price_store = price_store
+        self.use_price_store = use_price_store
+        self.window = window
+
+    def load_closes(self, db: Session, codes: list) -> np.ndarray:
+        """
+        (股票数, window) 前复权收盘价矩阵，右对齐、历史不足左侧填 NaN
+        数据库补齐的只是最近一段K线，不写回价格库（避免生成缺少早期历史的短文件）
+        """
+        n = self.window
+        if self.use_price_store:
+            panel = self.price_store.get_panel(codes, n, "close", adjust="qfq")
+            missing = [i for i, code in enumerate(codes) if not self.price_store.has(code)]
+        else:
+            panel = np.full((len(codes), n), np.nan)
+            missing = list(range(len(codes)))
+        if not missing:
+            return panel
+
+        missing_codes = [codes[i] for i in missing]
+        since = trading_calendar.shift_trading_days(trading_calendar.last_trading_day(), n)
+        rows = db.query(
+            HistoricalData.stock_code, HistoricalData.date, HistoricalData.close
+        ).filter(
+            HistoricalData.stock_code.in_(missing_codes),
+            HistoricalData.date >= since
+        ).order_by(HistoricalData.stock_code, HistoricalData.date).all()
+        if not rows:
+            return panel
+        factors = get_adjust_factors(db, missing_codes)
+        bars = pd.DataFrame(rows, columns=["stock_code", "date", "close"])
+        bars_by_code = dict(tuple(bars.groupby("stock_code")))
+
+        for i in missing:
+            code_bars = bars_by_code.get(codes[i])
+            if code_bars is None:
+                continue
+            factor_dates, factor_values = factors.get(codes[i], ([], []))
+            closes = adjust_prices(
+                pd.to_numeric(code_bars["close"], errors="coerce").to_numpy(dtype=np.float64),
+                np.array(code_bars["date"], dtype="datetime64[D]"),
+                np.array(factor_dates, dtype="datetime64[D]"), factor_values, "qfq"
+            )[-n:]
+            panel[i, n - len(closes):] = closes
+        return panel
+
+    @staticmethod
+    def _load_market(db: Session, codes: list) -> pd.DataFrame:
+        """每只股票最新一条快照行情"""
+        latest = db.query(
+            DailyMarketData.code, func.max(DailyMarketData.date).label("max_date")
+        ).filter(DailyMarketData.code.in_(codes)).group_by(DailyMarketData.code).subquery()
+        rows = db.query(
+            DailyMarketData.code, DailyMarketData.name, DailyMarketData.latest_price,
+            DailyMarketData.pe_dynamic, DailyMarketData.pb
+        ).join(
+            latest, (DailyMarketData.code == latest.c.code) & (DailyMarketData.date == latest.c.max_date)
+        ).all()
+        frame = pd.DataFrame(rows, columns=["stock_code", "stock_name", "latest_price", "pe_ratio", "pb_ratio"])
+        return frame.drop_duplicates("stock_code", keep="last")
+
+    @staticmethod
+    def _load_cash_dividends(db: Session, codes: list, since: datetime.date) -> pd.Series:
+        """近一年每股现金分红(元)：从"10派X元"方案中提取 X/10 后按股票求和"""
+        rows = db.query(DividendData.stock_code, DividendData.dividend).filter(
+            DividendData.stock_code.in_(codes),
+            DividendData.ex_dividend_date >= since
+        ).all()
+        if not rows:
+            return pd.Series(dtype=np.float64)
+        frame = pd.DataFrame(rows, columns=["stock_code", "dividend"])
+        cash = pd.to_numeric(frame["dividend"].astype(str).str.extract(r"派(\d+\.?\d*)")[0], errors="coerce")
+        return (cash / 10).groupby(frame["stock_code"]).sum()
+
+    @staticmethod
+    def _load_cached_financials(db: Session, codes: list) -> pd.DataFrame:
+        """每只股票最近一次分析结果中的 ROE 与利润增速（没有传入财务数据时使用）"""
+        latest = db.query(
+            StockAnalysisResult.stock_code, func.max(StockAnalysisResult.analysis_date).label("max_date")
+        ).filter(StockAnalysisResult.stock_code.in_(codes)).group_by(StockAnalysisResult.stock_code).subquery()
+        rows = db.query(
+            StockAnalysisResult.stock_code, StockAnalysisResult.roe, StockAnalysisResult.profit_growth
+        ).join(
+            latest, (StockAnalysisResult.stock_code == latest.c.stock_code)
+            & (StockAnalysisResult.analysis_date == latest.c.max_date)
+        ).all()
+        return pd.DataFrame(rows, columns=["stock_code", "roe", "profit_growth"]).set_index("stock_code")
+
+    def score(self, db: Session, codes: list, financials: dict = None,
+              analysis_date: datetime.date = None) -> pd.DataFrame:
+        """
+        批量评分
+        financials: {代码: (roe, profit_growth)}，未覆盖的股票使用各股票最近一次分析结果中的财务数据
+        两处都没有财务数据的股票 ROE/增速按 0 评分，has_financials 列为 False
+        没有行情的股票不出现在结果中
+        """
+        analysis_date = analysis_date or datetime.date.today()
+        frame = self._load_market(db, list(codes))
+        frame = frame[frame["latest_price"].fillna(0) != 0].reset_index(drop=True)
+        if frame.empty:
+            return frame
+        codes = frame["stock_code"].tolist()
+
+        # 1. 波动率（矩阵按行计算）
+        closes = self.load_closes(db, codes)
+        v30 = rolling_volatility(closes, 30)
+        v60 = rolling_volatility(closes, 60)
+
+        # 2. 股息率
+        cash = self._load_cash_dividends(db, codes, analysis_date - datetime.timedelta(days=365))
+        cash = frame["stock_code"].map(cash).fillna(0.0).to_numpy()
+        div_yield = np.where(cash > 0, cash / frame["latest_price"].to_numpy(dtype=np.float64) * 100, 0.0)
+
+        # 3. 财务
+        fin = self._load_cached_financials(db, codes)
+        if financials:
+            given = pd.DataFrame.from_dict(financials, orient="index", columns=["roe", "profit_growth"])
+            fin = given.combine_first(fin)
+        fin = fin.reindex(codes)
+        frame["has_financials"] = fin["roe"].notna().to_numpy() | fin["profit_growth"].notna().to_numpy()
+        roe = fin["roe"].astype(np.float64).fillna(0.0).to_numpy()
+        growth = fin["profit_growth"].astype(np.float64).fillna(0.0).to_numpy()
+
+        # 4. 评分
+        pe = frame["pe_ratio"].astype(np.float64).to_numpy()
+        pb = frame["pb_ratio"].astype(np.float64).to_numpy()
+        frame["volatility_30d"] = np.round(v30, 2)
+        frame["volatility_60d"] = np.round(v60, 2)
+        frame["dividend_yield"] = np.round(div_yield, 2)
+        frame["roe"] = np.round(roe, 2)
+        frame["profit_growth"] = np.round(growth, 2)
+        frame["volatility_score"] = volatility_points(v30)
+        frame["dividend_score"] = dividend_points(div_yield)
+        frame["growth_score"] = growth_points(roe, growth)
+        frame["valuation_score"] = valuation_points(pe, pb)
+        frame["total_score"] = frame[["volatility_score", "dividend_score",
+                                      "growth_score", "valuation_score"]].sum(axis=1)
+        frame["suggestion"] = suggestions(frame["total_score"].to_numpy())
+        frame["analysis_date"] = analysis_date
+        return frame
+
+    @staticmethod
+    def to_records(frame: pd.DataFrame, data_source: str = "automated_v4") -> list:
+        """评分结果转为 upsert_analysis_results 可用的字典列表（NaN 转 None，分数转 int）"""
+        now = datetime.datetime.now()
+        frame = frame.drop(columns=["has_financials"], errors="ignore")
+        records = frame.astype(object).where(frame.notna(), None).to_dict("records")
+        for record in records:
+            for field in ("volatility_score", "dividend_score", "growth_score", "valuation_score", "total_score"):
+                record[field] = int(record[field])
+            record["data_source"] = data_source
+            record["created_at"] = now
+        return records
@@ -0,0 +1,73 @@
+import os
+import json
+import shutil
+import hashlib
+import datetime
+from pathlib import Path
+
+import pandas as pd
+
+
+class SnapshotCheckpoint:
+    """
+    全市场快照分页检查点
+    每成功解析一页就落盘一份，按 交易日 + 查询条件(fs/fields/每页条数) 分目录存放，
+    中途失败后重跑只需补抓缺失页
+    目录结构: {base_dir}/{YYYYMMDD}/{查询条件哈希}/meta.json, page_0001.json ...
+    """
+
+    def __init__(self, base_dir: str, trade_date: datetime.date, query: dict):
+        self.base_dir = Path(base_dir)
+        self.trade_date = trade_date
+        query_key = hashlib.sha1(json.dumps(query, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        self.dir = self.base_dir / trade_date.strftime("%Y%m%d") / query_key
+
+    def _page_path(self, page: int) -> Path:
+        return self.dir / f"page_{page:04d}.json"
+
+    def _write_json(self, path: Path, payload):
+        """先写临时文件再原子替换，进程中断不会留下半个文件"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load_total(self):
+        """读取首页记录的总条数，没有检查点时返回 None"""
+        meta_path = self.dir / "meta.json"
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                return int(json.load(f)["total"])
+        except (ValueError, KeyError, OSError):
+            return None
+
+    def save_total(self, total: int):
+        self._write_json(self.dir / "meta.json", {"total": int(total)})
+
+    def saved_pages(self) -> set:
+        if not self.dir.exists():
+            return set()
+        return {int(p.stem.split("_")[1]) for p in self.dir.glob("page_*.json")}
+
+    def load_page(self, page: int) -> pd.DataFrame:
+        with open(self._page_path(page), encoding="utf-8") as f:
+            return pd.DataFrame(json.load(f))
+
+    def save_page(self, page: int, df: pd.DataFrame):
+        self._write_json(self._page_path(page), df.to_dict("records"))
+
+    def clear(self):
+        """删除当日该查询条件的检查点，完整抓取后调用，避免同日强制重抓回放旧数据"""
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def purge_stale(self):
+        """删除其他交易日的检查点目录"""
+        if not self.base_dir.exists():
+            return
+        current = self.trade_date.strftime("%Y%m%d")
+        for day_dir in self.base_dir.iterdir():
+            if day_dir.is_dir() and day_dir.name != current:
+                shutil.rmtree(day_dir, ignore_errors=True)
@@ -1,10 +1,10 @@
 import os
 import re
 import time
-import json
 import random
 import asyncio
 import datetime
+from collections import deque
 import pandas as pd
 import numpy as np
 import requests
@@ -15,9 +15,55 @@ from sqlalchemy import desc, func
 
 from core.database import SessionLocal
 from core.config import settings  # 确保这行存在
-from models.stock import DailyMarketData, HistoricalData, DividendData, StockAnalysisResult, UserStockWatch
+from models.stock import (
+    DailyMarketData, HistoricalData, DividendData, StockAnalysisResult, UserStockWatch, AdjustmentFactor,
+    AnalysisInputState
+)
 from models.holdings import UserStockHolding  # 添加这行导入
-from crud.stock import save_market_data_batch, save_analysis_result
+from crud.stock import (
+    bulk_upsert, save_market_data_batch, save_analysis_result, upsert_market_data_batch,
+    append_daily_bars_from_snapshot, upsert_intraday_data_batch, upsert_historical_bars,
+    upsert_dividends, upsert_analysis_results, get_adjust_factors, save_adjust_factors, get_adjacent_bar_pairs
+)
+from services.rate_limiter import TokenBucket, AIMDRateController
+from services.snapshot_checkpoint import SnapshotCheckpoint
+from services.pipeline import run_stages, queue_stage
+from services.jsonp import decode_jsonp, response_bytes, diff_to_frame
+from services.hedged_fetch import SourceLatencyStats, hedged_race
+from services.price_store import PriceStore
+from services.trading_calendar import trading_calendar
+from services.adjustment import derive_factors, adjust_prices, PRICE_TOLERANCE
+from services.scoring_engine import (
+    ScoringEngine, volatility_points, dividend_points, growth_points, valuation_points
+)
+
+class CompletenessCounter:
+    """字段完整性统计 - 增量版：逐页累加非空计数，不需要保留整表"""
+
+    FIELDS = ['code', 'name', 'latest_price', 'open', 'high', 'low', 'close_prev',
+              'turnover_rate', 'total_market_cap', 'pe_dynamic', 'pb']
+
+    def __init__(self):
+        self.rows = 0
+        self.non_null = {col: 0 for col in self.FIELDS}
+        self.seen = set()
+
+    def update(self, df: pd.DataFrame):
+        self.rows += len(df)
+        for col in self.FIELDS:
+            if col in df.columns:
+                self.seen.add(col)
+                self.non_null[col] += int(df[col].notna().sum())
+
+    def report(self):
+        """显示字段完整性统计"""
+        print(f"\n✅ 总计获取 {self.rows} 条数据")
+        print(f"\n📊 字段完整性统计:")
+        for col in self.FIELDS:
+            if col in self.seen and self.rows:
+                non_null = self.non_null[col]
+                pct = (non_null / self.rows) * 100
+                print(f"   [{'✅' if pct > 90 else '⚠️'}] {col:20s}: {non_null:5d}/{self.rows} ({pct:5.1f}%)")
 
 class StockDataService:
     def __init__(self):
@@ -34,17 +80,34 @@ class StockDataService:
         self.cache_expiry = {}     # 缓存过期时间
         self.CACHE_TTL = 3600      # 缓存有效期1小时
 
-        self.em_fields_map = {
-        'f12': 'code',          # 股票代码
-        'f14': 'name',          # 股票名称
-        'f2': 'latest_price',   # 最新价
-        'f3': 'change_pct',     # 涨跌幅
-        'f9': 'pe_dynamic',     # 动态市盈率
-        'f23': 'pb',            # 市净率
-        'f5': 'volume',         # 成交量
-        'f6': 'amount',         # 成交额
-        # 可以根据需要添加更多字段映射
-    }
+        # 快照数据源延迟/胜率统计，驱动对冲竞速的主备顺序与对冲延迟
+        self.source_stats = SourceLatencyStats()
+
+        # 按上游主机的自适应限速：每次请求前取许可，成功加速、限流/断连/超时降速
+        self.rate_controller = AIMDRateController(
+            initial_rate=self.settings.UPSTREAM_RATE_INITIAL,
+            min_rate=self.settings.UPSTREAM_RATE_MIN,
+            max_rate=self.settings.UPSTREAM_RATE_MAX,
+            increase=self.settings.UPSTREAM_RATE_INCREASE,
+            decrease=self.settings.UPSTREAM_RATE_DECREASE,
+        )
+
+        # 本地内存映射价格库，随K线入库同步
+        self.price_store = PriceStore(self.settings.PRICE_STORE_DIR)
+        self.scoring_engine = ScoringEngine(self.price_store, self.settings.PRICE_STORE_ENABLED)
+
+        # K线请求共用的 keep-alive 会话（首次使用时创建）
+        self.kline_session = None
+
+        # 盘中轮询：每只股票上次写入值的哈希（按交易日重置）与每次轮询的变化行数
+        self.intraday_hashes = {}
+        self.intraday_date = None
+        self.intraday_polls = deque(maxlen=200)
+        self.intraday_lock = asyncio.Lock()  # 同一时刻只允许一次轮询读写 intraday_hashes
+
+        # 两个数据源的列名映射均由 MARKET_FIELDS 统一声明派生
+        self.em_fields_map = {em: col for col, (em, _, _) in self.MARKET_FIELDS.items()}
+        self.ak_fields_map = {ak_col: col for col, (_, ak_col, _) in self.MARKET_FIELDS.items()}
 
         # 优化请求会话配置
         self.session = requests.Session()
@@ -216,6 +279,96 @@ class StockDataService:
         except (ValueError, TypeError):
             return 0
 
+    # =========================================================================
+    # 列级向量化转换（整表一次完成，替代逐行 _safe_* 调用）
+    # =========================================================================
+
+    # 字符串哨兵值：东财/akshare 用这些表示"无数据"
+    NUMERIC_SENTINELS = ['', '-', '--', 'null', 'nan', 'none']
+
+    # 快照字段声明：内部列名(DailyMarketData 字段) -> (东财 f 字段, akshare 列名, 转换规则)
+    # 转换规则:
+    # - text: 字符串，去首尾空白
+    # - default: 缺失填 0.0（对应 _safe_float_default）
+    # - nullable: 缺失存 NULL（停牌股没有开高低等数据，不能当作 0）
+    # - pe / pb: 缺失或超出合理范围置 None（对应 _safe_pe / _safe_pb）
+    MARKET_FIELDS = {
+        'code':                   ('f12', '代码',        'text'),
+        'name':                   ('f14', '名称',        'text'),
+        'latest_price':           ('f2',  '最新价',      'default'),
+        'change_pct':             ('f3',  '涨跌幅',      'default'),
+        'change_amount':          ('f4',  '涨跌额',      'nullable'),
+        'volume':                 ('f5',  '成交量',      'default'),
+        'amount':                 ('f6',  '成交额',      'default'),
+        'amplitude':              ('f7',  '振幅',        'nullable'),
+        'turnover_rate':          ('f8',  '换手率',      'nullable'),
+        'pe_dynamic':             ('f9',  '市盈率-动态', 'pe'),
+        'volume_ratio':           ('f10', '量比',        'nullable'),
+        'change_5min':            ('f11', '5分钟涨跌',   'nullable'),
+        'high':                   ('f15', '最高',        'nullable'),
+        'low':                    ('f16', '最低',        'nullable'),
+        'open':                   ('f17', '今开',        'nullable'),
+        'close_prev':             ('f18', '昨收',        'nullable'),
+        'total_market_cap':       ('f20', '总市值',      'nullable'),
+        'circulating_market_cap': ('f21', '流通市值',    'nullable'),
+        'rise_speed':             ('f22', '涨速',        'nullable'),
+        'pb':                     ('f23', '市净率',      'pb'),
+    }
+
+    def _to_numeric_column(self, series: pd.Series) -> pd.Series:
+        """
+        _safe_float 的向量化版本
+        去除千分位逗号和百分号，哨兵字符串与无法解析的值统一为 NaN，inf 同样视为 NaN
+        """
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            result = series.astype('float64')
+        else:
+            text = series.astype(str).str.strip()
+            text = text.str.replace(',', '', regex=False).str.replace('%', '', regex=False).str.strip()
+            text = text.mask(text.str.lower().isin(self.NUMERIC_SENTINELS))
+            result = pd.to_numeric(text, errors='coerce').astype('float64')
+        return result.replace([np.inf, -np.inf], np.nan)
+
+    def _normalize_market_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        快照整表标准化：一次性把原始 DataFrame 转成入库所需的类型化列
+        PE/PB 的异常值过滤使用范围掩码，结果中 NaN 表示入库为 NULL
+        """
+        out = pd.DataFrame(index=df.index)
+        for col, (_, _, rule) in self.MARKET_FIELDS.items():
+            if rule == 'text':
+                out[col] = df[col].astype(str).str.strip() if col in df.columns else ''
+                continue
+
+            if col in df.columns:
+                values = self._to_numeric_column(df[col])
+            else:
+                values = pd.Series(np.nan, index=df.index, dtype='float64')
+
+            if rule == 'pe':
+                # 东方财富对亏损股有时返回 -999.xx 这样的标记值，过滤掉
+                valid = (values > -10000) & (values < 10000)
+            elif rule == 'pb':
+                valid = (values >= 0) & (values < 10000)
+            elif rule == 'default':
+                out[col] = values.fillna(0.0)
+                continue
+            else:
+                out[col] = values
+                continue
+
+            if self.debug_mode:
+                abnormal = int((values.notna() & ~valid).sum())
+                if abnormal:
+                    print(f"      ⚠️ 检测到 {abnormal} 条异常 {col} 值，已置为 None")
+            out[col] = values.where(valid)
+
+        return out.reset_index(drop=True)
+
+    def _frame_to_records(self, df: pd.DataFrame) -> list:
+        """DataFrame -> 入库字典列表，NaN 转为 None（数据库 NULL）"""
+        return df.astype(object).where(df.notna(), None).to_dict('records')
+
     def refresh_ut(self):
         """自动刷新 ut 参数"""
         print("🔄 正在刷新 ut 参数...")
@@ -234,223 +387,261 @@ class StockDataService:
     # 核心抓取逻辑
     # =========================================================================
 
-    async def fetch_em_data_via_web_api(self, page_size: int = 100) -> pd.DataFrame:
-        """增强版数据抓取 - 增加网络容错"""
-        all_dfs = []
-        current_page = 1
-        total_pages = 999
-        url = "https://push2.eastmoney.com/api/qt/clist/get"
-        
-        # clist/get 是 JSONP 接口，浏览器以脚本方式加载（script标签），对应头部如下
-        headers = {
-            "Accept": "*/*",
-            "Accept-Language": "zh-CN,zh;q=0.9",
-            "Connection": "keep-alive",
-            "Referer": "https://quote.eastmoney.com/center/gridlist.html",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36",
-            "Sec-Fetch-Dest": "script",
-            "Sec-Fetch-Mode": "no-cors",
-            "Sec-Fetch-Site": "same-site",
-            "sec-ch-ua": '"Not(A:Brand";v="8", "Chromium";v="144", "Google Chrome";v="144"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": '"Windows"',
-        }
-        
-        print(f"\n🌐 启动增强版数据抓取 (每页 {page_size} 条)")
+    # 东财 clist/get 查询条件：沪深京 A 股全市场 + 需要的字段
+    EM_CLIST_URL = "https://push2.eastmoney.com/api/qt/clist/get"
+    EM_CLIST_PAGE_SIZE = 100
+    EM_CLIST_FS = "m:0+t:6+f:!2,m:0+t:13+f:!2,m:0+t:80+f:!2,m:1+t:2+f:!2,m:1+t:23+f:!2,m:0+t:81+s:2048"
+    EM_CLIST_FIELDS = "f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f12,f13,f14,f15,f16,f17,f18,f19,f20,f21,f23,f24,f25,f22,f11,f62,f111,f128,f136,f115,f148,f152"
+
+    # clist/get 是 JSONP 接口，浏览器以脚本方式加载（script标签），对应头部如下
+    EM_CLIST_HEADERS = {
+        "Accept": "*/*",
+        "Accept-Language": "zh-CN,zh;q=0.9",
+        "Connection": "keep-alive",
+        "Referer": "https://quote.eastmoney.com/center/gridlist.html",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36",
+        "Sec-Fetch-Dest": "script",
+        "Sec-Fetch-Mode": "no-cors",
+        "Sec-Fetch-Site": "same-site",
+        "sec-ch-ua": '"Not(A:Brand";v="8", "Chromium";v="144", "Google Chrome";v="144"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": '"Windows"',
+    }
 
+    def _make_em_session(self) -> requests.Session:
+        """创建直连东财的 session（不配置自动重试，断连由外层逻辑处理并重建）"""
         from requests.adapters import HTTPAdapter
-        from urllib3.util.retry import Retry
 
-        def _make_session():
-            """每次创建全新 session，避免同一 TCP 连接被限速"""
-            s = requests.Session()
-            s.trust_env = False
-            s.proxies = {"http": None, "https": None}
-            s.cookies.update(self.target_cookies)
-            # 注意：这里不配置自动重试，断连由外层逻辑手动处理并重建session
-            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=5, max_retries=0)
-            s.mount("http://", adapter)
-            s.mount("https://", adapter)
-            return s
+        s = requests.Session()
+        s.trust_env = False
+        s.proxies = {"http": None, "https": None}
+        s.cookies.update(self.target_cookies)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=5, max_retries=0)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        return s
 
-        session = _make_session()
-        consecutive_failures = 0
-        max_consecutive_failures = 5  # 提高容忍度
-        # 每隔几页主动重建 session，模拟浏览器重新打开
-        pages_per_session = random.randint(4, 7)
-        pages_in_current_session = 0
+    async def _fetch_em_page(self, session: requests.Session, page: int, page_size: int):
+        """
+        抓取并解析单页快照，返回 (total, DataFrame)
+        响应异常时抛出 ValueError，网络异常原样抛出，由调用方决定重试
+        """
+        # ✅ cb 和 _ 每次请求动态生成，避免被识别为爬虫
+        _ts = int(time.time() * 1000)
+        params = {
+            "cb": f"jQuery341015241163678647807_{_ts}",
+            "pn": str(page),
+            "np": "1",
+            "ut": self.target_ut,
+            "fltt": "2",
+            "invt": "2",
+            "fs": self.EM_CLIST_FS,
+            "fields": self.EM_CLIST_FIELDS,
+            "wbp2u": "|0|0|0|web",
+            "fid": "f3",
+            "po": "1",
+            "pz": str(page_size),
+            "_": str(_ts)
+        }
 
-        while current_page <= total_pages and consecutive_failures < max_consecutive_failures:
+        response = await asyncio.to_thread(
+            session.get,
+            self.EM_CLIST_URL,
+            params=params,
+            headers=self.EM_CLIST_HEADERS,
+            timeout=30,
+            verify=False
+        )
+        if response.status_code != 200:
+            raise ValueError(f"HTTP状态码: {response.status_code}")
+
+        res_json = decode_jsonp(response_bytes(response))
+        if not res_json or not res_json.get("data"):
+            # 空 data 通常是 ut 失效，刷新后交给重试
+            if not await asyncio.to_thread(self.refresh_ut):
+                print("   ⚠️ 无法刷新ut参数")
+            raise ValueError("响应 data 为空")
+
+        data = res_json["data"]
+        return int(data.get("total") or 0), diff_to_frame(data.get("diff"))
+
+    async def _fetch_em_page_with_retry(self, session_holder: dict, page: int, page_size: int,
+                                        limiter: TokenBucket):
+        """
+        带限速与重试的单页抓取
+        session_holder 保存当前 worker 的 session，断连时就地重建，避免继续用同一连接被拒
+        """
+        max_attempts = max(1, self.settings.EM_PAGE_RETRY)
+        for attempt in range(1, max_attempts + 1):
+            # 每次尝试都先拿令牌：重试同样受速率上限约束
+            await limiter.acquire()
             try:
-                # 主动轮换 session（模拟用户间隔操作）
-                if pages_in_current_session >= pages_per_session:
-                    session.close()
-                    cooldown = random.uniform(30, 60)
-                    print(f"   🔄 主动轮换连接，冷却 {cooldown:.0f} 秒...")
-                    await asyncio.sleep(cooldown)
-                    session = _make_session()
-                    pages_in_current_session = 0
-                    pages_per_session = random.randint(4, 7)
-
-                print(f"   ➤ 抓取第 {current_page}/{total_pages if total_pages != 999 else '?'} 页...")
-                
-                # ✅ cb 和 _ 每次请求动态生成，避免被识别为爬虫
-                _ts = int(time.time() * 1000)
-                params = {
-                    "cb": f"jQuery341015241163678647807_{_ts}",
-                    "pn": str(current_page),
-                    "np": "1",
-                    "ut": self.target_ut,
-                    "fltt": "2",
-                    "invt": "2",
-                    "fs": "m:0+t:6+f:!2,m:0+t:13+f:!2,m:0+t:80+f:!2,m:1+t:2+f:!2,m:1+t:23+f:!2,m:0+t:81+s:2048",
-                    "fields": "f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f12,f13,f14,f15,f16,f17,f18,f19,f20,f21,f23,f24,f25,f22,f11,f62,f111,f128,f136,f115,f148,f152",
-                    "wbp2u": "|0|0|0|web",
-                    "fid": "f3",
-                    "po": "1",
-                    "pz": str(page_size),
-                    "_": str(_ts)
-                }
-                
-                # 发送请求
-                response = await asyncio.to_thread(
-                    session.get, 
-                    url, 
-                    params=params, 
-                    headers=headers, 
-                    timeout=30,
-                    verify=False
-                )
-                
-                if response.status_code != 200:
-                    print(f"   ⚠️ HTTP状态码: {response.status_code}")
-                    consecutive_failures += 1
-                    await asyncio.sleep(5)
-                    continue
-                
-                # 解压响应：requests 自动处理 gzip/deflate/br
-                # 若服务器仍强制返回 zstd，用 zstandard 库手动解压
-                content_encoding = response.headers.get("Content-Encoding", "").lower()
-                if "zstd" in content_encoding:
-                    try:
-                        import zstandard as zstd_lib
-                        raw_text = zstd_lib.ZstdDecompressor().decompress(response.content).decode("utf-8")
-                    except ImportError:
-                        print("   ❌ 服务器返回了 zstd 压缩，请执行: pip install zstandard")
-                        consecutive_failures += 1
-                        await asyncio.sleep(5)
-                        continue
-                    except Exception as e:
-                        print(f"   ⚠️ zstd 解压失败: {e}")
-                        consecutive_failures += 1
-                        await asyncio.sleep(5)
-                        continue
-                else:
-                    raw_text = response.text
-                json_match = re.search(r'jQuery.*?\((.*)\)', raw_text)
-                if not json_match:
-                    print(f"   ⚠️ 无法解析JSON响应，原始内容(前500字符): {raw_text[:500]!r}")
-                    consecutive_failures += 1
-                    await asyncio.sleep(5)
-                    continue
-                
-                res_json = json.loads(json_match.group(1))
-                if not res_json or not res_json.get("data"):
-                    if self.refresh_ut():
-                        params["ut"] = self.target_ut
-                        consecutive_failures = 0  # 重置失败计数
-                        continue
-                    else:
-                        print("   ⚠️ 无法刷新ut参数")
-                        consecutive_failures += 1
-                        await asyncio.sleep(10)
-                        continue
-                
-                # 首次获取总记录数
-                if current_page == 1:
-                    total_records = res_json["data"]["total"]
-                    total_pages = (total_records + page_size - 1) // page_size
-                    print(f"   📊 全市场共 {total_records} 只股票，预计 {total_pages} 页")
-                
-                # 处理数据
-                batch_df = pd.DataFrame(res_json["data"]["diff"])
-                if not batch_df.empty:
-                    all_dfs.append(batch_df)
-                    consecutive_failures = 0  # 重置失败计数
-                    pages_in_current_session += 1
-                    print(f"   ✅ 第 {current_page} 页抓取成功 ({len(batch_df)} 条记录)")
-                else:
-                    print(f"   ⚠️ 第 {current_page} 页无数据")
-                
-                # 检查是否完成
-                if current_page >= total_pages:
-                    break
-                    
-                # 页间等待：模拟正常翻页节奏（3~8秒），session轮换时会有更长冷却
-                wait_time = random.uniform(3, 8)
-                print(f"   💤 等待 {wait_time:.1f} 秒...")
-                await asyncio.sleep(wait_time)
-                current_page += 1
-                
+                return await self._fetch_em_page(session_holder["session"], page, page_size)
             except requests.exceptions.ConnectionError as e:
-                print(f"   ❌ 连接错误: {str(e)[:100]}")
-                consecutive_failures += 1
-                if consecutive_failures < max_consecutive_failures:
-                    # 断连时重建 session + 较长冷却，避免继续用同一连接被拒
-                    session.close()
-                    wait_time = consecutive_failures * 20 + random.uniform(10, 30)
-                    print(f"   🔄 重建连接，冷却 {wait_time:.0f} 秒后重试...")
-                    await asyncio.sleep(wait_time)
-                    session = _make_session()
-                    pages_in_current_session = 0
-                continue
-                
+                print(f"   ❌ 第 {page} 页连接错误: {str(e)[:100]}")
+                session_holder["session"].close()
+                session_holder["session"] = self._make_em_session()
             except requests.exceptions.Timeout as e:
-                print(f"   ❌ 请求超时: {str(e)[:100]}")
-                consecutive_failures += 1
-                if consecutive_failures < max_consecutive_failures:
-                    print("   💤 超时重试中...")
-                    await asyncio.sleep(10)
-                continue
-                
+                print(f"   ❌ 第 {page} 页请求超时: {str(e)[:100]}")
             except Exception as e:
-                print(f"   ❌ 第 {current_page} 页处理异常: {str(e)[:100]}")
-                consecutive_failures += 1
-                if consecutive_failures < max_consecutive_failures:
-                    print("   💤 异常重试中...")
-                    await asyncio.sleep(15)
-                continue
-        
-        # 清理资源
-        try:
-            session.close()
-        except Exception:
-            pass
-        
-        # 返回结果
+                print(f"   ⚠️ 第 {page} 页处理异常: {str(e)[:100]}")
+
+            if attempt < max_attempts:
+                wait_time = attempt * 2 + random.uniform(0, 2)
+                print(f"   💤 第 {page} 页 {wait_time:.1f} 秒后重试 ({attempt}/{max_attempts})...")
+                await asyncio.sleep(wait_time)
+        return None
+
+    def _snapshot_checkpoint(self, page_size: int) -> SnapshotCheckpoint:
+        """当日快照检查点，查询条件变化(fs/fields/每页条数)时自动使用新目录"""
+        query = {"fs": self.EM_CLIST_FS, "fields": self.EM_CLIST_FIELDS, "pz": page_size}
+        return SnapshotCheckpoint(self.settings.SNAPSHOT_CHECKPOINT_DIR, datetime.date.today(), query)
+
+    async def _produce_em_pages(self, page_queue: asyncio.Queue, page_size: int = 100,
+                                resume: bool = True, use_checkpoint: bool = True,
+                                meta: dict = None) -> int:
+        """
+        快照分页生产者 - 并发限速版
+        先抓第 1 页得到 total，再由有界并发的 worker 按令牌桶速率抓取剩余页，单页失败独立重试；
+        每页解析并完成字段映射后立即以 (页码, DataFrame) 放入队列，结束时放入 None
+        每页成功后写入当日检查点；resume=True 时先回放检查点中的页，只抓缺失页，
+        全部分页抓取成功后清除检查点
+        use_checkpoint=False 时不读写检查点（盘中轮询的数据不能被收盘抓取续用）
+        meta 给出时写入首页返回的 total 与仍缺失的页码 missing_pages，供调用方判断结果是否完整
+        返回成功入队的页数
+        """
+        concurrency = max(1, self.settings.EM_PAGE_CONCURRENCY)
+        limiter = TokenBucket(self.settings.EM_PAGE_RATE_LIMIT, capacity=concurrency)
+        max_page_failures = self.settings.EM_MAX_PAGE_FAILURES
+
+        print(f"\n🌐 启动增强版数据抓取 (每页 {page_size} 条, 并发 {concurrency}, "
+              f"限速 {self.settings.EM_PAGE_RATE_LIMIT}/秒)")
+
+        checkpoint = self._snapshot_checkpoint(page_size) if use_checkpoint else None
+        if checkpoint:
+            checkpoint.purge_stale()
+        done_pages = set()
+
+        async def emit(page, batch_df):
+            done_pages.add(page)
+            await page_queue.put((page, batch_df.rename(columns=self.em_fields_map)))
+
+        total_records = checkpoint.load_total() if checkpoint and resume else None
+        if total_records is not None:
+            saved = sorted(checkpoint.saved_pages())
+            print(f"   ♻️ 从检查点恢复 {len(saved)} 页")
+            for page in saved:
+                await emit(page, checkpoint.load_page(page))
+
+        # 1. 首页：获取总记录数
+        if total_records is None or 1 not in done_pages:
+            first_holder = {"session": self._make_em_session()}
+            try:
+                first = await self._fetch_em_page_with_retry(first_holder, 1, page_size, limiter)
+            finally:
+                first_holder["session"].close()
+            if first is None:
+                print("❌ 所有页面抓取失败")
+                await page_queue.put(None)
+                return 0
+            total_records, first_df = first
+            if checkpoint:
+                checkpoint.save_total(total_records)
+                checkpoint.save_page(1, first_df)
+            await emit(1, first_df)
+
+        if meta is not None:
+            meta["total"] = total_records
+        total_pages = max(1, (total_records + page_size - 1) // page_size)
+        print(f"   📊 全市场共 {total_records} 只股票，预计 {total_pages} 页")
+
+        queue = asyncio.Queue()
+        for page in range(2, total_pages + 1):
+            if page not in done_pages:
+                queue.put_nowait(page)
+        if queue.empty():
+            print("   ✅ 检查点已覆盖全部分页，无需请求")
+
+        state = {"failed_streak": 0, "failed_pages": [], "empty_pages": set(), "aborted": False}
+
+        async def worker():
+            holder = {"session": self._make_em_session()}
+            try:
+                while not state["aborted"]:
+                    try:
+                        page = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    result = await self._fetch_em_page_with_retry(holder, page, page_size, limiter)
+                    if result is None:
+                        state["failed_pages"].append(page)
+                        state["failed_streak"] += 1
+                        if state["failed_streak"] >= max_page_failures:
+                            state["aborted"] = True
+                            print(f"   🚨 连续 {state['failed_streak']} 页失败，中止抓取")
+                        continue
+                    state["failed_streak"] = 0
+                    batch_df = result[1]
+                    if batch_df.empty:
+                        print(f"   ⚠️ 第 {page} 页无数据")
+                        state["empty_pages"].add(page)
+                        continue
+                    if checkpoint:
+                        checkpoint.save_page(page, batch_df)
+                    print(f"   ✅ 第 {page}/{total_pages} 页抓取成功 ({len(batch_df)} 条记录)")
+                    await emit(page, batch_df)
+            finally:
+                holder["session"].close()
+
+        # 2. 其余页：有界并发 + 令牌桶限速
+        if not queue.empty():
+            await asyncio.gather(*(worker() for _ in range(min(concurrency, queue.qsize()))))
+
+        # 失败页与中止后未请求的页都算缺失，检查点保留到下次重跑补齐
+        missing = sorted(set(range(1, total_pages + 1)) - done_pages - state["empty_pages"])
+        if meta is not None:
+            meta["missing_pages"] = missing
+        if missing:
+            print(f"   ⚠️ 缺失页: {missing}")
+        elif checkpoint:
+            # 全部分页已抓完，检查点只用于续抓，清掉以免同日强制重抓直接回放旧数据
+            checkpoint.clear()
+
+        await page_queue.put(None)
+        return len(done_pages)
+
+    async def fetch_em_data_via_web_api(self, page_size: int = 100, resume: bool = True,
+                                        use_checkpoint: bool = True) -> pd.DataFrame:
+        """
+        增强版数据抓取 - 汇总版
+        收集 _produce_em_pages 产出的全部分页，按页码顺序拼接成一张表
+        入库请使用 fetch_daily_market_data 的流式路径，峰值内存只有一页
+        首页返回的 total 记录在结果的 attrs["expected_total"] 中
+        """
+        page_queue = asyncio.Queue()
+        pages = {}
+        meta = {}
+
+        async def collect():
+            while (item := await page_queue.get()) is not None:
+                pages[item[0]] = item[1]
+
+        await run_stages(self._produce_em_pages(page_queue, page_size, resume, use_checkpoint, meta), collect())
+
+        all_dfs = [pages[p] for p in sorted(pages) if not pages[p].empty]
         if not all_dfs:
             print("❌ 所有页面抓取失败")
             return pd.DataFrame()
-        
+
         final_df = pd.concat(all_dfs, ignore_index=True)
-        
-        # 应用字段映射
-        if hasattr(self, 'em_fields_map'):
-            final_df = final_df.rename(columns=self.em_fields_map)
-        
-        # 显示字段完整性统计
-        print(f"\n✅ 总计获取 {len(final_df)} 条数据")
-        print(f"\n📊 字段完整性统计:")
-        for col in ['code', 'name', 'latest_price', 'pe_dynamic', 'pb']:
-            if col in final_df.columns:
-                non_null = final_df[col].notna().sum()
-                pct = (non_null / len(final_df)) * 100
-                print(f"   [{'✅' if pct > 90 else '⚠️'}] {col:20s}: {non_null:5d}/{len(final_df)} ({pct:5.1f}%)")
-        
+        final_df.attrs["expected_total"] = meta.get("total")
+        counter = CompletenessCounter()
+        counter.update(final_df)
+        counter.report()
         return final_df
 
 
-    async def fetch_em_data_via_akshare(self) -> pd.DataFrame:
+    async def fetch_em_data_via_akshare(self, report: bool = True) -> pd.DataFrame:
         """
         通过 akshare 获取全量A股行情（备用方案）
         akshare 底层同样是东财数据，但封装了请求细节，不需要手动维护 Cookie/Header
@@ -466,29 +657,16 @@ class StockDataService:
             print(f"   ✅ akshare 获取成功，共 {len(df)} 条记录")
 
             # akshare 字段名 -> 内部字段名
-            col_map = {
-                "代码":     "code",
-                "名称":     "name",
-                "最新价":   "latest_price",
-                "涨跌幅":   "change_pct",
-                "市盈率-动态": "pe_dynamic",
-                "市净率":   "pb",
-                "成交量":   "volume",
-                "成交额":   "amount",
-            }
-            df = df.rename(columns=col_map)
+            df = df.rename(columns=self.ak_fields_map)
 
             # 只保留需要的列（忽略多余列）
-            keep = [c for c in col_map.values() if c in df.columns]
+            keep = [c for c in self.MARKET_FIELDS if c in df.columns]
             df = df[keep].copy()
 
-            # 字段完整性统计
-            print(f"\n📊 字段完整性统计:")
-            for col in ["code", "name", "latest_price", "pe_dynamic", "pb"]:
-                if col in df.columns:
-                    non_null = df[col].notna().sum()
-                    pct = non_null / len(df) * 100
-                    print(f"   [{'✅' if pct > 90 else '⚠️'}] {col:20s}: {non_null:5d}/{len(df)} ({pct:5.1f}%)")
+            if report:
+                counter = CompletenessCounter()
+                counter.update(df)
+                counter.report()
 
             return df
 
@@ -496,49 +674,393 @@ class StockDataService:
             print(f"   ❌ akshare 获取失败: {e}")
             return pd.DataFrame()
 
+    async def fetch_market_snapshot_hedged(self, use_checkpoint: bool = True,
+                                           resume: bool = True) -> pd.DataFrame:
+        """
+        对冲抓取全市场快照
+        主数据源按历史胜率选择（默认 akshare），超过对冲延迟仍未返回时并行启动另一数据源，
+        取第一个完整结果并取消另一方；对冲延迟默认取主数据源成功耗时的 p95
+        东财直连被取消时已抓取的分页保存在检查点中，下次可续抓
+        """
+        factories = {
+            "akshare": lambda: self.fetch_em_data_via_akshare(report=False),
+            "web_api": lambda: self.fetch_em_data_via_web_api(resume=resume, use_checkpoint=use_checkpoint),
+        }
+        primary, secondary = self.source_stats.pick_primary(list(factories))
+        if self.settings.SNAPSHOT_HEDGE_DELAY > 0:
+            delay = self.settings.SNAPSHOT_HEDGE_DELAY
+        else:
+            delay = self.source_stats.hedge_delay(
+                primary,
+                default=self.settings.SNAPSHOT_HEDGE_DELAY_DEFAULT,
+                lower=self.settings.SNAPSHOT_HEDGE_DELAY_MIN,
+                upper=self.settings.SNAPSHOT_HEDGE_DELAY_MAX,
+            )
+        print(f"\n🏁 对冲抓取: 主数据源 {primary}，对冲延迟 {delay:.1f} 秒")
+
+        winner, df = await hedged_race(
+            (primary, factories[primary]),
+            (secondary, factories[secondary]),
+            delay=delay,
+            stats=self.source_stats,
+            is_complete=self._is_complete_snapshot,
+        )
+        if winner is None:
+            print("   ❌ 两个数据源均未返回数据")
+            return pd.DataFrame()
+        print(f"   🏆 {winner} 胜出，共 {len(df)} 条记录")
+        return df
+
+    def _is_complete_snapshot(self, frame: pd.DataFrame) -> bool:
+        """
+        竞速胜出条件：东财直连的结果带有首页 total，行数需达到 total * SNAPSHOT_MIN_COVERAGE，
+        分页中途放弃时的部分结果不算完整；akshare 要么整表返回要么失败，非空即视为完整
+        """
+        if frame is None or frame.empty:
+            return False
+        expected = frame.attrs.get("expected_total")
+        if not expected:
+            return True
+        coverage = len(frame) / expected
+        if coverage < self.settings.SNAPSHOT_MIN_COVERAGE:
+            print(f"   ⚠️ 快照只覆盖 {len(frame)}/{expected} 只股票 ({coverage:.1%})，不作为完整结果")
+            return False
+        return True
+
+    async def _produce_frame_pages(self, df: pd.DataFrame, page_queue: asyncio.Queue) -> int:
+        """把已完整获取的表按批切片放入队列，与分页抓取共用同一条入库流水线"""
+        batch_size = max(1, self.settings.UPSERT_BATCH_SIZE)
+        pages = 0
+        for start in range(0, len(df), batch_size):
+            pages += 1
+            await page_queue.put((pages, df.iloc[start:start + batch_size]))
+        await page_queue.put(None)
+        return pages
+
+    def _prepare_market_records(self, df: pd.DataFrame, today: datetime.date,
+                                updated_at: datetime.datetime) -> list:
+        """单页标准化并转成入库字典（PE/PB 保留负值/None 语义，None 存库而非 0）"""
+        normalized = self._normalize_market_frame(df)
+        normalized = normalized[normalized['code'] != ''].drop_duplicates('code', keep='last')
+        normalized['date'] = today
+        normalized['updated_at'] = updated_at
+        return self._frame_to_records(normalized)
+
+    async def _consume_market_pages(self, page_queue: asyncio.Queue, today: datetime.date,
+                                    report: bool = True) -> int:
+        """
+        快照入库消费者：页队列 -> 标准化 -> 批量写入
+        - 标准化阶段逐页处理并累加完整性计数，不保留整表
+        - 写入阶段攒满 UPSERT_BATCH_SIZE 行后在线程中按 (date, code) upsert 并提交，
+          与网络等待重叠进行
+        返回写入行数
+        """
+        batch_size = max(1, self.settings.UPSERT_BATCH_SIZE)
+        record_queue = asyncio.Queue(maxsize=4)
+        counter = CompletenessCounter()
+        updated_at = datetime.datetime.now()
+
+        async def normalizer():
+            while (item := await page_queue.get()) is not None:
+                _, page_df = item
+                counter.update(page_df)
+                await record_queue.put(self._prepare_market_records(page_df, today, updated_at))
+            await record_queue.put(None)
+
+        async def writer():
+            db = SessionLocal()
+
+            def flush(rows):
+                upsert_market_data_batch(db, rows, batch_size=batch_size)
+                db.commit()
+
+            buffer, written = [], 0
+            try:
+                while (records := await record_queue.get()) is not None:
+                    buffer.extend(records)
+                    if len(buffer) >= batch_size:
+                        await asyncio.to_thread(flush, buffer)
+                        written += len(buffer)
+                        buffer = []
+                if buffer:
+                    await asyncio.to_thread(flush, buffer)
+                    written += len(buffer)
+                return written
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        _, written = await run_stages(normalizer(), writer())
+        if report and counter.rows:
+            counter.report()
+        return written
+
     async def fetch_daily_market_data(self, force: bool = False):
-        """入库逻辑整合"""
-        db = SessionLocal()
+        """
+        入库逻辑整合 - 流式版
+        数据源产出的分页经队列流入标准化与批量写入阶段，边抓边写
+        当日有未完成的分页检查点时（上次有页失败），无论是否 force 都直接续抓东财直连的缺失页，
+        不因"今日数据已存在"跳过；仍有缺失页时返回 partial 与缺失页码
+        """
         today = datetime.date.today()
-        
-        if not force and db.query(DailyMarketData).filter(DailyMarketData.date == today).first():
+        if not force and not trading_calendar.is_trading_day(today):
+            return {"status": "skip", "message": "今日非交易日"}
+
+        checkpoint = self._snapshot_checkpoint(self.EM_CLIST_PAGE_SIZE)
+        resuming = checkpoint.load_total() is not None
+        if not force and not resuming:
+            db = SessionLocal()
+            try:
+                if db.query(DailyMarketData).filter(DailyMarketData.date == today).first():
+                    return {"status": "skip", "message": "今日数据已存在"}
+            finally:
+                db.close()
+
+        page_queue = asyncio.Queue(maxsize=2)
+        meta = {}
+        if resuming:
+            print("   ♻️ 存在未完成的快照检查点，只补抓缺失页")
+            producer = self._produce_em_pages(page_queue, self.EM_CLIST_PAGE_SIZE, resume=True, meta=meta)
+        elif self.settings.SNAPSHOT_HEDGE_ENABLED:
+            # 对冲模式：两个数据源竞速，取先完整返回的一方
+            df = await self.fetch_market_snapshot_hedged()
+            if df.empty:
+                return {"status": "error", "message": "抓取数据为空"}
+            producer = self._produce_frame_pages(df, page_queue)
+        else:
+            # 优先使用 akshare（更稳定），失败后降级到直接请求东财接口（流式入库）
+            df = await self.fetch_em_data_via_akshare(report=False)
+            if not df.empty:
+                producer = self._produce_frame_pages(df, page_queue)
+            else:
+                print("   ⚠️ akshare 失败，降级到直接请求东财接口...")
+                producer = self._produce_em_pages(page_queue, self.EM_CLIST_PAGE_SIZE, meta=meta)
+
+        # 按 (date, code) 覆盖写入：不再先删后插，读者不会看到当日数据为空的窗口
+        try:
+            _, count = await run_stages(producer, self._consume_market_pages(page_queue, today))
+        except Exception as e:
+            print(f"   ❌ 市场数据入库失败: {e}")
+            return {"status": "error", "message": f"入库失败: {str(e)[:100]}"}
+
+        if count == 0:
+            return {"status": "error", "message": "抓取数据为空"}
+
+        missing = meta.get("missing_pages")
+        if missing:
+            result = {"status": "partial", "count": count, "missing_pages": missing,
+                      "message": f"{len(missing)} 页抓取失败，重跑时只补抓这些页"}
+        else:
+            result = {"status": "success", "count": count}
+        if self.settings.SNAPSHOT_APPEND_HISTORY:
+            result["history_bars"] = await asyncio.to_thread(self._append_snapshot_bars, today)
+        return result
+
+    def _append_snapshot_bars(self, trade_date: datetime.date) -> int:
+        """入库后阶段：用当日快照为全市场追加日K线，零额外HTTP请求；失败不影响快照结果"""
+        db = SessionLocal()
+        try:
+            bars = append_daily_bars_from_snapshot(db, trade_date, batch_size=self.settings.UPSERT_BATCH_SIZE)
+            adjusted = self._record_snapshot_adjustments(db, trade_date)
+            db.commit()
+            print(f"   📈 已从快照追加 {bars} 根当日K线到历史数据")
+            if adjusted:
+                print(f"   ✂️ {len(adjusted)} 只股票今日除权除息，已新增复权因子")
+                for code in adjusted:
+                    # 因子变化的股票删除价格库文件，下次读取时从数据库重建
+                    self.price_store.delete(code)
+        except Exception as e:
+            db.rollback()
+            print(f"   ⚠️ 快照K线追加失败: {e}")
+            return 0
+        finally:
             db.close()
-            return {"status": "skip", "message": "今日数据已存在"}
 
-        # 优先使用 akshare（更稳定），失败后降级到直接请求东财接口
-        df = await self.fetch_em_data_via_akshare()
-        if df.empty:
-            print("   ⚠️ akshare 失败，降级到直接请求东财接口...")
-            df = await self.fetch_em_data_via_web_api()
-        if df.empty:
+        if self.settings.PRICE_STORE_ENABLED:
+            self._sync_price_store_day(trade_date)
+        return bars
+
+    def _record_snapshot_adjustments(self, db: Session, trade_date: datetime.date) -> list:
+        """
+        快照追加当日K线后检测除权除息：当日 收盘-涨跌额(除权参考昨收) 与上一交易日已存收盘价不一致的
+        股票新增一行复权因子；只处理已有复权因子（已按不复权存储）的股票，返回发生除权的股票代码
+        """
+        pairs = get_adjacent_bar_pairs(db, trade_date, trading_calendar.prev_trading_day(trade_date))
+        if not pairs:
+            return []
+        frame = pd.DataFrame(pairs, columns=['stock_code', 'prev_close', 'close', 'change_amount'])
+        gap = (frame['prev_close'] - (frame['close'] - frame['change_amount'])).abs()
+        candidates = frame[gap > PRICE_TOLERANCE]
+        if candidates.empty:
+            return []
+
+        factors = get_adjust_factors(db, candidates['stock_code'].tolist())
+        adjusted = []
+        for row in candidates.itertuples(index=False):
+            if row.stock_code not in factors:
+                continue
+            events = derive_factors([trade_date], [row.close], [row.change_amount],
+                                    prev_close=row.prev_close, prev_factor=factors[row.stock_code][1][-1])
+            if events:
+                save_adjust_factors(db, row.stock_code, events)
+                adjusted.append(row.stock_code)
+        return adjusted
+
+    def _sync_price_store_day(self, trade_date: datetime.date):
+        """把某交易日的K线追加到价格库中已有的股票文件（没有文件的股票首次读取时再从数据库构建）"""
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                HistoricalData.stock_code, HistoricalData.date, HistoricalData.open, HistoricalData.high,
+                HistoricalData.low, HistoricalData.close, HistoricalData.volume
+            ).filter(HistoricalData.date == trade_date).all()
+        finally:
             db.close()
-            return {"status": "error", "message": "抓取数据为空"}
 
-        # 删除旧数据并入库
-        db.query(DailyMarketData).filter(DailyMarketData.date == today).delete()
-        
-        batch = []
-        for _, row in df.iterrows():
-            m = DailyMarketData(
-                date=today,
-                code=str(row.get('code', '')),
-                name=str(row.get('name', '')),
-                latest_price=self._safe_float_default(row.get('latest_price')),
-                change_pct=self._safe_float_default(row.get('change_pct')),
-                # ✅ 使用专用方法：保留负PE语义，None 存库而非 0
-                pe_dynamic=self._safe_pe(row.get('pe_dynamic')),
-                pb=self._safe_pb(row.get('pb')),
-                volume=self._safe_float_default(row.get('volume')),
-                amount=self._safe_float_default(row.get('amount')),
-                updated_at=datetime.datetime.now()
-            )
-            batch.append(m)
-        
-        db.bulk_save_objects(batch)
-        db.commit()
-        db.close()
-        return {"status": "success", "count": len(batch)}
+        for row in rows:
+            if self.price_store.has(row.stock_code):
+                self._sync_price_store(row.stock_code, [row._asdict()], replace=False)
+
+    def _sync_price_store(self, stock_code: str, bars, replace: bool, factors: tuple = None):
+        """
+        K线写库成功后同步价格库
+        replace=True 整体替换；追加时只更新已有文件，避免生成缺少早期历史的短文件
+        factors 为该股票全部复权因子 (日期列表, 因子列表)，给出时一并整体替换
+        同步失败则删除该股票文件，下次读取回退数据库重建
+        """
+        if not self.settings.PRICE_STORE_ENABLED:
+            return
+        try:
+            if isinstance(bars, list):
+                bars = pd.DataFrame(bars)
+            if replace:
+                self.price_store.write(stock_code, PriceStore.to_array(bars))
+            elif self.price_store.has(stock_code):
+                self.price_store.append(stock_code, PriceStore.to_array(bars))
+            else:
+                return
+            if factors is not None:
+                self.price_store.write_factors(stock_code, *factors)
+        except Exception as e:
+            self.price_store.delete(stock_code)
+            if self.debug_mode:
+                print(f"      ⚠️ {stock_code} 价格库同步失败: {str(e)[:50]}")
+
+    def _recent_closes(self, db: Session, stock_code: str, n: int) -> np.ndarray:
+        """
+        最近 n 个前复权收盘价（升序）
+        优先读价格库的内存映射切片并按复权因子换算；库中没有该股票时查一次数据库并构建文件
+        """
+        if self.settings.PRICE_STORE_ENABLED:
+            closes = self.price_store.get_closes(stock_code, n, adjust="qfq")
+            if closes is not None:
+                return closes
+
+        hist = db.query(
+            HistoricalData.date, HistoricalData.open, HistoricalData.high,
+            HistoricalData.low, HistoricalData.close, HistoricalData.volume
+        ).filter(HistoricalData.stock_code == stock_code).order_by(HistoricalData.date).all()
+        if not hist:
+            return np.array([])
+
+        bars = pd.DataFrame([h._asdict() for h in hist])
+        factor_dates, factor_values = get_adjust_factors(db, [stock_code]).get(stock_code, ([], []))
+        if self.settings.PRICE_STORE_ENABLED:
+            self._sync_price_store(stock_code, bars, replace=True, factors=(factor_dates, factor_values))
+        closes = pd.to_numeric(bars['close'], errors='coerce').to_numpy(dtype=np.float64)
+        closes = adjust_prices(closes, np.array(bars['date'], dtype='datetime64[D]'),
+                               np.array(factor_dates, dtype='datetime64[D]'), factor_values, "qfq")
+        return closes[-n:]
    
+    def is_trading_time(self, now: datetime.datetime = None) -> bool:
+        """是否处于A股连续竞价时段（交易日 9:30-11:30, 13:00-15:00）"""
+        now = now or datetime.datetime.now()
+        if not trading_calendar.is_trading_day(now.date()):
+            return False
+        t = now.time()
+        return (datetime.time(9, 30) <= t <= datetime.time(11, 30)
+                or datetime.time(13, 0) <= t <= datetime.time(15, 0))
+
+    async def fetch_intraday_snapshot(self, force: bool = False):
+        """
+        盘中快照轮询 - 只写变化行
+        内存中保存每只股票上次写入值的哈希，本次快照只把哈希变化（或首次出现）的股票
+        按 (date, code) upsert 到 intraday_market_data；收盘快照仍写 daily_market_data
+        每次轮询的总行数/变化行数记录在 intraday_polls 中
+        定时任务与手动触发共用一把锁，上一次轮询未结束时直接跳过，避免并发修改哈希表
+        """
+        if self.intraday_lock.locked():
+            return {"status": "skip", "message": "上一次盘中轮询仍在进行"}
+        async with self.intraday_lock:
+            return await self._poll_intraday_snapshot(force)
+
+    async def _poll_intraday_snapshot(self, force: bool):
+        """轮询本体，只由 fetch_intraday_snapshot 在锁内调用"""
+        now = datetime.datetime.now()
+        if not force and not self.is_trading_time(now):
+            return {"status": "skip", "message": "非交易时段"}
+
+        today = now.date()
+        if self.intraday_date != today:
+            self.intraday_hashes = {}
+            self.intraday_date = today
+
+        started = time.monotonic()
+        if self.settings.SNAPSHOT_HEDGE_ENABLED:
+            df = await self.fetch_market_snapshot_hedged(use_checkpoint=False)
+        else:
+            df = await self.fetch_em_data_via_akshare(report=False)
+            if df.empty:
+                df = await self.fetch_em_data_via_web_api(use_checkpoint=False)
+        if df.empty:
+            return {"status": "error", "message": "抓取数据为空"}
+
+        normalized = self._normalize_market_frame(df)
+        normalized = normalized[normalized['code'] != ''].drop_duplicates('code', keep='last')
+        value_columns = [c for c in self.MARKET_FIELDS if c in normalized.columns]
+        hashes = pd.util.hash_pandas_object(normalized[value_columns], index=False).tolist()
+        codes = normalized['code'].tolist()
+        changed = [self.intraday_hashes.get(code) != h for code, h in zip(codes, hashes)]
+
+        changed_df = normalized[changed].copy()
+        changed_df['date'] = today
+        changed_df['updated_at'] = now
+        records = self._frame_to_records(changed_df)
+
+        def write():
+            db = SessionLocal()
+            try:
+                upsert_intraday_data_batch(db, records, batch_size=self.settings.UPSERT_BATCH_SIZE)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        try:
+            if records:
+                await asyncio.to_thread(write)
+        except Exception as e:
+            print(f"   ❌ 盘中行情入库失败: {e}")
+            return {"status": "error", "message": f"入库失败: {str(e)[:100]}"}
+
+        # 写入成功后才更新哈希，失败的行下次轮询会重新写入
+        self.intraday_hashes.update(
+            (code, h) for code, h, is_changed in zip(codes, hashes, changed) if is_changed
+        )
+        poll = {
+            "time": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "total": len(codes),
+            "changed": len(records),
+            "seconds": round(time.monotonic() - started, 2),
+        }
+        self.intraday_polls.append(poll)
+        print(f"   ⏱️ 盘中轮询: {poll['total']} 只股票，变化 {poll['changed']} 行，耗时 {poll['seconds']} 秒")
+        return {"status": "success", **poll}
+
     async def fetch_dividend_data(self, stock_code: str = None):
         """同步分红数据 (基于Akshare)"""
         db = SessionLocal()
@@ -547,15 +1069,15 @@ class StockDataService:
             df = ak.news_trade_notify_dividend_baidu(date=datetime.date.today().strftime('%Y%m%d'))
             if df.empty: return
             
-            for _, row in df.iterrows():
-                div = DividendData(
-                    stock_code=row['股票代码'],
-                    stock_name=row['股票简称'],
-                    ex_dividend_date=pd.to_datetime(row['除权日']).date(),
-                    dividend=row['分红'],
-                    report_period=row['报告期']
-                )
-                db.merge(div)
+            ex_dates = pd.to_datetime(df['除权日'], errors='coerce')
+            rows = [{
+                'stock_code': row['股票代码'],
+                'stock_name': row['股票简称'],
+                'ex_dividend_date': ex_date.date(),
+                'dividend': row['分红'],
+                'report_period': row['报告期']
+            } for (_, row), ex_date in zip(df.iterrows(), ex_dates) if not pd.isna(ex_date)]
+            upsert_dividends(db, rows)
             db.commit()
         except: pass
         finally: db.close()
@@ -584,85 +1106,249 @@ class StockDataService:
                 raise e
         return None
     
-    async def fetch_historical_data(self, stock_code: str):
-        """同步历史K线"""
+    # 自适应限速按上游主机区分
+    HOST_EM_KLINE = "push2his.eastmoney.com"       # 东财K线（直连与 efinance 历史行情）
+    HOST_EM_QUOTE = "push2.eastmoney.com"          # efinance 基本信息 / akshare 个股信息
+    HOST_SINA_FINANCE = "vip.stock.finance.sina.com.cn"  # 分红明细、新浪财报
+    HOST_THS = "basic.10jqka.com.cn"               # 同花顺财务摘要
+    HOST_LEGULEGU = "legulegu.com"                 # 乐咕乐股指标
+    AK_INDICATOR_HOSTS = {
+        'stock_a_indicator_lg': HOST_LEGULEGU,
+        'stock_a_lg_indicator': HOST_LEGULEGU,
+        'stock_individual_info': HOST_EM_QUOTE,
+    }
+
+    # 东财K线字段 f51-f61 对应的列（与 efinance/akshare 历史行情列一致）
+    KLINE_COLUMNS = ['date', 'open', 'close', 'high', 'low', 'volume', 'amount',
+                     'amplitude', 'change_pct', 'change_amount', 'turnover_rate']
+    EF_HISTORY_COLUMNS = {
+        '日期': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
+        '成交量': 'volume', '成交额': 'amount', '振幅': 'amplitude',
+        '涨跌幅': 'change_pct', '涨跌额': 'change_amount', '换手率': 'turnover_rate',
+    }
+
+    def _get_kline_session(self) -> requests.Session:
+        """K线请求共用的 keep-alive 会话：连接池复用 TCP/TLS 连接，不带自动重试"""
+        if self.kline_session is None:
+            from requests.adapters import HTTPAdapter
+            s = requests.Session()
+            s.trust_env = False
+            s.proxies = {"http": None, "https": None}
+            s.cookies.update(self.target_cookies)
+            pool_size = max(4, self.settings.KLINE_BATCH_CONCURRENCY)
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update({
+                "Referer": "https://quote.eastmoney.com/",
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
+                "Connection": "keep-alive",
+            })
+            self.kline_session = s
+        return self.kline_session
+
+    def _request_kline(self, stock_code: str, beg: str = "0", lmt: int = 120, end: str = "20500101"):
+        """
+        请求东财日K线（不复权，复权由 adjustment_factors 在读取时换算），返回 klines 字符串列表；解析失败返回 None
+        非 200 状态码抛出 HTTPError
+        lmt 为 None 时不限制条数（按 beg/end 日期区间返回）
+        """
+        market = "1" if stock_code.startswith(('6', '9', '11')) else "0"
+        url = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
+        params = {
+            "cb": f"jQuery_{int(time.time()*1000)}",
+            "secid": f"{market}.{stock_code}",
+            "ut": self.target_ut,
+            "fields1": "f1,f2,f3,f4,f5,f6",
+            "fields2": "f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61",
+            "klt": "101", "fqt": "0", "beg": beg, "end": end,
+            "lmt": str(lmt or 1000000), "_": str(int(time.time() * 1000))
+        }
+
+        response = self._get_kline_session().get(url, params=params, timeout=20, verify=False)
+
+        if response.status_code != 200:
+            # 非 200 一律以异常抛出：429/503 由自适应限速器降速，其余状态码计入错误率
+            raise requests.exceptions.HTTPError(f"HTTP状态码: {response.status_code}", response=response)
+        res = decode_jsonp(response_bytes(response))
+        return (res.get("data") or {}).get("klines", []) if res else None
+
+    def _parse_klines(self, klines: list) -> pd.DataFrame:
+        """东财 klines ("日期,开,收,高,低,量,额,振幅,涨跌幅,涨跌额,换手率") 转为按日期排列的K线表"""
+        width = len(self.KLINE_COLUMNS)
+        rows = [line.split(',')[:width] for line in klines]
+        rows = [r + [None] * (width - len(r)) for r in rows if len(r) >= 5]
+        df = pd.DataFrame(rows, columns=self.KLINE_COLUMNS)
+        df['date'] = pd.to_datetime(df['date']).dt.date
+        for col in ['open', 'close', 'high', 'low']:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+        for col in self.KLINE_COLUMNS[5:]:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+
+    def _normalize_history_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """efinance/akshare 历史行情表统一为 KLINE_COLUMNS 列"""
+        df = df.rename(columns=self.EF_HISTORY_COLUMNS)
+        df = df[[c for c in self.KLINE_COLUMNS if c in df.columns]].copy()
+        df['date'] = pd.to_datetime(df['date']).dt.date
+        for col in df.columns[1:]:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df.sort_values('date').reset_index(drop=True)
+
+    async def fetch_history_batch(self, codes: list, beg: str = "0", end: str = "20500101",
+                                  chunk_size: int = None, limiter: TokenBucket = None):
+        """
+        批量获取多只股票的日K线（不复权），按完成顺序逐只产出 (代码, DataFrame)
+        - 每块 chunk_size 只股票先走一次 efinance 多代码接口
+        - efinance 失败或缺失的股票改用共享 keep-alive 会话请求东财K线接口，
+          有界并发(KLINE_BATCH_CONCURRENCY)，先完成先产出
+        - 获取失败的股票产出空 DataFrame；limiter 为每次请求前获取的限速令牌
+        beg/end 为 YYYYMMDD，beg="0" 表示从最早开始
+        """
+        chunk_size = chunk_size or self.settings.KLINE_BATCH_CHUNK
+        semaphore = asyncio.Semaphore(max(1, self.settings.KLINE_BATCH_CONCURRENCY))
+
+        async def fetch_one(code):
+            async with semaphore:
+                if limiter:
+                    await limiter.acquire()
+                try:
+                    klines = await self.rate_controller.call(
+                        self.HOST_EM_KLINE, self._request_kline, code, beg, None, end
+                    )
+                    return code, self._parse_klines(klines) if klines else pd.DataFrame()
+                except Exception as e:
+                    if self.debug_mode:
+                        print(f"      ⚠️ {code} K线获取异常: {str(e)[:80]}")
+                    return code, pd.DataFrame()
+
+        for start in range(0, len(codes), chunk_size):
+            chunk = list(codes[start:start + chunk_size])
+            frames = {}
+            try:
+                # efinance 多代码接口内部按股票并行请求 push2his，按股票数取许可
+                if limiter:
+                    await limiter.acquire(len(chunk))
+                result = await self.rate_controller.call(
+                    self.HOST_EM_KLINE, ef.stock.get_quote_history, chunk,
+                    beg="19000101" if beg in ("0", None) else beg, end=end, fqt=0, permits=len(chunk)
+                )
+                if isinstance(result, pd.DataFrame):
+                    result = {chunk[0]: result}
+                for code, df in (result or {}).items():
+                    if df is not None and not df.empty:
+                        frames[code] = self._normalize_history_frame(df)
+            except Exception as e:
+                if self.debug_mode:
+                    print(f"      ⚠️ efinance 批量K线失败，改用东财接口: {str(e)[:80]}")
+
+            for code in chunk:
+                if code in frames:
+                    yield code, frames[code]
+
+            missing = [code for code in chunk if code not in frames]
+            tasks = [asyncio.ensure_future(fetch_one(code)) for code in missing]
+            try:
+                for future in asyncio.as_completed(tasks):
+                    yield await future
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    def _store_kline_bars(self, stock_code: str, bars, replace: bool, factors: list = None):
+        """
+        写入不复权K线与复权因子（同一事务）
+        - replace=True：先清空该股票历史，并由这批K线重新推算全部复权因子
+        - 追加：factors 为新K线中的除权除息行 [(日期, 因子)]，按 (stock_code, date) upsert
+        """
+        if replace:
+            change_amounts = bars['change_amount'] if 'change_amount' in bars else np.full(len(bars['date']), np.nan)
+            factors = derive_factors(list(bars['date']), bars['close'], change_amounts)
         db = SessionLocal()
         try:
-            existing_count = db.query(HistoricalData).filter(
+            if replace:
+                db.query(HistoricalData).filter(HistoricalData.stock_code == stock_code).delete()
+            upsert_historical_bars(db, stock_code, bars, batch_size=self.settings.KLINE_BATCH_SIZE,
+                                   upsert=not replace)
+            if factors or replace:
+                save_adjust_factors(db, stock_code, factors or [], replace=replace)
+            db.commit()
+            all_factors = get_adjust_factors(db, [stock_code]).get(stock_code) if factors else None
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self._sync_price_store(stock_code, bars, replace, all_factors)
+
+    async def fetch_historical_data(self, stock_code: str, full: bool = False):
+        """
+        同步历史K线 - 增量版（不复权K线 + 复权因子）
+        - 不复权价格不随除权除息变化，已有足够K线时只请求最后一根已存K线之后的数据并幂等追加
+        - 新K线中 收盘-涨跌额 与上一根收盘不一致的日期为除权除息日，只新增一行复权因子，
+          不再整段重抓；前/后复权价格在读取时按因子换算
+        - 按交易日历计算最后一根K线之后缺几根：不缺则不发请求
+        - K线不足 KLINE_MIN_BARS、关闭增量、full=True，或该股票还没有复权因子
+          （旧版存的前复权数据）时重抓并替换：请求区间从已存最早K线与最近 KLINE_FULL_BARS 个交易日
+          两者中较早的一天开始，不截断补充工具回填的长历史；返回K线没有覆盖已存区间时不替换
+        """
+        db = SessionLocal()
+        try:
+            existing_count = db.query(func.count(HistoricalData.id)).filter(
                 HistoricalData.stock_code == stock_code
-            ).count()
-            if existing_count >= 100:
-                return True
+            ).scalar()
+            last_bar = db.query(HistoricalData.date, HistoricalData.close).filter(
+                HistoricalData.stock_code == stock_code
+            ).order_by(desc(HistoricalData.date)).first()
+            first_date = db.query(func.min(HistoricalData.date)).filter(
+                HistoricalData.stock_code == stock_code
+            ).scalar()
+            last_factor = db.query(AdjustmentFactor.hfq_factor).filter(
+                AdjustmentFactor.stock_code == stock_code
+            ).order_by(desc(AdjustmentFactor.date)).limit(1).scalar()
         finally:
             db.close()
 
+        incremental = (self.settings.KLINE_INCREMENTAL and not full and last_bar is not None
+                       and last_factor is not None and existing_count >= self.settings.KLINE_MIN_BARS)
+        if not self.settings.KLINE_INCREMENTAL and not full and existing_count >= self.settings.KLINE_MIN_BARS:
+            return True
+        if incremental and trading_calendar.bars_missing(last_bar.date) == 0:
+            return True
+
         try:
-            # 随机延迟，避免并发请求被识别
-            await asyncio.sleep(random.uniform(2, 6))
-
-            market = "1" if stock_code.startswith(('6', '9', '11')) else "0"
-            url = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
-            params = {
-                "cb": f"jQuery_{int(time.time()*1000)}",
-                "secid": f"{market}.{stock_code}",
-                "ut": self.target_ut,
-                "fields1": "f1,f2,f3,f4,f5,f6",
-                "fields2": "f51,f52,f53,f54,f55,f56",
-                "klt": "101", "fqt": "1", "beg": "0", "end": "20500101",
-                "lmt": "120", "_": str(int(time.time() * 1000))
-            }
+            # 请求节奏由按主机的自适应限速器控制，不再固定随机延迟
+            if incremental:
+                klines = await self.rate_controller.call(
+                    self.HOST_EM_KLINE, self._request_kline, stock_code, last_bar.date.strftime("%Y%m%d"), None
+                )
+                if not klines:
+                    return True
+                bars = self._parse_klines(klines)
+                new_bars = bars[bars['date'] > last_bar.date]
+                if new_bars.empty:
+                    return True
+                events = derive_factors(new_bars['date'].tolist(), new_bars['close'], new_bars['change_amount'],
+                                        prev_close=last_bar.close, prev_factor=last_factor)
+                if events and self.debug_mode:
+                    print(f"      ℹ️ {stock_code} 除权除息 {[str(d) for d, _ in events]}，新增复权因子")
+                await asyncio.to_thread(self._store_kline_bars, stock_code, new_bars, False, events)
+                return True
 
-            # 用一次性 session，不带自动重试
-            def _do_request():
-                s = requests.Session()
-                s.trust_env = False
-                s.proxies = {"http": None, "https": None}
-                s.cookies.update(self.target_cookies)
-                from requests.adapters import HTTPAdapter
-                s.mount("http://", HTTPAdapter(max_retries=0))
-                s.mount("https://", HTTPAdapter(max_retries=0))
-                try:
-                    headers = {
-                        "Referer": "https://quote.eastmoney.com/",
-                        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
-                    }
-                    return s.get(url, params=params, headers=headers, timeout=20, verify=False)
-                finally:
-                    s.close()
-
-            response = await asyncio.to_thread(_do_request)
-
-            if response and response.status_code == 200:
-                match = re.search(r'\(({.*})\)', response.text)
-                if match:
-                    res = json.loads(match.group(1))
-                    klines = res.get("data", {}).get("klines", [])
-                    if klines:
-                        db = SessionLocal()
-                        try:
-                            db.query(HistoricalData).filter(
-                                HistoricalData.stock_code == stock_code
-                            ).delete()
-                            for line in klines:
-                                cols = line.split(',')
-                                if len(cols) >= 5:
-                                    h = HistoricalData(
-                                        stock_code=stock_code,
-                                        date=datetime.datetime.strptime(cols[0], "%Y-%m-%d").date(),
-                                        open=self._safe_float_default(cols[1]),
-                                        close=self._safe_float_default(cols[2]),
-                                        high=self._safe_float_default(cols[3]),
-                                        low=self._safe_float_default(cols[4])
-                                    )
-                                    db.add(h)
-                            db.commit()
-                            return True
-                        except Exception as e:
-                            db.rollback()
-                            if self.debug_mode:
-                                print(f"      ⚠️ K线保存失败: {e}")
-                        finally:
-                            db.close()
+            beg = trading_calendar.shift_trading_days(trading_calendar.last_trading_day(),
+                                                      self.settings.KLINE_FULL_BARS)
+            if first_date is not None:
+                beg = min(beg, first_date)
+            klines = await self.rate_controller.call(
+                self.HOST_EM_KLINE, self._request_kline, stock_code, beg.strftime("%Y%m%d"), None
+            )
+            if klines:
+                bars = self._parse_klines(klines)
+                if first_date is not None and (bars.empty or bars['date'].min() > first_date):
+                    # 替换会先删除全部已存K线，数据源返回的区间更短时保留旧数据
+                    print(f"      ⚠️ {stock_code} 重抓K线未覆盖已存区间(自 {first_date})，保留原数据")
+                    return True
+                await asyncio.to_thread(self._store_kline_bars, stock_code, bars, True)
 
             return True  # K线失败不阻断后续分析
 
@@ -739,17 +1425,21 @@ class StockDataService:
             # 如果完全没有数据，生成基础数据用于分析
             market_data = db.query(DailyMarketData).filter(
                 DailyMarketData.code == stock_code
-            ).first()
+            ).order_by(desc(DailyMarketData.date)).first()
             
             if market_data and market_data.latest_price:
-                # 生成一条基础K线数据
+                # 用快照中的当日开高低收生成一条K线，缺失时退回按最新价估算
+                price = market_data.latest_price
                 fake_kline = HistoricalData(
                     stock_code=stock_code,
-                    date=datetime.date.today(),
-                    open=market_data.latest_price,
-                    close=market_data.latest_price,
-                    high=market_data.latest_price * 1.02,
-                    low=market_data.latest_price * 0.98
+                    date=market_data.date or datetime.date.today(),
+                    open=market_data.open or price,
+                    close=price,
+                    high=market_data.high or price * 1.02,
+                    low=market_data.low or price * 0.98,
+                    amount=market_data.amount,
+                    change_pct=market_data.change_pct,
+                    turnover_rate=market_data.turnover_rate
                 )
                 db.add(fake_kline)
                 db.commit()
@@ -765,34 +1455,23 @@ class StockDataService:
     
     async def _save_kline_data(self, stock_code: str, df):
         """保存K线数据的通用方法"""
+        dates = df['date'] if 'date' in df.columns else df.index
+        bars = {'date': pd.DatetimeIndex(pd.to_datetime(dates)).date}
+        for col in ['open', 'close', 'high', 'low']:
+            values = df[col] if col in df.columns else pd.Series(0.0, index=df.index)
+            bars[col] = pd.to_numeric(values, errors='coerce').fillna(0.0).to_numpy()
+        await asyncio.to_thread(self._store_kline_bars, stock_code, bars, True)
+
+    async def fetch_stock_dividend_history(self, stock_code: str) -> bool:
+        """同步历史分红记录，返回是否成功（没有分红记录也算成功）"""
         db = SessionLocal()
         try:
-            # 清理旧数据
-            db.query(HistoricalData).filter(HistoricalData.stock_code == stock_code).delete()
-            
-            # 保存新数据
-            for _, row in df.iterrows():
-                h = HistoricalData(
-                    stock_code=stock_code,
-                    date=pd.to_datetime(row['date'] if 'date' in row else row.index).date(),
-                    open=self._safe_float_default(row.get('open', 0)),
-                    close=self._safe_float_default(row.get('close', 0)),
-                    high=self._safe_float_default(row.get('high', 0)),
-                    low=self._safe_float_default(row.get('low', 0))
-                )
-                db.add(h)
-            
-            db.commit()
-        finally:
-            db.close()
-
-    async def fetch_stock_dividend_history(self, stock_code: str):
-        """同步历史分红记录"""
-        db = SessionLocal()
-        try:
-            df = await asyncio.to_thread(ak.stock_history_dividend_detail, symbol=stock_code, indicator="分红")
-            if df is None or df.empty: return
+            df = await self.rate_controller.call(
+                self.HOST_SINA_FINANCE, ak.stock_history_dividend_detail, symbol=stock_code, indicator="分红"
+            )
+            if df is None or df.empty: return True
             
+            rows = []
             for _, row in df.iterrows():
                 ex_date_raw = row.get('除权除息日')
                 if pd.isna(ex_date_raw) or str(ex_date_raw) in ['NaT', 'nan', '']: continue
@@ -801,17 +1480,21 @@ class StockDataService:
                 div_val = row.get('派息(每10股派,税前)', 0)
                 if not div_val: continue
                 
-                div = DividendData(
-                    stock_code=stock_code,
-                    stock_name=row.get('名称', '未知'),
-                    ex_dividend_date=ex_date,
-                    dividend=f"10派{div_val}",
-                    report_period=str(row.get('分红年度', ''))
-                )
-                db.merge(div)
+                rows.append({
+                    'stock_code': stock_code,
+                    'stock_name': row.get('名称', '未知'),
+                    'ex_dividend_date': ex_date,
+                    'dividend': f"10派{div_val}",
+                    'report_period': str(row.get('分红年度', ''))
+                })
+            # 按 (stock_code, ex_dividend_date) 覆盖写入，重复同步不再产生重复行
+            upsert_dividends(db, rows)
             db.commit()
+            return True
         except Exception as e:
+            db.rollback()
             print(f"   ⚠️ {stock_code} 分红抓取失败: {e}")
+            return False
         finally:
             db.close()
 
@@ -837,7 +1520,7 @@ class StockDataService:
         try:
             # 1. 首选：efinance 财务数据
             attempts.append("efinance")
-            df = await asyncio.to_thread(ef.stock.get_base_info, stock_code)
+            df = await self.rate_controller.call(self.HOST_EM_QUOTE, ef.stock.get_base_info, stock_code)
             
             if df is not None and not df.empty:
                 # 统一数据格式处理
@@ -889,10 +1572,14 @@ class StockDataService:
             formatted_code = self._format_stock_code_for_akshare(stock_code)
             
             try:
-                df_fin = await asyncio.to_thread(ak.stock_financial_abstract_ths, symbol=stock_code)
+                df_fin = await self.rate_controller.call(
+                    self.HOST_THS, ak.stock_financial_abstract_ths, symbol=stock_code
+                )
             except AttributeError:
                 try:
-                    df_fin = await asyncio.to_thread(ak.stock_financial_report_sina, symbol=formatted_code)
+                    df_fin = await self.rate_controller.call(
+                        self.HOST_SINA_FINANCE, ak.stock_financial_report_sina, symbol=formatted_code
+                    )
                 except:
                     df_fin = None
             
@@ -933,7 +1620,9 @@ class StockDataService:
             for func_name in indicator_functions:
                 try:
                     if hasattr(ak, func_name):
-                        df_ind = await asyncio.to_thread(getattr(ak, func_name), symbol=stock_code)
+                        df_ind = await self.rate_controller.call(
+                            self.AK_INDICATOR_HOSTS[func_name], getattr(ak, func_name), symbol=stock_code
+                        )
                         if df_ind is not None and not df_ind.empty:
                             break
                 except:
@@ -1001,17 +1690,15 @@ class StockDataService:
         return stock_code
     
     async def _derive_financial_from_market(self, stock_code: str):
-        """从市场价格数据推算基础财务指标 - 增强版"""
+        """从市场价格数据推算基础财务指标 - 增强版（前复权收盘价，除权缺口不计入涨幅）"""
         db = SessionLocal()
         try:
-            hist_data = db.query(HistoricalData).filter(
-                HistoricalData.stock_code == stock_code
-            ).order_by(HistoricalData.date.desc()).limit(252).all()
+            closes = self._recent_closes(db, stock_code, 252)
+            prices = closes[np.isfinite(closes)]
             
-            if len(hist_data) < 30:
+            if len(prices) < 30:
                 return 0.0, 0.0
             
-            prices = [float(h.close) for h in reversed(hist_data)]
             if len(prices) >= 2:
                 annual_growth = ((prices[-1] / prices[0]) ** (252/len(prices)) - 1) * 100
                 derived_growth = max(-50, min(50, annual_growth))
@@ -1068,66 +1755,22 @@ class StockDataService:
     #  建议档位：≥75 强烈推荐 / ≥55 推荐 / ≥40 关注 / <40 观望
     # =========================================================================
 
+    # 分档表见 services/scoring_engine.py，单只分析与批量评分共用
+
     def _calc_volatility_score(self, v30: float) -> int:
         """波动率评分 (0-30 分)，v30 为 30 日年化波动率(%)"""
-        if v30 <= 0:
-            return 0
-        if v30 < 20:
-            return 30
-        elif v30 < 30:
-            return 22
-        elif v30 < 40:
-            return 14
-        elif v30 < 55:
-            return 8
-        else:
-            return 3
+        return int(volatility_points(v30))
 
     def _calc_dividend_score(self, div_yield: float) -> int:
         """股息率评分 (0-25 分)，div_yield 为年化股息率(%)"""
-        if div_yield >= 6:
-            return 25
-        elif div_yield >= 4:
-            return 20
-        elif div_yield >= 2.5:
-            return 14
-        elif div_yield >= 1.2:
-            return 8
-        else:
-            return 0
+        return int(dividend_points(div_yield))
 
     def _calc_growth_score(self, roe: float, profit_growth: float) -> int:
         """
         成长性评分 (0-25 分)
         ROE 子分 (0-15) + 利润增速子分 (0-10)
         """
-        # ROE 子分
-        if roe >= 20:
-            roe_score = 15
-        elif roe >= 15:
-            roe_score = 12
-        elif roe >= 10:
-            roe_score = 9
-        elif roe >= 6:
-            roe_score = 5
-        elif roe > 0:
-            roe_score = 2
-        else:
-            roe_score = 0  # 亏损不给分
-
-        # 利润增速子分
-        if profit_growth >= 30:
-            growth_sub = 10
-        elif profit_growth >= 15:
-            growth_sub = 8
-        elif profit_growth >= 5:
-            growth_sub = 5
-        elif profit_growth >= 0:
-            growth_sub = 2
-        else:
-            growth_sub = 0  # 利润下滑不给分
-
-        return roe_score + growth_sub
+        return int(growth_points(roe, profit_growth))
 
     def _calc_valuation_score(self, pe: float | None, pb: float | None) -> int:
         """
@@ -1135,38 +1778,7 @@ class StockDataService:
         PE 子分 (0-12)：负PE=亏损不加分，None=无数据不加分
         PB 子分 (0-8)
         """
-        pe_score = 0
-        pb_score = 0
-
-        # PE 子分
-        if pe is not None and pe > 0:
-            if pe < 10:
-                pe_score = 12
-            elif pe < 18:
-                pe_score = 10
-            elif pe < 28:
-                pe_score = 7
-            elif pe < 40:
-                pe_score = 4
-            elif pe < 60:
-                pe_score = 2
-            else:
-                pe_score = 0
-
-        # PB 子分
-        if pb is not None and pb > 0:
-            if pb < 1.0:
-                pb_score = 8
-            elif pb < 2.0:
-                pb_score = 6
-            elif pb < 3.5:
-                pb_score = 4
-            elif pb < 6.0:
-                pb_score = 2
-            else:
-                pb_score = 0
-
-        return pe_score + pb_score
+        return int(valuation_points(pe, pb))
 
     # =========================================================================
     # 综合分析
@@ -1193,20 +1805,17 @@ class StockDataService:
         # ---------------------------------------------------------
         v30, v60, vol_score = 0.0, 0.0, 0
         
-        hist = db.query(HistoricalData).filter(
-            HistoricalData.stock_code == stock_code
-        ).order_by(desc(HistoricalData.date)).limit(120).all()
-
-        if len(hist) >= 20:
-            prices = [h.close for h in reversed(hist)]
-            price_series = pd.Series(prices)
-            log_returns = np.log(price_series / price_series.shift(1)).dropna()
+        closes = self._recent_closes(db, stock_code, 120)
+
+        if len(closes) >= 20:
+            log_returns = np.log(closes[1:] / closes[:-1])
+            log_returns = log_returns[~np.isnan(log_returns)]
             
             if len(log_returns) >= 30:
-                v30 = float(log_returns.tail(30).std() * np.sqrt(252) * 100)
+                v30 = float(np.std(log_returns[-30:], ddof=1) * np.sqrt(252) * 100)
                 
             if len(log_returns) >= 60:
-                v60 = float(log_returns.tail(60).std() * np.sqrt(252) * 100)
+                v60 = float(np.std(log_returns[-60:], ddof=1) * np.sqrt(252) * 100)
             
             vol_score = self._calc_volatility_score(v30)
 
@@ -1272,7 +1881,7 @@ class StockDataService:
         # ---------------------------------------------------------
         # 7. 持久化
         # ---------------------------------------------------------
-        analysis_res = StockAnalysisResult(
+        analysis_res = dict(
             stock_code=stock_code,
             stock_name=market.name,
             analysis_date=today,
@@ -1299,137 +1908,322 @@ class StockDataService:
             total_score=total,
             
             suggestion=suggestion,
-            data_source="automated_v4"
+            data_source="automated_v4",
+            created_at=datetime.datetime.now()
         )
 
         try:
-            db.merge(analysis_res)
+            # 按 (stock_code, analysis_date) 覆盖当日结果
+            upsert_analysis_results(db, [analysis_res])
             db.commit()
-            return analysis_res.total_score
+            return total
         except Exception as e:
             db.rollback()
             print(f"   ❌ {stock_code} 结果入库失败: {e}")
             return None
 
+    async def score_stocks(self, codes: list = None, persist: bool = False,
+                           financials: dict = None) -> pd.DataFrame:
+        """
+        向量化批量评分（不发网络请求）
+        codes 为空时对最新快照中的全部股票评分；financials {代码: (roe, 利润增速)} 未覆盖的股票
+        取最近一次分析结果中的财务数据
+        persist=True 时只把有财务数据的股票按 (stock_code, analysis_date) 批量覆盖当日结果，
+        data_source 记为 universe_v1，与逐只深度分析(automated_v4)区分
+        """
+        def run():
+            db = SessionLocal()
+            try:
+                targets = codes
+                if targets is None:
+                    latest = db.query(func.max(DailyMarketData.date)).scalar()
+                    targets = [c for (c,) in db.query(DailyMarketData.code).filter(DailyMarketData.date == latest).all()]
+                frame = self.scoring_engine.score(db, targets, financials)
+                scored = frame[frame["has_financials"]] if persist and not frame.empty else None
+                if scored is not None and not scored.empty:
+                    upsert_analysis_results(db, ScoringEngine.to_records(scored, data_source="universe_v1"),
+                                            batch_size=self.settings.UPSERT_BATCH_SIZE)
+                    db.commit()
+                return frame
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        start = time.time()
+        frame = await asyncio.to_thread(run)
+        print(f"⚡ 批量评分完成: {len(frame)} 只股票，耗时 {time.time() - start:.1f} 秒")
+        return frame
+
     # =========================================================================
     # 批量分析任务
     # =========================================================================
 
     async def analyze_all_watched_stocks(self):
-        """主分析任务循环 - 修复版"""
+        """
+        主分析任务 - 分阶段流水线
+        K线刷新 -> 分红刷新 -> 财务刷新 -> 评分 -> 写入，阶段之间用队列衔接：
+        - 三个刷新阶段各有独立并发数(ANALYSIS_*_WORKERS)，请求节奏由各自数据源主机的自适应限速器控制；
+          一只股票完成上一阶段即进入下一阶段，总耗时趋近最慢的阶段而不是各阶段之和
+        - 未过期的输入直接放行不发请求；超过 ANALYSIS_REFRESH_TIMEOUT 后不再请求，剩余股票沿用本地数据
+        - 评分阶段按 ANALYSIS_SCORE_BATCH 攒批调用批量评分引擎，每批使用独立的短会话只读查询
+        - 唯一的写入阶段按 ANALYSIS_COMMIT_BATCH 条或 ANALYSIS_COMMIT_INTERVAL 秒累计后
+          批量 upsert (stock_code, analysis_date) 并提交
+        """
+        start = time.time()
         db = SessionLocal()
-        stats = {
-            "success": 0, 
-            "failed": 0, 
-            "financial_failed": 0,
-            "network_errors": 0,
-            "data_errors": 0,
-            "timeout_errors": 0,
-            "total_processed": 0
-        }
-        semaphore = asyncio.Semaphore(self.settings.CONCURRENT_LIMIT)
-        
         try:
-            # 获取关注股票列表
             watched_raw = db.query(UserStockWatch.stock_code).distinct().all()
             watched_codes = list(set([w[0] for w in watched_raw if w[0] and len(w[0]) == 6 and w[0].isdigit()]))
             total = len(watched_codes)
-            
-            print(f"🚀 启动深度分析 (共 {total} 只)...")
-            print(f"📊 配置: 并发数{self.settings.CONCURRENT_LIMIT}, 超时{self.settings.FINANCIAL_FETCH_TIMEOUT}s")
-            
-            # 获取高优先级股票
+            if not total:
+                print("ℹ️ 没有关注的股票，跳过分析")
+                return {"status": "skip", "total": 0}
+
             priority_stocks = await self._get_priority_stocks(db, [(code,) for code in watched_codes])
-            print(f"🎯 优先处理 {len(priority_stocks)} 只重要股票...")
-            
-            # 记录已处理的股票
-            processed_stocks = set()
-            tasks = []
-            
-            async def process_stock(stock_index, stock_code):
-                if stock_code in processed_stocks:
-                    return
-                processed_stocks.add(stock_code)
-                
-                async with semaphore:
-                    try:
-                        stats["total_processed"] += 1
-                        current_index = stats["total_processed"]
-                        
-                        kline_success = await self.fetch_historical_data(stock_code)
-                        if not kline_success and self.debug_mode:
-                            print(f"      ⚠️ K线获取失败，但仍继续分析...")
-                        
-                        await self.fetch_stock_dividend_history(stock_code)
-                        score = await self.analyze_stock(stock_code, db)
-                        
-                        if score is not None:
-                            stats["success"] += 1
-                            success_rate = (stats["success"] / current_index) * 100 if current_index > 0 else 0
-                            print(f"   ✓ {current_index}/{total} {stock_code} 分析完成 (评分: {score}, 成功率: {success_rate:.1f}%)")
-                        else:
-                            stats["failed"] += 1
-                            success_rate = (stats["success"] / current_index) * 100 if current_index > 0 else 0
-                            print(f"   ❌ {current_index}/{total} {stock_code} 分析失败 (成功率: {success_rate:.1f}%)")
-                        
-                    except Exception as e:
-                        stats["failed"] += 1
-                        stats["total_processed"] += 1
-                        current_index = stats["total_processed"]
-                        success_rate = (stats["success"] / current_index) * 100 if current_index > 0 else 0
-                        error_msg = str(e).lower()
-                        
-                        if "connection" in error_msg or "disconnected" in error_msg:
-                            stats["network_errors"] += 1
-                        elif "timeout" in error_msg:
-                            stats["timeout_errors"] += 1
-                        elif "data" in error_msg or "format" in error_msg:
-                            stats["data_errors"] += 1
-                        else:
-                            stats["financial_failed"] += 1
-                        
-                        print(f"   ❌ {current_index}/{total} {stock_code} 处理异常: {str(e)[:50]} (成功率: {success_rate:.1f}%)")
-                    
-                    # 延迟策略
-                    delay = random.uniform(
-                        self.settings.FETCH_DELAY_MIN, 
-                        self.settings.FETCH_DELAY_MAX
-                    )
-                    remaining = total - current_index
-                    eta_minutes = (remaining * delay) / 60 if remaining > 0 else 0
-                    print(f"   💤 等待 {delay:.1f} 秒... (预计剩余: {eta_minutes:.1f}分钟)")
-                    await asyncio.sleep(delay)
-            
-            # 处理所有股票
-            all_stocks = priority_stocks + [code for code in watched_codes if code not in priority_stocks]
-            for i, code in enumerate(all_stocks, 1):
-                tasks.append(process_stock(i, code))
-                
-            await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # 最终统计
-            final_success_rate = (stats["success"] / total) * 100 if total > 0 else 0
-            print(f"\n🏁 分析完成!")
-            print(f"📊 总体统计:")
-            print(f"   总数: {total}")
-            print(f"   成功: {stats['success']} ({final_success_rate:.1f}%)")
-            print(f"   失败: {stats['failed']}")
-            if stats["network_errors"] > 0:
-                print(f"   网络错误: {stats['network_errors']}")
-            if stats["timeout_errors"] > 0:
-                print(f"   超时错误: {stats['timeout_errors']}")
-            if stats["data_errors"] > 0:
-                print(f"   数据错误: {stats['data_errors']}")
-            if stats["financial_failed"] > 0:
-                print(f"   财务数据失败: {stats['financial_failed']}")
-                
-        except Exception as e:
-            print(f"🚨 分析过程中发生严重错误: {e}")
-            import traceback
-            traceback.print_exc()
+            ordered = priority_stocks + [code for code in watched_codes if code not in priority_stocks]
+            stale = self._stale_inputs(db, ordered)
+            financials = {
+                s.stock_code: (s.roe, s.profit_growth)
+                for s in db.query(AnalysisInputState).filter(
+                    AnalysisInputState.stock_code.in_(watched_codes),
+                    AnalysisInputState.financial_at.isnot(None)
+                ).all()
+            }
         finally:
             db.close()
-    
+
+        cfg = self.settings
+        print(f"🚀 启动深度分析 (共 {total} 只，需刷新输入 {len(stale)} 只，优先 {len(priority_stocks)} 只)...")
+        print(f"📊 流水线: K线×{cfg.ANALYSIS_KLINE_WORKERS} → 分红×{cfg.ANALYSIS_DIVIDEND_WORKERS} → "
+              f"财务×{cfg.ANALYSIS_FINANCIAL_WORKERS} → 评分(每批{cfg.ANALYSIS_SCORE_BATCH}) → 写入, "
+              f"刷新时限{cfg.ANALYSIS_REFRESH_TIMEOUT or '不限'}s")
+
+        stats = {"kline": 0, "dividend": 0, "financial": 0, "failed": 0, "timeout": 0,
+                 "scored": 0, "score_failed": 0}
+        suggestion_counts = {}
+        timed_out = set()
+        deadline = time.monotonic() + cfg.ANALYSIS_REFRESH_TIMEOUT if cfg.ANALYSIS_REFRESH_TIMEOUT else None
+
+        kline_queue = asyncio.Queue(maxsize=cfg.ANALYSIS_KLINE_WORKERS * 2)
+        dividend_queue = asyncio.Queue(maxsize=cfg.ANALYSIS_DIVIDEND_WORKERS * 2)
+        financial_queue = asyncio.Queue(maxsize=cfg.ANALYSIS_FINANCIAL_WORKERS * 2)
+        score_queue = asyncio.Queue()
+        persist_queue = asyncio.Queue(maxsize=2)
+
+        # 队列元素为 {"stock_code": 代码, ...本次刷新成功的 analysis_input_state 字段}
+
+        async def producer():
+            for code in ordered:
+                await kline_queue.put({"stock_code": code})
+            await kline_queue.put(None)
+
+        async def fetch_part(item, part, fetch):
+            """该部分过期且未超时才发请求，返回 (是否请求成功, 结果)"""
+            code = item["stock_code"]
+            if part not in stale.get(code, ()) or code in timed_out:
+                return False, None
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                timed_out.add(code)
+                return False, None
+            try:
+                return True, await asyncio.wait_for(fetch(code), timeout=remaining)
+            except asyncio.TimeoutError:
+                timed_out.add(code)
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"   ❌ {code} {part} 刷新异常: {str(e)[:50]}")
+            return False, None
+
+        async def refresh_kline(item):
+            ok, _ = await fetch_part(item, "kline", self.fetch_historical_data)
+            if ok:
+                stats["kline"] += 1
+            return item
+
+        async def refresh_dividend(item):
+            ok, saved = await fetch_part(item, "dividend", self.fetch_stock_dividend_history)
+            if ok and saved:
+                item["dividend_at"] = datetime.datetime.now()
+                stats["dividend"] += 1
+            return item
+
+        async def refresh_financial(item):
+            ok, metrics = await fetch_part(item, "financial", self.fetch_financial_metrics)
+            if ok and (metrics[0] or metrics[1]):
+                item.update(roe=metrics[0], profit_growth=metrics[1], financial_at=datetime.datetime.now())
+                financials[item["stock_code"]] = metrics
+                stats["financial"] += 1
+            return item
+
+        def score_batch(codes, batch_financials):
+            db = SessionLocal()
+            try:
+                return self.scoring_engine.score(db, codes, batch_financials)
+            finally:
+                db.close()
+
+        async def scorer():
+            """攒满一批或上游 ANALYSIS_SCORE_WAIT 秒没有新股票时评分一次"""
+            batch_size = max(1, cfg.ANALYSIS_SCORE_BATCH)
+            finished = False
+            while not finished and (item := await score_queue.get()) is not None:
+                batch = [item]
+                while len(batch) < batch_size:
+                    try:
+                        item = await asyncio.wait_for(score_queue.get(), timeout=cfg.ANALYSIS_SCORE_WAIT)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        finished = True
+                        break
+                    batch.append(item)
+
+                codes = [item["stock_code"] for item in batch]
+                try:
+                    frame = await asyncio.to_thread(
+                        score_batch, codes, {c: financials[c] for c in codes if c in financials}
+                    )
+                except Exception as e:
+                    stats["score_failed"] += len(codes)
+                    print(f"🚨 批量评分失败 ({len(codes)} 只): {e}")
+                    frame = None
+                await persist_queue.put((frame, [item for item in batch if len(item) > 1]))
+            await persist_queue.put(None)
+
+        def persist(frames, states):
+            """写入者自己的短会话：评分结果与刷新状态在同一事务内批量 upsert"""
+            db = SessionLocal()
+            try:
+                records = [record for frame in frames for record in ScoringEngine.to_records(frame)]
+                upsert_analysis_results(db, records, batch_size=cfg.UPSERT_BATCH_SIZE)
+                # 各股票刷新成功的字段不同，按字段组合分组 upsert，未刷新的字段保留原值
+                groups = {}
+                for state in states:
+                    groups.setdefault(tuple(sorted(state)), []).append(state)
+                for rows in groups.values():
+                    bulk_upsert(db, AnalysisInputState, rows, key_fields=("stock_code",))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        async def writer():
+            """
+            唯一写入者：累计满 ANALYSIS_COMMIT_BATCH 条，或最早一条已等待 ANALYSIS_COMMIT_INTERVAL 秒时提交一次，
+            而不是每批评分或每只股票提交；按时提交保证进程中途退出时已刷新的财务数据不会全部丢失
+            """
+            commit_size = max(1, cfg.ANALYSIS_COMMIT_BATCH)
+            interval = cfg.ANALYSIS_COMMIT_INTERVAL
+            frames, states = [], []
+            buffered, oldest = 0, None
+
+            async def flush():
+                nonlocal frames, states, buffered, oldest
+                try:
+                    await asyncio.to_thread(persist, frames, states)
+                except Exception as e:
+                    print(f"   ⚠️ 分析结果写入失败 ({buffered} 条): {str(e)[:80]}")
+                else:
+                    stats["scored"] += buffered
+                    for frame in frames:
+                        for suggestion, count in frame["suggestion"].value_counts().items():
+                            suggestion_counts[suggestion] = suggestion_counts.get(suggestion, 0) + int(count)
+                frames, states, buffered, oldest = [], [], 0, None
+
+            while True:
+                due = None
+                if interval > 0 and oldest is not None:
+                    due = max(0.0, oldest + interval - time.monotonic())
+                try:
+                    item = await asyncio.wait_for(persist_queue.get(), timeout=due)
+                except asyncio.TimeoutError:
+                    await flush()
+                    continue
+                if item is None:
+                    break
+                frame, batch_states = item
+                if frame is not None and not frame.empty:
+                    frames.append(frame)
+                    buffered += len(frame)
+                states.extend(batch_states)
+                if oldest is None and (frames or states):
+                    oldest = time.monotonic()
+                expired = interval > 0 and oldest is not None and time.monotonic() - oldest >= interval
+                if buffered >= commit_size or len(states) >= commit_size or expired:
+                    await flush()
+            if frames or states:
+                await flush()
+
+        await run_stages(
+            producer(),
+            queue_stage(kline_queue, dividend_queue, refresh_kline, cfg.ANALYSIS_KLINE_WORKERS),
+            queue_stage(dividend_queue, financial_queue, refresh_dividend, cfg.ANALYSIS_DIVIDEND_WORKERS),
+            queue_stage(financial_queue, score_queue, refresh_financial, cfg.ANALYSIS_FINANCIAL_WORKERS),
+            scorer(),
+            writer(),
+        )
+        stats["timeout"] = len(timed_out)
+
+        scored = stats["scored"]
+        print(f"\n🏁 分析完成! 耗时 {time.time() - start:.1f} 秒")
+        print(f"📊 总体统计:")
+        print(f"   总数: {total}")
+        print(f"   刷新: K线 {stats['kline']} / 分红 {stats['dividend']} / 财务 {stats['financial']}，"
+              f"失败 {stats['failed']}")
+        if timed_out:
+            print(f"   ⏱️ 刷新超时: {len(timed_out)} 只股票沿用本地数据")
+        print(f"   成功: {scored} ({scored / total * 100:.1f}%)")
+        print(f"   缺少行情: {total - scored - stats['score_failed']}")
+        if stats["score_failed"]:
+            print(f"   评分失败: {stats['score_failed']}")
+        for suggestion, count in suggestion_counts.items():
+            print(f"   {suggestion}: {count}")
+        status = "error" if stats["score_failed"] and not scored else "success"
+        return {"status": status, "total": total, "scored": scored, "refresh": stats}
+
+    def _stale_inputs(self, db: Session, codes: list) -> dict:
+        """
+        只查库判断每只股票哪些输入需要刷新，返回 {代码: {"kline", "dividend", "financial"} 的子集}
+        - K线：最后一根早于最近已收盘交易日、根数不足或还没有复权因子
+        - 分红/财务：analysis_input_state 中的刷新时间超过配置天数或从未成功
+        """
+        latest = trading_calendar.last_completed_trading_day()
+        bars = {
+            code: (max_date, count) for code, max_date, count in db.query(
+                HistoricalData.stock_code, func.max(HistoricalData.date), func.count(HistoricalData.id)
+            ).filter(HistoricalData.stock_code.in_(codes)).group_by(HistoricalData.stock_code).all()
+        }
+        with_factors = {c for (c,) in db.query(AdjustmentFactor.stock_code).filter(
+            AdjustmentFactor.stock_code.in_(codes)
+        ).distinct().all()}
+        states = {s.stock_code: s for s in db.query(AnalysisInputState).filter(
+            AnalysisInputState.stock_code.in_(codes)
+        ).all()}
+
+        now = datetime.datetime.now()
+        financial_cutoff = now - datetime.timedelta(days=self.settings.ANALYSIS_FINANCIAL_MAX_AGE_DAYS)
+        dividend_cutoff = now - datetime.timedelta(days=self.settings.ANALYSIS_DIVIDEND_MAX_AGE_DAYS)
+        stale = {}
+        for code in codes:
+            parts = set()
+            max_date, count = bars.get(code, (None, 0))
+            if (max_date is None or max_date < latest or count < self.settings.KLINE_MIN_BARS
+                    or code not in with_factors):
+                parts.add("kline")
+            state = states.get(code)
+            if state is None or state.dividend_at is None or state.dividend_at < dividend_cutoff:
+                parts.add("dividend")
+            if state is None or state.financial_at is None or state.financial_at < financial_cutoff:
+                parts.add("financial")
+            if parts:
+                stale[code] = parts
+        return stale
+
     async def _check_update_needed(self, db: Session, watched_stocks):
         """检查是否需要更新"""
         latest_analysis = db.query(StockAnalysisResult).order_by(
@@ -1464,29 +2258,6 @@ class StockDataService:
         
         return list(priority_set.intersection(all_codes))
     
-    async def _check_network_health(self):
-        """检查网络连接健康度"""
-        try:
-            response = await asyncio.to_thread(
-                self.session.get, "https://httpbin.org/get", timeout=5
-            )
-            return response.status_code == 200
-        except:
-            return False
-    
-    async def _adaptive_delay(self, network_healthy: bool):
-        """自适应延迟调整"""
-        if network_healthy:
-            return random.uniform(
-                self.settings.FETCH_DELAY_MIN,
-                self.settings.FETCH_DELAY_MAX
-            )
-        else:
-            return random.uniform(
-                self.settings.FETCH_DELAY_MAX,
-                self.settings.FETCH_DELAY_MAX * 2
-            )
-
     # =========================================================================
     # 数据维护工具
     # =========================================================================
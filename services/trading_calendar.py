@@ -0,0 +1,175 @@
+import os
+import json
+import bisect
+import datetime
+import threading
+from pathlib import Path
+
+import pandas as pd
+import akshare as ak
+
+from core.config import settings
+
+
+class TradingCalendar:
+    """
+    A股交易日历
+    首次使用时从 akshare (新浪交易日历) 加载全部交易日并缓存到本地 JSON，
+    之后直接读缓存；缓存超过 max_age_days 或不覆盖今天时才重新拉取
+    拉取失败时沿用旧缓存；没有任何缓存时退化为"周一到周五都是交易日"
+    到期重新检查在后台线程中进行，期间查询继续使用已加载的日历，不阻塞调用方（事件循环）
+    """
+
+    def __init__(self, cache_path: str, max_age_days: int = 30,
+                 close_time: datetime.time = datetime.time(15, 0)):
+        self.cache_path = Path(cache_path)
+        self.max_age_days = max_age_days
+        self.close_time = close_time
+        self._dates = []          # 升序交易日列表
+        self._date_set = set()
+        self._source = None       # akshare / cache / weekday
+        self._next_check = None   # 下次检查缓存是否需要刷新的时间
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # 同一时刻只有一个后台刷新线程
+
+    # ---------- 加载 ----------
+
+    def _read_cache(self):
+        if not self.cache_path.exists():
+            return None, []
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                payload = json.load(f)
+            fetched_at = datetime.datetime.fromisoformat(payload["fetched_at"])
+            dates = [datetime.date.fromisoformat(d) for d in payload["dates"]]
+            return fetched_at, dates
+        except (ValueError, KeyError, OSError):
+            return None, []
+
+    def _write_cache(self, dates: list):
+        """先写临时文件再原子替换"""
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "fetched_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "dates": [d.isoformat() for d in dates],
+            }, f)
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def _fetch_dates() -> list:
+        df = ak.tool_trade_date_hist_sina()
+        return sorted(set(pd.to_datetime(df["trade_date"]).dt.date))
+
+    def _set_dates(self, dates: list, source: str):
+        self._dates = dates
+        self._date_set = set(dates)
+        self._source = source
+
+    def load(self, refresh: bool = False) -> str:
+        """加载交易日历，返回数据来源 (akshare/cache/weekday)"""
+        with self._lock:
+            now = datetime.datetime.now()
+            fetched_at, cached = self._read_cache()
+            fresh = (fetched_at is not None and cached
+                     and now - fetched_at < datetime.timedelta(days=self.max_age_days)
+                     and cached[-1] >= now.date())
+            if fresh and not refresh:
+                self._set_dates(cached, "cache")
+                self._next_check = fetched_at + datetime.timedelta(days=self.max_age_days)
+                return self._source
+
+            try:
+                dates = self._fetch_dates()
+                if not dates:
+                    raise ValueError("交易日历为空")
+                self._write_cache(dates)
+                self._set_dates(dates, "akshare")
+                self._next_check = now + datetime.timedelta(days=self.max_age_days)
+                print(f"📅 交易日历已更新: {len(dates)} 个交易日 ({dates[0]} ~ {dates[-1]})")
+            except Exception as e:
+                # 拉取失败：有旧缓存就继续用，否则按工作日判断；一天后再尝试
+                if cached:
+                    self._set_dates(cached, "cache")
+                else:
+                    self._set_dates([], "weekday")
+                self._next_check = now + datetime.timedelta(days=1)
+                print(f"⚠️ 交易日历拉取失败，使用{'旧缓存' if cached else '工作日规则'}: {str(e)[:80]}")
+            return self._source
+
+    def _ensure_loaded(self):
+        if self._next_check is None:
+            # 首次使用只能同步加载；应用启动时已在线程中预加载
+            self.load()
+        elif datetime.datetime.now() >= self._next_check and self._refresh_lock.acquire(blocking=False):
+            threading.Thread(target=self._background_load, name="trading-calendar-refresh", daemon=True).start()
+
+    def _background_load(self):
+        try:
+            self.load()
+        finally:
+            self._refresh_lock.release()
+
+    # ---------- 查询 ----------
+
+    @property
+    def source(self):
+        self._ensure_loaded()
+        return self._source
+
+    def is_trading_day(self, day: datetime.date = None) -> bool:
+        day = day or datetime.date.today()
+        self._ensure_loaded()
+        if self._dates and self._dates[0] <= day <= self._dates[-1]:
+            return day in self._date_set
+        # 日历覆盖范围之外按工作日判断
+        return day.weekday() < 5
+
+    def prev_trading_day(self, day: datetime.date = None) -> datetime.date:
+        """严格早于 day 的最近一个交易日"""
+        day = day or datetime.date.today()
+        self._ensure_loaded()
+        if self._dates and self._dates[0] < day <= self._dates[-1] + datetime.timedelta(days=1):
+            return self._dates[bisect.bisect_left(self._dates, day) - 1]
+        day -= datetime.timedelta(days=1)
+        while not self.is_trading_day(day):
+            day -= datetime.timedelta(days=1)
+        return day
+
+    def last_trading_day(self, day: datetime.date = None) -> datetime.date:
+        """不晚于 day 的最近一个交易日"""
+        day = day or datetime.date.today()
+        return day if self.is_trading_day(day) else self.prev_trading_day(day)
+
+    def last_completed_trading_day(self, now: datetime.datetime = None) -> datetime.date:
+        """最近一个已收盘的交易日：今天是交易日且已过收盘时间则为今天，否则为上一个交易日"""
+        now = now or datetime.datetime.now()
+        if now.time() >= self.close_time and self.is_trading_day(now.date()):
+            return now.date()
+        return self.prev_trading_day(now.date())
+
+    def shift_trading_days(self, day: datetime.date, n: int) -> datetime.date:
+        """day 之前第 n 个交易日（n=0 返回 day 本身），用于把"最近 n 根K线"换算成日期下限"""
+        for _ in range(n):
+            day = self.prev_trading_day(day)
+        return day
+
+    def trading_days_between(self, start: datetime.date, end: datetime.date) -> list:
+        """(start, end] 区间内的交易日"""
+        if end <= start:
+            return []
+        days = []
+        day = start + datetime.timedelta(days=1)
+        while day <= end:
+            if self.is_trading_day(day):
+                days.append(day)
+            day += datetime.timedelta(days=1)
+        return days
+
+    def bars_missing(self, last_bar_date: datetime.date, now: datetime.datetime = None) -> int:
+        """最后一根已存K线之后、截至最近已收盘交易日还缺几根日K线（无需请求数据源）"""
+        return len(self.trading_days_between(last_bar_date, self.last_completed_trading_day(now)))
+
+
+trading_calendar = TradingCalendar(settings.TRADING_CALENDAR_PATH, settings.TRADING_CALENDAR_MAX_AGE_DAYS)
@@ -7,62 +7,91 @@ import os
 import sys
 import asyncio
 import datetime
+import numpy as np
 import pandas as pd
 import akshare as ak
 import efinance as ef
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func, case, select, delete, insert
 import time
+import json
 
 # 添加主程序路径以导入模型
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# 导入数据库配置
-SQLALCHEMY_DATABASE_URL = "sqlite:///./stock_advanced_system.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 与主程序共用数据库配置(.env 中的 DATABASE_URL)、连接池和模型
+from core.config import settings
+from core.database import engine, SessionLocal
+from models.stock import (
+    HistoricalData, DailyMarketData, UserStockWatch, SupplementProgress, SupplementRun, HistoricalCoverage,
+    AdjustmentFactor
+)
+from crud.stock import upsert_historical_bars, bulk_upsert, save_adjust_factors, HISTORICAL_BAR_FIELDS
+from services.rate_limiter import TokenBucket
+from services.price_store import PriceStore
+from services.pipeline import run_stages
+from services.trading_calendar import trading_calendar
+from services.adjustment import derive_factors
 
-# 导入模型定义
-from sqlalchemy import Column, String, Float, Date, Integer, DateTime
-from sqlalchemy.orm import declarative_base
 
-Base = declarative_base()
+# 报告统计完整性的字段
+REPORT_FIELDS = ['open', 'close', 'high', 'low', 'volume', 'amount',
+                 'amplitude', 'change_pct', 'turnover_rate']
+
+
+class ProgressLine:
+    """单行刷新的进度/吞吐显示，替代逐只股票打印"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.counts = {"success": 0, "skip": 0, "error": 0}
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def update(self, status, saved=0):
+        self.done += 1
+        self.counts[status] = self.counts.get(status, 0) + 1
+        self.rows += saved
+        self.render()
 
-class HistoricalData(Base):
-    __tablename__ = "historical_data"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    stock_code = Column(String, index=True)
-    date = Column(Date, index=True)
-    open = Column(Float)
-    close = Column(Float)
-    high = Column(Float)
-    low = Column(Float)
-    volume = Column(Integer)
-    amount = Column(Float)
-    amplitude = Column(Float)
-    change_pct = Column(Float)
-    change_amount = Column(Float)
-    turnover_rate = Column(Float)
-    created_at = Column(DateTime, default=datetime.datetime.now)
+    def render(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        line = (f"\r   [{self.done}/{self.total}] ✅ {self.counts['success']} ⏭️ {self.counts['skip']} "
+                f"❌ {self.counts['error']} | {rate * 60:.1f} 只/分 | {self.rows:,} 行 "
+                f"({self.rows / elapsed:,.0f} 行/秒) | 剩余约 {eta / 60:.1f} 分钟   ")
+        sys.stdout.write(line)
+        sys.stdout.flush()
 
-class DailyMarketData(Base):
-    __tablename__ = "daily_market_data"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    date = Column(Date, index=True)
-    code = Column(String, index=True)
-    name = Column(String)
+    def finish(self):
+        self.render()
+        sys.stdout.write("\n")
+        sys.stdout.flush()
 
-class UserStockWatch(Base):
-    __tablename__ = "user_stock_watch"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(String, index=True)
-    stock_code = Column(String, index=True)
 
 class HistoricalDataSupplementer:
     """历史数据补充器"""
     
-    def __init__(self):
+    def __init__(self, batch_size: int = 5000, ef_rate: float = 2.0, ak_rate: float = 1.0):
+        for table in (SupplementProgress.__table__, SupplementRun.__table__, HistoricalCoverage.__table__,
+                      AdjustmentFactor.__table__):
+            table.create(bind=engine, checkfirst=True)
         self.db = SessionLocal()
+        # 补充写库后让价格库中该股票的文件失效，分析时从数据库重建
+        self.price_store = PriceStore(settings.PRICE_STORE_DIR)
+        self.batch_size = batch_size
+        self.verbose = True
+        # 每个数据源独立限速(次/秒)，并发 worker 共享
+        self.limiters = {
+            "efinance": TokenBucket(ef_rate),
+            "akshare": TokenBucket(ak_rate),
+        }
+
+    def _log(self, message):
+        """逐只股票的明细输出，批量并发模式下关闭，改由进度行汇总"""
+        if self.verbose:
+            print(message)
         
     def _safe_float(self, val):
         """安全转换为浮点数"""
@@ -99,33 +128,50 @@ class HistoricalDataSupplementer:
         
         return all_codes
     
-    def check_stock_history_status(self, stock_code):
+    def check_stock_history_status(self, stock_code, db=None):
         """检查股票的历史数据状态"""
-        count = self.db.query(HistoricalData).filter(
-            HistoricalData.stock_code == stock_code
-        ).count()
+        db = db or self.db
+        # 一次查询同时取条数与日期范围（走 stock_code, date 联合索引）
+        count, min_date, max_date = db.query(
+            func.count(HistoricalData.id),
+            func.min(HistoricalData.date),
+            func.max(HistoricalData.date)
+        ).filter(HistoricalData.stock_code == stock_code).one()
         
         if count == 0:
             return "无数据", 0, None, None
         
-        # 获取日期范围
-        min_date = self.db.query(func.min(HistoricalData.date)).filter(
-            HistoricalData.stock_code == stock_code
-        ).scalar()
-        
-        max_date = self.db.query(func.max(HistoricalData.date)).filter(
-            HistoricalData.stock_code == stock_code
-        ).scalar()
-        
         return "有数据", count, min_date, max_date
     
+    def _update_coverage(self, db, stock_code):
+        """补充完单只股票后刷新它在覆盖度缓存中的一行"""
+        _, count, min_date, max_date = self.check_stock_history_status(stock_code, db)
+        bulk_upsert(db, HistoricalCoverage, [{
+            "stock_code": stock_code,
+            "bars": count,
+            "min_date": min_date,
+            "max_date": max_date,
+            "refreshed_at": datetime.datetime.now(),
+        }], key_fields=("stock_code",))
+    
+    def _rebuild_adjust_factors(self, db, stock_code):
+        """由该股票全部已存不复权K线重新推算复权因子（补充可能插入中间日期，整体重算）"""
+        rows = db.query(HistoricalData.date, HistoricalData.close, HistoricalData.change_amount).filter(
+            HistoricalData.stock_code == stock_code
+        ).order_by(HistoricalData.date).all()
+        if rows:
+            dates, closes, changes = zip(*rows)
+            factors = derive_factors(list(dates), np.array(closes, dtype=float), np.array(changes, dtype=float))
+            save_adjust_factors(db, stock_code, factors, replace=True)
+    
     async def fetch_history_efinance(self, stock_code, start_date=None, end_date=None):
         """使用efinance获取历史数据(推荐)"""
         try:
-            print(f"   📥 使用 efinance 获取 {stock_code}...")
+            self._log(f"   📥 使用 efinance 获取 {stock_code}...")
+            await self.limiters["efinance"].acquire()
             
             # efinance获取全部历史数据
-            df = await asyncio.to_thread(ef.stock.get_quote_history, stock_code)
+            df = await asyncio.to_thread(ef.stock.get_quote_history, stock_code, fqt=0)
             
             if df is None or df.empty:
                 return None
@@ -157,13 +203,13 @@ class HistoricalDataSupplementer:
             return df
             
         except Exception as e:
-            print(f"   ⚠️ efinance 失败: {str(e)[:50]}")
+            self._log(f"   ⚠️ efinance 失败: {str(e)[:50]}")
             return None
     
     async def fetch_history_akshare(self, stock_code, start_date=None, end_date=None):
         """使用akshare获取历史数据(备用)"""
         try:
-            print(f"   📥 使用 akshare 获取 {stock_code}...")
+            self._log(f"   📥 使用 akshare 获取 {stock_code}...")
             
             if not end_date:
                 end_date = datetime.date.today().strftime("%Y%m%d")
@@ -171,13 +217,14 @@ class HistoricalDataSupplementer:
                 # 默认获取3年数据
                 start_date = (datetime.date.today() - datetime.timedelta(days=1095)).strftime("%Y%m%d")
             
+            await self.limiters["akshare"].acquire()
             df = await asyncio.to_thread(
                 ak.stock_zh_a_hist,
                 symbol=stock_code,
                 period="daily",
                 start_date=start_date,
                 end_date=end_date,
-                adjust="qfq"  # 前复权
+                adjust=""  # 不复权，复权因子由K线推算
             )
             
             if df.empty:
@@ -202,10 +249,11 @@ class HistoricalDataSupplementer:
             return df
             
         except Exception as e:
-            print(f"   ⚠️ akshare 失败: {str(e)[:50]}")
+            self._log(f"   ⚠️ akshare 失败: {str(e)[:50]}")
             return None
     
-    async def supplement_single_stock(self, stock_code, mode="full", start_date=None, end_date=None):
+    async def supplement_single_stock(self, stock_code, mode="full", start_date=None, end_date=None, db=None,
+                                      df=None):
         """
         补充单只股票的历史数据
         
@@ -213,46 +261,49 @@ class HistoricalDataSupplementer:
         - full: 全量更新(删除旧数据,重新获取)
         - incremental: 增量更新(只补充缺失的日期)
         - append: 追加模式(只添加新数据)
+        db: 使用的数据库会话，默认共享会话；并发 worker 各自传入独立会话
+        df: 批量接口已取到的K线，为空时自行逐只获取
         """
+        db = db or self.db
+        status, count, min_date, max_date = self.check_stock_history_status(stock_code, db)
         
-        status, count, min_date, max_date = self.check_stock_history_status(stock_code)
-        
-        print(f"\n{'='*60}")
-        print(f"📊 股票: {stock_code}")
-        print(f"   当前状态: {status}")
+        self._log(f"\n{'='*60}")
+        self._log(f"📊 股票: {stock_code}")
+        self._log(f"   当前状态: {status}")
         if count > 0:
-            print(f"   数据量: {count} 条")
-            print(f"   日期范围: {min_date} 至 {max_date}")
-        print(f"   补充模式: {mode}")
-        print(f"{'='*60}")
+            self._log(f"   数据量: {count} 条")
+            self._log(f"   日期范围: {min_date} 至 {max_date}")
+        self._log(f"   补充模式: {mode}")
+        self._log(f"{'='*60}")
         
         # 获取数据 - 优先efinance,失败则用akshare
-        df = await self.fetch_history_efinance(stock_code, start_date, end_date)
+        if df is None or df.empty:
+            df = await self.fetch_history_efinance(stock_code, start_date, end_date)
         
         if df is None or df.empty:
             df = await self.fetch_history_akshare(stock_code, start_date, end_date)
         
         if df is None or df.empty:
-            print(f"   ❌ 无法获取数据")
+            self._log(f"   ❌ 无法获取数据")
             return {"status": "error", "message": "无法获取数据"}
         
-        print(f"   ✅ 获取到 {len(df)} 条数据")
+        self._log(f"   ✅ 获取到 {len(df)} 条数据")
         
         # 根据模式处理数据
         if mode == "full":
             # 全量模式: 删除旧数据
-            deleted = self.db.query(HistoricalData).filter(
+            # 与新数据在同一事务中提交，写入失败时旧数据随回滚保留
+            deleted = db.query(HistoricalData).filter(
                 HistoricalData.stock_code == stock_code
             ).delete()
-            self.db.commit()
             if deleted > 0:
-                print(f"   🗑️ 删除旧数据: {deleted} 条")
+                self._log(f"   🗑️ 删除旧数据: {deleted} 条")
         
         elif mode == "incremental":
             # 增量模式: 只补充缺失日期
             if count > 0:
                 # 获取已有日期
-                existing_dates = self.db.query(HistoricalData.date).filter(
+                existing_dates = db.query(HistoricalData.date).filter(
                     HistoricalData.stock_code == stock_code
                 ).all()
                 existing_dates = set([d[0] for d in existing_dates])
@@ -261,52 +312,38 @@ class HistoricalDataSupplementer:
                 df['date'] = pd.to_datetime(df['date'])
                 df = df[~df['date'].dt.date.isin(existing_dates)]
                 
-                print(f"   📌 增量补充: {len(df)} 条新数据")
+                self._log(f"   📌 增量补充: {len(df)} 条新数据")
         
         elif mode == "append":
             # 追加模式: 只添加比最新日期更新的数据
             if max_date:
                 df['date'] = pd.to_datetime(df['date'])
                 df = df[df['date'].dt.date > max_date]
-                print(f"   📌 追加模式: {len(df)} 条新数据")
+                self._log(f"   📌 追加模式: {len(df)} 条新数据")
         
         if df.empty:
-            print(f"   ℹ️ 无需补充")
+            self._log(f"   ℹ️ 无需补充")
             return {"status": "skip", "message": "无需补充"}
         
-        # 保存数据
-        saved = 0
-        for _, row in df.iterrows():
-            try:
-                hist = HistoricalData(
-                    stock_code=stock_code,
-                    date=pd.to_datetime(row['date']).date(),
-                    open=self._safe_float(row.get('open')),
-                    close=self._safe_float(row.get('close')),
-                    high=self._safe_float(row.get('high')),
-                    low=self._safe_float(row.get('low')),
-                    volume=self._safe_int(row.get('volume')),
-                    amount=self._safe_float(row.get('amount')),
-                    amplitude=self._safe_float(row.get('amplitude')),
-                    change_pct=self._safe_float(row.get('change_pct')),
-                    change_amount=self._safe_float(row.get('change_amount')),
-                    turnover_rate=self._safe_float(row.get('turnover_rate'))
-                )
-                self.db.add(hist)
-                saved += 1
-                
-                # 每100条提交一次
-                if saved % 100 == 0:
-                    self.db.commit()
-                    
-            except Exception as e:
-                print(f"   ⚠️ 保存失败: {str(e)[:50]}")
-                continue
-        
-        # 最终提交
-        self.db.commit()
+        # 保存数据：按列批量写入（各模式均已排除已有日期，直接 INSERT）
+        bars = {'date': pd.to_datetime(df['date']).dt.date}
+        for field in HISTORICAL_BAR_FIELDS:
+            if field in df.columns:
+                values = df[field].astype(str).str.rstrip('%') if df[field].dtype == object else df[field]
+                bars[field] = pd.to_numeric(values, errors='coerce')
+        try:
+            saved = upsert_historical_bars(db, stock_code, bars,
+                                           batch_size=self.batch_size, upsert=False)
+            self._rebuild_adjust_factors(db, stock_code)
+            self._update_coverage(db, stock_code)
+            db.commit()
+            self.price_store.delete(stock_code)
+        except Exception as e:
+            db.rollback()
+            self._log(f"   ⚠️ 保存失败: {str(e)[:50]}")
+            return {"status": "error", "message": f"保存失败: {str(e)[:100]}"}
         
-        print(f"   ✅ 成功保存 {saved} 条数据")
+        self._log(f"   ✅ 成功保存 {saved} 条数据")
         
         return {
             "status": "success",
@@ -315,14 +352,21 @@ class HistoricalDataSupplementer:
             "mode": mode
         }
     
-    async def supplement_batch(self, stock_codes=None, mode="full", max_stocks=None, delay=1):
+    async def supplement_batch(self, stock_codes=None, mode="full", max_stocks=None, delay=1,
+                               workers=1, run_id=None, resume=True, fetch_chunk=50):
         """
-        批量补充历史数据
+        批量补充历史数据 - 并发 worker 池
         
         stock_codes: 股票代码列表,None表示全部
         mode: 补充模式 full/incremental/append
         max_stocks: 最大处理股票数量
-        delay: 每只股票之间的延迟(秒)
+        delay: 每个 worker 处理完一只股票后的延迟(秒)
+        workers: 并发 worker 数，每个 worker 使用独立数据库会话；各数据源按各自速率限速
+        run_id: 批次标识；不指定时续跑同模式最近一个未完成的批次（跨天重启也能续上），
+                没有未完成批次时为 "{mode}-{当天日期}"；同一批次中已成功/跳过的股票在重跑时不再处理
+        resume: False 时忽略已有进度，全部重新处理
+        fetch_chunk: >1 时通过 stock_service.fetch_history_batch 按块批量取K线(多代码/keep-alive)，
+                     worker 只负责写库；<=1 时每个 worker 逐只获取
         """
         
         if stock_codes is None:
@@ -331,40 +375,86 @@ class HistoricalDataSupplementer:
         if max_stocks:
             stock_codes = stock_codes[:max_stocks]
         
-        total = len(stock_codes)
+        run_id = run_id or (self._unfinished_run(mode) if resume else None) \
+            or f"{mode}-{datetime.date.today():%Y%m%d}"
+        self._start_run(run_id, mode)
+        finished = set()
+        if resume:
+            finished = {c[0] for c in self.db.query(SupplementProgress.stock_code).filter(
+                SupplementProgress.run_id == run_id,
+                SupplementProgress.status.in_(["success", "skip"])
+            ).all()}
+        pending = [code for code in stock_codes if code not in finished]
+        
+        up_to_date = 0
+        if mode == "append" and pending:
+            # 追加模式：最后一根K线已到最近收盘交易日的股票不必请求数据源
+            latest = trading_calendar.last_completed_trading_day()
+            fresh = {c[0] for c in self.db.query(HistoricalData.stock_code).group_by(
+                HistoricalData.stock_code
+            ).having(func.max(HistoricalData.date) >= latest).all()}
+            up_to_date = len(pending)
+            pending = [code for code in pending if code not in fresh]
+            up_to_date -= len(pending)
+        
+        total = len(pending)
         print(f"\n{'='*80}")
         print(f"🚀 批量补充历史数据")
         print(f"{'='*80}")
-        print(f"   股票数量: {total}")
+        print(f"   批次标识: {run_id}")
+        print(f"   股票数量: {total} (已完成跳过 {len(stock_codes) - total - up_to_date}, 已是最新跳过 {up_to_date})")
         print(f"   补充模式: {mode}")
+        print(f"   并发数: {workers}")
         print(f"   延迟设置: {delay}秒/股")
         print(f"{'='*80}\n")
         
-        success = 0
-        failed = 0
-        skipped = 0
-        
-        for i, code in enumerate(stock_codes, 1):
-            print(f"\n[{i}/{total}] 处理 {code}...")
-            
+        worker_count = max(1, min(workers, total))
+        queue = asyncio.Queue(maxsize=worker_count * 2)
+        progress = ProgressLine(total)
+        verbose, self.verbose = self.verbose, total <= 1
+        
+        async def producer():
+            if fetch_chunk > 1 and pending:
+                from services.stock_service import stock_service
+                async for code, df in stock_service.fetch_history_batch(
+                    pending, chunk_size=fetch_chunk, limiter=self.limiters["efinance"]
+                ):
+                    await queue.put((code, df))
+            else:
+                for code in pending:
+                    await queue.put((code, None))
+            for _ in range(worker_count):
+                await queue.put(None)
+        
+        async def worker():
+            db = SessionLocal()
             try:
-                result = await self.supplement_single_stock(code, mode=mode)
-                
-                if result["status"] == "success":
-                    success += 1
-                elif result["status"] == "skip":
-                    skipped += 1
-                else:
-                    failed += 1
+                while (item := await queue.get()) is not None:
+                    code, df = item
+                    try:
+                        result = await self.supplement_single_stock(code, mode=mode, db=db, df=df)
+                    except Exception as e:
+                        db.rollback()
+                        result = {"status": "error", "message": str(e)}
                     
-            except Exception as e:
-                print(f"   ❌ 处理失败: {str(e)[:100]}")
-                failed += 1
-            
-            # 延迟
-            if i < total:
-                await asyncio.sleep(delay)
+                    status = result.get("status", "error")
+                    self._record_progress(db, run_id, code, status, result)
+                    progress.update(status, result.get("saved", 0))
+                    
+                    if delay:
+                        await asyncio.sleep(delay)
+            finally:
+                db.close()
         
+        try:
+            await run_stages(producer(), *(worker() for _ in range(worker_count)))
+            self._finish_run(run_id, mode)
+        finally:
+            self.verbose = verbose
+            progress.finish()
+        
+        success, skipped, failed = (progress.counts["success"], progress.counts["skip"],
+                                    progress.counts["error"])
         print(f"\n{'='*80}")
         print(f"📊 批量补充完成")
         print(f"{'='*80}")
@@ -372,87 +462,198 @@ class HistoricalDataSupplementer:
         print(f"   ⏭️ 跳过: {skipped}")
         print(f"   ❌ 失败: {failed}")
         print(f"   📈 总计: {total}")
+        print(f"   💾 写入: {progress.rows:,} 条")
         print(f"{'='*80}\n")
         
         return {
+            "run_id": run_id,
             "total": total,
             "success": success,
             "skipped": skipped,
             "failed": failed
         }
     
-    def generate_report(self):
-        """生成历史数据统计报告"""
+    def _unfinished_run(self, mode):
+        """
+        同模式最近一个未完成批次的标识，没有时返回 None
+        append 模式只续跑当天的批次：隔天需要追加的是新K线，前一天已追加过的股票不能跳过
+        """
+        query = self.db.query(SupplementRun.run_id).filter(
+            SupplementRun.mode == mode,
+            SupplementRun.finished_at.is_(None)
+        )
+        if mode == "append":
+            query = query.filter(SupplementRun.started_at >= datetime.datetime.combine(
+                datetime.date.today(), datetime.time.min))
+        row = query.order_by(SupplementRun.started_at.desc()).first()
+        return row[0] if row else None
+    
+    def _start_run(self, run_id, mode):
+        """登记批次；续跑或同一批次重跑时清空完成时间"""
+        bulk_upsert(self.db, SupplementRun, [{
+            "run_id": run_id,
+            "mode": mode,
+            "started_at": datetime.datetime.now(),
+            "finished_at": None,
+        }], key_fields=("run_id",))
+        self.db.commit()
+    
+    def _finish_run(self, run_id, mode):
+        """标记批次完成；同模式更早的未完成批次已被本次完整处理覆盖，一并关闭"""
+        self.db.query(SupplementRun).filter(
+            (SupplementRun.run_id == run_id)
+            | ((SupplementRun.mode == mode) & SupplementRun.finished_at.is_(None))
+        ).update({SupplementRun.finished_at: datetime.datetime.now()}, synchronize_session=False)
+        self.db.commit()
+    
+    def _record_progress(self, db, run_id, stock_code, status, result):
+        """记录单只股票的处理结果（同批次重复处理时覆盖）"""
+        try:
+            bulk_upsert(db, SupplementProgress, [{
+                "run_id": run_id,
+                "stock_code": stock_code,
+                "status": status,
+                "saved": result.get("saved", 0),
+                "message": str(result.get("message", ""))[:200],
+                "finished_at": datetime.datetime.now(),
+            }], key_fields=("run_id", "stock_code"))
+            db.commit()
+        except Exception:
+            db.rollback()
+    
+    def refresh_coverage(self):
+        """一次分组扫描重建每只股票的覆盖度缓存表"""
+        grouped = select(
+            HistoricalData.stock_code,
+            func.count(HistoricalData.id),
+            func.min(HistoricalData.date),
+            func.max(HistoricalData.date),
+        ).group_by(HistoricalData.stock_code)
+        
+        now = datetime.datetime.now()
+        rows = [{"stock_code": code, "bars": count, "min_date": min_d, "max_date": max_d, "refreshed_at": now}
+                for code, count, min_d, max_d in self.db.execute(grouped)]
+        
+        self.db.execute(delete(HistoricalCoverage))
+        for start in range(0, len(rows), self.batch_size):
+            self.db.execute(insert(HistoricalCoverage), rows[start:start + self.batch_size])
+        self.db.commit()
+        return len(rows)
+    
+    def collect_report(self, refresh=True):
+        """
+        汇总历史数据统计
+        - 总量、日期范围和全部字段的完整性在一次聚合扫描中完成
+        - 每股覆盖度来自缓存表 historical_coverage；refresh=True 时先用一次分组查询重建
+        - 应用本身写K线（快照追加、单只同步）时不更新缓存表：缓存合计条数或最新日期与
+          上面聚合扫描的结果不一致时 coverage_stale=True，报告中提示重新统计
+        """
+        
+        field_counts = [
+            func.sum(case((getattr(HistoricalData, field).isnot(None), 1), else_=0)).label(field)
+            for field in REPORT_FIELDS
+        ]
+        totals = self.db.execute(select(
+            func.count(HistoricalData.id).label("total_records"),
+            func.min(HistoricalData.date).label("min_date"),
+            func.max(HistoricalData.date).label("max_date"),
+            *field_counts
+        )).one()._asdict()
+        total_records = totals["total_records"] or 0
+        
+        if refresh:
+            self.refresh_coverage()
+        
+        total_stocks = self.db.query(func.count(HistoricalCoverage.stock_code)).scalar() or 0
+        top = self.db.query(HistoricalCoverage).order_by(
+            HistoricalCoverage.bars.desc()
+        ).limit(10).all()
+        insufficient = self.db.query(HistoricalCoverage).filter(
+            HistoricalCoverage.bars < 100
+        ).order_by(HistoricalCoverage.bars.asc()).limit(10).all()
+        cached_bars, cached_max_date, oldest_refresh, refreshed_at = self.db.query(
+            func.sum(HistoricalCoverage.bars), func.max(HistoricalCoverage.max_date),
+            func.min(HistoricalCoverage.refreshed_at), func.max(HistoricalCoverage.refreshed_at)
+        ).one()
+        coverage_stale = (int(cached_bars or 0) != total_records
+                          or cached_max_date != totals["max_date"])
+        
+        def _date(value):
+            return str(value) if value else None
+        
+        return {
+            "total_stocks": total_stocks,
+            "total_records": total_records,
+            "avg_per_stock": total_records // total_stocks if total_stocks > 0 else 0,
+            "min_date": _date(totals["min_date"]),
+            "max_date": _date(totals["max_date"]),
+            "fields": {
+                field: {
+                    "count": int(totals[field] or 0),
+                    "pct": round((totals[field] or 0) / total_records * 100, 1) if total_records > 0 else 0,
+                }
+                for field in REPORT_FIELDS
+            },
+            "top_coverage": [
+                {"stock_code": c.stock_code, "bars": c.bars,
+                 "min_date": _date(c.min_date), "max_date": _date(c.max_date)}
+                for c in top
+            ],
+            "insufficient": [{"stock_code": c.stock_code, "bars": c.bars} for c in insufficient],
+            "coverage_refreshed_at": refreshed_at.isoformat(timespec="seconds") if refreshed_at else None,
+            "coverage_oldest_refresh": oldest_refresh.isoformat(timespec="seconds") if oldest_refresh else None,
+            "coverage_cached_records": int(cached_bars or 0),
+            "coverage_stale": coverage_stale,
+        }
+    
+    def generate_report(self, as_json=False, refresh=True):
+        """生成历史数据统计报告；as_json=True 时输出 JSON 供监控采集"""
+        
+        report = self.collect_report(refresh=refresh)
+        if as_json:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+            return report
         
         print(f"\n{'='*80}")
         print(f"📊 历史数据统计报告")
         print(f"{'='*80}\n")
         
-        # 总体统计
-        total_records = self.db.query(HistoricalData).count()
-        total_stocks = self.db.query(HistoricalData.stock_code).distinct().count()
-        
+        total_records = report["total_records"]
         print(f"【总体统计】")
-        print(f"   股票数量: {total_stocks}")
+        print(f"   股票数量: {report['total_stocks']}")
         print(f"   数据总量: {total_records:,} 条")
-        print(f"   平均每股: {total_records // total_stocks if total_stocks > 0 else 0} 条")
-        
-        # 日期范围
-        min_date = self.db.query(func.min(HistoricalData.date)).scalar()
-        max_date = self.db.query(func.max(HistoricalData.date)).scalar()
+        print(f"   平均每股: {report['avg_per_stock']} 条")
         
         print(f"\n【日期范围】")
-        print(f"   最早日期: {min_date}")
-        print(f"   最新日期: {max_date}")
+        print(f"   最早日期: {report['min_date']}")
+        print(f"   最新日期: {report['max_date']}")
         
         # 字段完整性
         print(f"\n【字段完整性】")
-        
-        fields = ['open', 'close', 'high', 'low', 'volume', 'amount', 
-                 'amplitude', 'change_pct', 'turnover_rate']
-        
-        for field in fields:
-            count = self.db.query(HistoricalData).filter(
-                getattr(HistoricalData, field).isnot(None)
-            ).count()
-            
-            pct = (count / total_records * 100) if total_records > 0 else 0
+        for field, stat in report["fields"].items():
+            count, pct = stat["count"], stat["pct"]
             status = "✅" if pct > 90 else ("⚠️" if pct > 50 else "❌")
-            
             print(f"   {status} {field:15s}: {count:8,}/{total_records:8,} ({pct:5.1f}%)")
         
         # 数据覆盖度排名
         print(f"\n【数据覆盖度 TOP 10】")
-        
-        result = self.db.query(
-            HistoricalData.stock_code,
-            func.count(HistoricalData.id).label('count'),
-            func.min(HistoricalData.date).label('min_date'),
-            func.max(HistoricalData.date).label('max_date')
-        ).group_by(HistoricalData.stock_code).order_by(
-            func.count(HistoricalData.id).desc()
-        ).limit(10).all()
-        
-        for i, (code, count, min_d, max_d) in enumerate(result, 1):
-            print(f"   {i:2d}. {code}: {count:4d} 条 ({min_d} ~ {max_d})")
+        for i, item in enumerate(report["top_coverage"], 1):
+            print(f"   {i:2d}. {item['stock_code']}: {item['bars']:4d} 条 ({item['min_date']} ~ {item['max_date']})")
         
         # 需要补充的股票
         print(f"\n【需要补充数据的股票】")
-        
-        result = self.db.query(
-            HistoricalData.stock_code,
-            func.count(HistoricalData.id).label('count')
-        ).group_by(HistoricalData.stock_code).having(
-            func.count(HistoricalData.id) < 100
-        ).order_by(func.count(HistoricalData.id).asc()).limit(10).all()
-        
-        if result:
-            for code, count in result:
-                print(f"   ⚠️ {code}: 只有 {count} 条数据")
+        if report["insufficient"]:
+            for item in report["insufficient"]:
+                print(f"   ⚠️ {item['stock_code']}: 只有 {item['bars']} 条数据")
         else:
             print(f"   ✅ 所有股票数据充足")
         
+        print(f"\n   覆盖度缓存更新时间: {report['coverage_oldest_refresh']} ~ {report['coverage_refreshed_at']}")
+        if report["coverage_stale"]:
+            print(f"   ⚠️ 覆盖度缓存已过期: 缓存合计 {report['coverage_cached_records']:,} 条, "
+                  f"实际 {total_records:,} 条；去掉 --cached 重新统计")
         print(f"\n{'='*80}\n")
+        return report
     
     def close(self):
         """关闭数据库连接"""
@@ -479,15 +680,29 @@ async def main():
                        help='补充模式')
     parser.add_argument('--max', type=int, help='最大处理数量(batch模式)')
     parser.add_argument('--delay', type=float, default=1, help='延迟时间(秒)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='K线批量写入每批行数')
+    parser.add_argument('--workers', type=int, default=1, help='并发 worker 数(批量模式)')
+    parser.add_argument('--ef-rate', type=float, default=2.0, help='efinance 请求速率上限(次/秒)')
+    parser.add_argument('--ak-rate', type=float, default=1.0, help='akshare 请求速率上限(次/秒)')
+    parser.add_argument('--run-id', type=str,
+                       help='批次标识,默认续跑同模式最近未完成批次,否则 模式-日期;同批次重跑跳过已完成股票')
+    parser.add_argument('--restart', action='store_true', help='忽略已有进度,全部重新处理')
+    parser.add_argument('--fetch-chunk', type=int, default=50,
+                       help='批量取K线每块股票数(多代码接口+keep-alive), <=1 时逐只获取')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出报告(report模式)')
+    parser.add_argument('--cached', action='store_true', help='直接使用覆盖度缓存表,不重新分组统计(report模式)')
     
     args = parser.parse_args()
     
-    supplementer = HistoricalDataSupplementer()
+    supplementer = HistoricalDataSupplementer(batch_size=args.batch_size,
+                                              ef_rate=args.ef_rate, ak_rate=args.ak_rate)
+    pool_options = dict(workers=args.workers, run_id=args.run_id, resume=not args.restart,
+                        fetch_chunk=args.fetch_chunk)
     
     try:
         if args.action == 'report':
             # 生成报告
-            supplementer.generate_report()
+            supplementer.generate_report(as_json=args.json, refresh=not args.cached)
         
         elif args.action == 'single':
             # 补充单只股票
@@ -502,7 +717,8 @@ async def main():
             await supplementer.supplement_batch(
                 mode=args.mode,
                 max_stocks=args.max,
-                delay=args.delay
+                delay=args.delay,
+                **pool_options
             )
         
         elif args.action == 'watch':
@@ -518,7 +734,8 @@ async def main():
             await supplementer.supplement_batch(
                 stock_codes=watch_codes,
                 mode=args.mode,
-                delay=args.delay
+                delay=args.delay,
+                **pool_options
             )
         
         elif args.action == 'all':
@@ -529,7 +746,8 @@ async def main():
                 stock_codes=all_codes,
                 mode=args.mode,
                 max_stocks=args.max,
-                delay=args.delay
+                delay=args.delay,
+                **pool_options
             )
         
     finally:
@@ -537,15 +755,18 @@ async def main():
 
 
 if __name__ == "__main__":
-    print("""
+    # JSON 输出时 stdout 只保留报告本身
+    if '--json' not in sys.argv:
+        print("""
 ╔══════════════════════════════════════════════════════════════╗
 ║          历史数据补充工具 v1.0                               ║
 ╚══════════════════════════════════════════════════════════════╝
 
 使用示例:
 
-1. 生成统计报告
+1. 生成统计报告 (--json 输出给监控采集, --cached 使用覆盖度缓存)
    python supplement_history.py report
+   python supplement_history.py report --json
 
 2. 补充单只股票 (全量模式)
    python supplement_history.py single --code 600036
@@ -562,10 +783,16 @@ if __name__ == "__main__":
 6. 批量补充所有股票 (慢速,延迟2秒)
    python supplement_history.py all --delay 2
 
+7. 8 个并发 worker 补充所有股票 (中断后重跑自动跳过已完成)
+   python supplement_history.py all --workers 8 --delay 0 --ef-rate 4 --ak-rate 2
+
 参数说明:
   --mode: full(全量), incremental(增量), append(追加)
   --max: 限制处理数量
   --delay: 每只股票延迟(秒),避免请求过快
+  --batch-size: K线批量写入每批行数
+  --workers: 并发 worker 数; --ef-rate/--ak-rate: 各数据源限速(次/秒)
+  --run-id: 批次标识; --restart: 忽略进度重新处理
 
 """)
     
@@ -0,0 +1,56 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from services.adjustment import adjust_prices, derive_factors
+
+DAYS = [datetime.date(2024, 6, d) for d in (3, 4, 5, 6)]
+
+
+def test_no_events_gives_only_base_factor():
+    assert derive_factors(DAYS[:3], [10.0, 10.2, 10.1], [0.0, 0.2, -0.1]) == [(DAYS[0], 1.0)]
+
+
+def test_cash_dividend():
+    # 6/5 每股派 0.5 元：除权参考昨收 9.7，收 9.6，涨跌额 -0.1
+    rows = derive_factors(DAYS[:3], [10.0, 10.2, 9.6], [0.0, 0.2, -0.1])
+    assert rows[0] == (DAYS[0], 1.0)
+    assert rows[1][0] == DAYS[2]
+    assert rows[1][1] == pytest.approx(10.2 / 9.7)
+    assert len(rows) == 2
+
+
+def test_bonus_share_split():
+    # 6/4 10送10：昨收 20，除权参考昨收 10，收 10.5，涨跌额 0.5
+    rows = derive_factors(DAYS[:3], [20.0, 10.5, 10.4], [0.1, 0.5, -0.1])
+    assert rows == [(DAYS[0], 1.0), (DAYS[1], pytest.approx(2.0))]
+
+    # 前复权后除权缺口消失：6/3 的 20 元换算为 10 元
+    factor_days, factor_values = zip(*rows)
+    adjusted = adjust_prices(np.array([20.0, 10.5, 10.4]), np.array(DAYS[:3], dtype="datetime64[D]"),
+                             np.array(factor_days, dtype="datetime64[D]"), factor_values, "qfq")
+    assert adjusted == pytest.approx([10.0, 10.5, 10.4])
+
+
+def test_incremental_run_continues_from_prev_factor():
+    # 已存最后一根收盘 20、因子 1.5；新K线首日即 10送10 除权日
+    rows = derive_factors(DAYS[1:3], [10.5, 10.6], [0.5, 0.1], prev_close=20.0, prev_factor=1.5)
+    assert rows == [(DAYS[1], pytest.approx(3.0))]
+
+
+def test_incremental_run_without_events_adds_nothing():
+    assert derive_factors(DAYS[1:3], [20.2, 20.1], [0.2, -0.1], prev_close=20.0, prev_factor=1.5) == []
+
+
+def test_missing_change_amount_is_skipped():
+    # 涨跌额缺失的K线无法判断是否除权，不生成因子行，也不影响后续K线的判断
+    closes = [20.0, 10.5, 10.4, 5.3]
+    changes = [0.1, None, np.nan, 0.1]
+    rows = derive_factors(DAYS, closes, changes)
+    assert rows == [(DAYS[0], 1.0), (DAYS[3], pytest.approx(10.4 / 5.2))]
+
+
+def test_empty_input():
+    assert derive_factors([], [], []) == []
+    assert derive_factors([], [], [], prev_close=10.0) == []
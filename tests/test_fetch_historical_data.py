@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import services.stock_service as stock_module
+from core.database import Base
+from models.stock import AdjustmentFactor, HistoricalData
+from services.rate_limiter import AIMDRateController
+
+CODE = "600000"
+DAYS = [d.date() for d in pd.bdate_range("2023-01-02", periods=300)]
+
+
+def kline(day, close, change):
+    return f"{day:%Y-%m-%d},{close},{close},{close},{close},1000,10000,1.0,0.1,{change},0.5"
+
+
+@pytest.fixture
+def service(monkeypatch):
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(stock_module, "SessionLocal", sessionmaker(bind=engine))
+
+    calendar = stock_module.trading_calendar
+    monkeypatch.setattr(calendar, "bars_missing", lambda last_bar_date, now=None: 1)
+    monkeypatch.setattr(calendar, "last_trading_day", lambda day=None: DAYS[-1])
+    monkeypatch.setattr(calendar, "shift_trading_days", lambda day, n: day - datetime.timedelta(days=n))
+
+    svc = stock_module.StockDataService()
+    svc.settings = svc.settings.model_copy(update={"PRICE_STORE_ENABLED": False, "KLINE_INCREMENTAL": True})
+    svc.rate_controller = AIMDRateController(initial_rate=1000, max_rate=1000)
+    svc.requests = []
+    return svc
+
+
+def session():
+    return stock_module.SessionLocal()
+
+
+def seed(days, with_factor):
+    db = session()
+    db.add_all(HistoricalData(stock_code=CODE, date=d, open=10, close=10, high=10, low=10,
+                              change_amount=0) for d in days)
+    if with_factor:
+        db.add(AdjustmentFactor(stock_code=CODE, date=days[0], hfq_factor=1.0))
+    db.commit()
+    db.close()
+
+
+def stored(model):
+    db = session()
+    try:
+        return db.query(func.count(model.id), func.min(model.date)).filter(
+            model.stock_code == CODE).one()
+    finally:
+        db.close()
+
+
+def serve(svc, klines):
+    def request_kline(code, beg="0", lmt=120, end="20500101"):
+        svc.requests.append((beg, lmt))
+        return [k for k in klines if k[:10].replace("-", "") >= beg] if beg != "0" else klines
+    svc._request_kline = request_kline
+
+
+def test_legacy_history_is_rebuilt_over_the_stored_range(service):
+    seed(DAYS, with_factor=False)
+    serve(service, [kline(d, 10, 0) for d in DAYS])
+
+    asyncio.run(service.fetch_historical_data(CODE))
+
+    assert service.requests == [(f"{DAYS[0]:%Y%m%d}", None)]
+    assert stored(HistoricalData) == (300, DAYS[0])
+    assert stored(AdjustmentFactor)[0] == 1
+
+
+def test_rebuild_keeps_history_when_source_returns_a_shorter_range(service):
+    seed(DAYS, with_factor=False)
+    serve(service, [kline(d, 10, 0) for d in DAYS[-120:]])
+
+    asyncio.run(service.fetch_historical_data(CODE))
+
+    assert stored(HistoricalData) == (300, DAYS[0])
+    assert stored(AdjustmentFactor)[0] == 0
+
+
+def test_ex_dividend_appends_a_factor_without_rewriting_history(service):
+    seed(DAYS[:-1], with_factor=True)
+    # 最后一个交易日每股派 0.5 元：昨收 10，除权参考昨收 9.5
+    serve(service, [kline(DAYS[-2], 10, 0), kline(DAYS[-1], 9.6, 0.1)])
+
+    asyncio.run(service.fetch_historical_data(CODE))
+
+    assert service.requests == [(f"{DAYS[-2]:%Y%m%d}", None)]
+    assert stored(HistoricalData) == (300, DAYS[0])
+    db = session()
+    factors = db.query(AdjustmentFactor.date, AdjustmentFactor.hfq_factor).order_by(AdjustmentFactor.date).all()
+    db.close()
+    assert [d for d, _ in factors] == [DAYS[0], DAYS[-1]]
+    assert factors[-1][1] == pytest.approx(10 / 9.5)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from services.price_store import PriceStore
+
+
+def bars(days, value=1.0):
+    array = np.full((len(days), len(PriceStore.COLUMNS)), value)
+    array[:, PriceStore.DATE] = days
+    return array
+
+
+def test_append_after_last_bar_writes_in_place(tmp_path):
+    store = PriceStore(str(tmp_path))
+    # 999 -> 1001 行，头部中的行数多一位
+    store.write("600000", bars(range(999)))
+    size = (tmp_path / "600000.npy").stat().st_size
+
+    store.append("600000", bars([999, 1000], 2.0))
+
+    array = store.load("600000")
+    assert array.shape == (1001, 6)
+    assert array[-2:, PriceStore.CLOSE].tolist() == [2.0, 2.0]
+    assert (tmp_path / "600000.npy").stat().st_size == size + 2 * 6 * 8
+
+
+def test_append_overlapping_bars_replaces_existing_rows(tmp_path):
+    store = PriceStore(str(tmp_path))
+    store.write("600000", bars(range(10)))
+
+    store.append("600000", bars([5, 10], 3.0))
+
+    array = store.load("600000")
+    assert array[:, PriceStore.DATE].tolist() == list(range(11))
+    assert array[5, PriceStore.CLOSE] == 3.0
+    assert array[10, PriceStore.CLOSE] == 3.0
+
+
+def test_append_creates_missing_file(tmp_path):
+    store = PriceStore(str(tmp_path))
+    store.append("600000", bars([1, 2]))
+    assert store.load("600000").shape == (2, 6)
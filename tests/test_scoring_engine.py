@@ -0,0 +1,141 @@
+import math
+
+import pytest
+
+from services.scoring_engine import dividend_points, growth_points, valuation_points, volatility_points
+
+
+# 向量化之前 StockService._calc_*_score 的 if/elif 分档，作为对照
+def ladder_volatility(v30):
+    if v30 <= 0:
+        return 0
+    if v30 < 20:
+        return 30
+    elif v30 < 30:
+        return 22
+    elif v30 < 40:
+        return 14
+    elif v30 < 55:
+        return 8
+    else:
+        return 3
+
+
+def ladder_dividend(div_yield):
+    if div_yield >= 6:
+        return 25
+    elif div_yield >= 4:
+        return 20
+    elif div_yield >= 2.5:
+        return 14
+    elif div_yield >= 1.2:
+        return 8
+    else:
+        return 0
+
+
+def ladder_growth(roe, profit_growth):
+    if roe >= 20:
+        roe_score = 15
+    elif roe >= 15:
+        roe_score = 12
+    elif roe >= 10:
+        roe_score = 9
+    elif roe >= 6:
+        roe_score = 5
+    elif roe > 0:
+        roe_score = 2
+    else:
+        roe_score = 0
+
+    if profit_growth >= 30:
+        growth_sub = 10
+    elif profit_growth >= 15:
+        growth_sub = 8
+    elif profit_growth >= 5:
+        growth_sub = 5
+    elif profit_growth >= 0:
+        growth_sub = 2
+    else:
+        growth_sub = 0
+    return roe_score + growth_sub
+
+
+def ladder_valuation(pe, pb):
+    pe_score = 0
+    pb_score = 0
+    if pe is not None and pe > 0:
+        if pe < 10:
+            pe_score = 12
+        elif pe < 18:
+            pe_score = 10
+        elif pe < 28:
+            pe_score = 7
+        elif pe < 40:
+            pe_score = 4
+        elif pe < 60:
+            pe_score = 2
+    if pb is not None and pb > 0:
+        if pb < 1.0:
+            pb_score = 8
+        elif pb < 2.0:
+            pb_score = 6
+        elif pb < 3.5:
+            pb_score = 4
+        elif pb < 6.0:
+            pb_score = 2
+    return pe_score + pb_score
+
+
+def around(*edges):
+    """每个分档边界本身及其两侧"""
+    values = [-1.0, 0.0]
+    for edge in edges:
+        values += [edge - 0.01, edge, edge + 0.01]
+    return values + [1000.0]
+
+
+VOLATILITY_CASES = around(20, 30, 40, 55)
+DIVIDEND_CASES = around(1.2, 2.5, 4, 6)
+ROE_CASES = around(6, 10, 15, 20)
+GROWTH_CASES = around(0, 5, 15, 30)
+PE_CASES = around(10, 18, 28, 40, 60)
+PB_CASES = around(1.0, 2.0, 3.5, 6.0)
+
+
+@pytest.mark.parametrize("v30", VOLATILITY_CASES)
+def test_volatility_points_matches_ladder(v30):
+    assert volatility_points(v30) == ladder_volatility(v30)
+
+
+@pytest.mark.parametrize("div_yield", DIVIDEND_CASES)
+def test_dividend_points_matches_ladder(div_yield):
+    assert dividend_points(div_yield) == ladder_dividend(div_yield)
+
+
+@pytest.mark.parametrize("roe", ROE_CASES)
+@pytest.mark.parametrize("profit_growth", GROWTH_CASES)
+def test_growth_points_matches_ladder(roe, profit_growth):
+    assert growth_points(roe, profit_growth) == ladder_growth(roe, profit_growth)
+
+
+@pytest.mark.parametrize("pe", PE_CASES + [None])
+@pytest.mark.parametrize("pb", PB_CASES + [None])
+def test_valuation_points_matches_ladder(pe, pb):
+    assert valuation_points(pe, pb) == ladder_valuation(pe, pb)
+
+
+def test_vectorized_call_matches_scalar_calls():
+    assert volatility_points(VOLATILITY_CASES).tolist() == [ladder_volatility(v) for v in VOLATILITY_CASES]
+    assert dividend_points(DIVIDEND_CASES).tolist() == [ladder_dividend(d) for d in DIVIDEND_CASES]
+
+
+@pytest.mark.parametrize("missing", [None, math.nan])
+def test_missing_values_score_zero(missing):
+    assert volatility_points(missing) == 0
+    assert dividend_points(missing) == 0
+    assert growth_points(missing, missing) == 0
+    assert growth_points(20, missing) == 15
+    assert growth_points(missing, 30) == 10
+    assert valuation_points(missing, missing) == 0
+    assert valuation_points(5, missing) == 12